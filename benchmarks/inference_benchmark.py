@@ -0,0 +1,40 @@
+"""
+Latency of selecting one action with the agent only network of NN_handler, for every inference backend.
+usage: python benchmarks/inference_benchmark.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+import tensorflow as tf
+from config import Config
+from NN_utils import NN_handler
+
+N_CALLS = 2000
+BACKENDS = ["keras", "tf_function", "numpy"]
+
+
+def time_per_call(predict, state):
+    for _ in range(20):  # warm up (tracing, first call allocations)
+        predict(state)
+    start = time.perf_counter()
+    for _ in range(N_CALLS):
+        np.argmax(predict(state))
+    return (time.perf_counter() - start) / N_CALLS
+
+
+if __name__ == "__main__":
+    config = Config()
+    nn_handler = NN_handler(config)
+    network = nn_handler.init_network_agent_only(tf.keras.optimizers.Adam())
+    state = np.random.default_rng(0).standard_normal((1, config.AGENT_INPUT_SIZE))
+
+    reference = network.predict(state, verbose=0)
+    for backend in BACKENDS:
+        predict = nn_handler.create_inference_function(network, backend)
+        assert np.allclose(predict(state), reference, atol=1e-5), backend
+        print(f"{backend:>12}: {time_per_call(predict, state) * 1e6:10.1f} us per action")
@@ -0,0 +1,51 @@
+"""
+Latency of NumpyMlpPolicy.act (the PPO MlpPolicy without torch) per batch size, against PPO.predict when
+stable_baselines3 is installed.
+usage: python benchmarks/policy_serving_benchmark.py [model.zip]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from policy_server import NumpyMlpPolicy
+
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "experiments",
+                                  "24_08_2024-19_45_30Car_2_Random_Side", "model.zip")
+BATCH_SIZES = [1, 64, 1024]
+N_CALLS = 2000
+
+
+def time_per_call(act, observations):
+    for _ in range(20):  # warm up
+        act(observations)
+    start = time.perf_counter()
+    for _ in range(N_CALLS):
+        act(observations)
+    return (time.perf_counter() - start) / N_CALLS
+
+
+if __name__ == "__main__":
+    model_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_MODEL_PATH
+    start = time.perf_counter()
+    policy = NumpyMlpPolicy.load(model_path)
+    print(f"NumpyMlpPolicy loaded in {(time.perf_counter() - start) * 1e3:.1f} ms")
+    try:
+        from stable_baselines3 import PPO
+        model = PPO.load(model_path, device="cpu")
+    except ImportError:
+        model = None
+        print("stable_baselines3 is not installed, timing NumpyMlpPolicy only")
+
+    rng = np.random.default_rng(0)
+    for batch_size in BATCH_SIZES:
+        observations = rng.standard_normal((batch_size, policy.observation_size)).astype(np.float32) * 20
+        line = f"batch {batch_size:>5}: numpy {time_per_call(policy.act, observations) * 1e6:9.1f} us"
+        if model is not None:
+            sb3_actions, _ = model.predict(observations, deterministic=True)
+            assert np.array_equal(sb3_actions, policy.act(observations))
+            sb3_time = time_per_call(lambda x: model.predict(x, deterministic=True), observations)
+            line += f" | PPO.predict {sb3_time * 1e6:9.1f} us"
+        print(line)
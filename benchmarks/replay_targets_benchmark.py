@@ -0,0 +1,61 @@
+"""
+Compare the vectorized DQN / Double-DQN target computation of RL.replay against the original per-transition loop.
+usage: python benchmarks/replay_targets_benchmark.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from rl import RL
+
+TRANSITION_AMOUNTS = [10_000, 100_000, 1_000_000]
+N_ACTIONS = 2
+GAMMA = 0.999
+
+
+def loop_q_targets(target, target_next, target_val, action, reward, done, gamma, ddqn):
+    """ The target computation as it was done in RL.replay before vectorization """
+    for index in range(len(action)):
+        if done[index]:
+            target[index][action[index]] = reward[index]
+        else:
+            if ddqn:  # Double - DQN
+                a = np.argmax(target_next[index])
+                target[index][action[index]] = reward[index] + gamma * target_val[index][a]
+            else:  # Standard - DQN
+                target[index][action[index]] = reward[index] + gamma * np.amax(target_next[index])
+    return target
+
+
+def make_batch(n_transitions, rng):
+    target = rng.standard_normal((n_transitions, N_ACTIONS)).astype(np.float32)
+    target_next = rng.standard_normal((n_transitions, N_ACTIONS)).astype(np.float32)
+    target_val = rng.standard_normal((n_transitions, N_ACTIONS)).astype(np.float32)
+    action = rng.integers(0, N_ACTIONS, n_transitions)
+    reward = rng.standard_normal(n_transitions)
+    done = rng.random(n_transitions) < 0.05
+    return target, target_next, target_val, action, reward, done
+
+
+def time_function(function, batch, ddqn):
+    target, target_next, target_val, action, reward, done = batch
+    target = target.copy()
+    start = time.perf_counter()
+    result = function(target, target_next, target_val, action, reward, done, GAMMA, ddqn)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    for ddqn in [True, False]:
+        print(f"{'Double-DQN' if ddqn else 'DQN'} targets")
+        for n_transitions in TRANSITION_AMOUNTS:
+            batch = make_batch(n_transitions, rng)
+            loop_time, loop_result = time_function(loop_q_targets, batch, ddqn)
+            vectorized_time, vectorized_result = time_function(RL.compute_q_targets, batch, ddqn)
+            assert np.allclose(loop_result, vectorized_result)
+            print(f"  {n_transitions:>9} transitions: loop {loop_time * 1e3:9.2f} ms | "
+                  f"vectorized {vectorized_time * 1e3:7.2f} ms | speedup x{loop_time / vectorized_time:.0f}")
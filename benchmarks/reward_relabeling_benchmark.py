@@ -0,0 +1,80 @@
+"""
+Throughput of RewardRelabeler.relabel over a recorded trajectory, against calling RL.calculate_reward step by step,
+for every reward variant. The recording is synthetic (random car1 states, 1% collisions) unless a
+trajectories directory is given.
+usage: python benchmarks/reward_relabeling_benchmark.py [experiments/<run>/trajectories]
+"""
+import os
+import sys
+import tempfile
+import time
+import types
+
+import numpy as np
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIRECTORY, ".."))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIRECTORY, "..", "utils"))
+from config import Config
+from reward_relabeling import RewardRelabeler, reward_config
+from rl import RL
+from trajectory_store import TrajectoryRecorder, TrajectoryStore
+
+N_STEPS = 2000000
+EPISODE_LENGTH = 200
+N_SCALAR_STEPS = 100000  # the step by step loop is timed on a prefix
+REWARD_SPECS = {
+    "default": {},
+    "safety_distance": {'REWARD_SAFETY_DISTANCE': True},
+    "same_action": {'REWARD_SAME_ACTION': True},
+}
+
+
+def record_synthetic_trajectories(directory):
+    rng = np.random.default_rng(0)
+    recorder = TrajectoryRecorder(directory, 4)
+    for _ in range(N_STEPS // EPISODE_LENGTH):
+        states = rng.uniform(-30, 30, (EPISODE_LENGTH, 4))
+        next_states = states + rng.normal(0, 1, states.shape)
+        collisions = rng.random(EPISODE_LENGTH) < 0.01
+        cars_distances = rng.uniform(0, 2500, EPISODE_LENGTH)  # squared meters, around SAFETY_DISTANCE_FOR_*
+        recorder.append_episode(states, rng.integers(0, 2, EPISODE_LENGTH), np.zeros(EPISODE_LENGTH), next_states,
+                                collisions, collisions, cars_distances)
+    recorder.close()
+
+
+if __name__ == "__main__":
+    config = Config()
+    config.AGENT_ONLY = True
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        if len(sys.argv) > 1:
+            trajectories_directory = sys.argv[1]
+        else:
+            trajectories_directory = os.path.join(temporary_directory, "trajectories")
+            record_synthetic_trajectories(trajectories_directory)
+        store = TrajectoryStore(trajectories_directory)
+        relabeler = RewardRelabeler(config, store)
+        print(f"{len(store)} steps in {store.n_episodes} episodes")
+
+        n_scalar_steps = min(N_SCALAR_STEPS, len(store))
+        for spec_name, reward_spec in REWARD_SPECS.items():
+            start = time.perf_counter()
+            rewards = relabeler.relabel(reward_spec)
+            relabel_time = time.perf_counter() - start
+
+            # RL.calculate_reward only reads the config
+            rl = types.SimpleNamespace(config=reward_config(config, reward_spec))
+            next_states, collisions, actions = store.next_state[:n_scalar_steps], store.collision[:n_scalar_steps], \
+                store.action[:n_scalar_steps]
+            cars_distances = store.cars_distance[:n_scalar_steps]
+            start = time.perf_counter()
+            scalar_rewards = [RL.calculate_reward(rl, next_states[step], collisions[step],
+                                                  next_states[step, 0] > config.CAR1_DESIRED_POSITION[0],
+                                                  actions[step], config.CAR2_CONSTANT_ACTION, cars_distances[step])
+                              for step in range(n_scalar_steps)]
+            scalar_time = time.perf_counter() - start
+            assert np.allclose(rewards[:n_scalar_steps], scalar_rewards)
+
+            print(f"{spec_name:>16}: relabel {len(store) / relabel_time / 1e6:7.1f} M steps/s | "
+                  f"calculate_reward {n_scalar_steps / scalar_time / 1e6:7.2f} M steps/s | "
+                  f"mean episode reward {relabeler.episode_rewards(rewards).mean():8.2f}")
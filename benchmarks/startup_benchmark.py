@@ -0,0 +1,47 @@
+"""
+Import time, resident memory and frameworks loaded by importing each module of utils, every one in a fresh process.
+Importing a module should not load TensorFlow / torch until one of its functions actually uses them.
+usage: python benchmarks/startup_benchmark.py [module ...]
+"""
+import json
+import os
+import subprocess
+import sys
+
+UTILS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils")
+MODULES = ["logger", "NN_utils", "rl", "replay_buffer", "airsim_manager", "training_loop", "actor_learner",
+           "intersection_simulator", "intersection_vec_env", "parallel_rollouts"]
+FRAMEWORKS = ["tensorflow", "torch", "stable_baselines3", "matplotlib", "airsim"]
+
+# runs in the fresh process: import the module, report the import time, peak RSS and which frameworks got loaded
+MEASURE_IMPORT = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+import_time = time.perf_counter() - start
+print(json.dumps({{
+    "import_time": import_time,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "frameworks": [framework for framework in {frameworks} if framework in sys.modules],
+}}))
+"""
+
+
+def measure_import(module):
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join([UTILS_DIRECTORY, os.path.join(UTILS_DIRECTORY, "..")]))
+    completed = subprocess.run([sys.executable, "-c", MEASURE_IMPORT.format(module=module, frameworks=FRAMEWORKS)],
+                               capture_output=True, text=True, env=environment)
+    if completed.returncode != 0:
+        return None, completed.stderr.strip().splitlines()[-1]
+    return json.loads(completed.stdout.strip().splitlines()[-1]), None
+
+
+if __name__ == "__main__":
+    print(f"{'module':>24} | {'import':>9} | {'peak RSS':>9} | frameworks loaded")
+    for module in sys.argv[1:] or MODULES:
+        result, error = measure_import(module)
+        if error is not None:
+            print(f"{module:>24} | failed: {error}")
+            continue
+        print(f"{module:>24} | {result['import_time'] * 1e3:>6.0f} ms | {result['peak_rss_mb']:>6.0f} MB | "
+              f"{', '.join(result['frameworks']) or '-'}")
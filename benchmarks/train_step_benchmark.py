@@ -0,0 +1,136 @@
+"""
+Time per gradient step of the replay training of the agent only network (REPLAY_BATCH_SIZE rows per replay, fit's
+minibatches of 32) for every NN_handler.create_train_function backend, against an eager GradientTape step (RL.apply_gradients) and with
+the mixed_bfloat16 policy. Before timing, one step of every compiled backend is checked against model.fit.
+The same for the trajectory training of RL.train_trajectory (TRAJECTORY_LENGTH rows, one gradient step per
+trajectory): NN_handler.create_trajectory_train_function against the eager RL.apply_gradients step.
+usage: python benchmarks/train_step_benchmark.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+import tensorflow as tf
+from config import Config
+from NN_utils import NN_handler
+
+N_CALLS = 500
+TRAJECTORY_LENGTH = 57  # not a power of two, so the compiled steps also pay for their padding
+MINIBATCH_SIZE = 32  # model.fit default batch_size, used by RL.replay
+VARIANTS = [  # (name, backend, mixed precision)
+    ("model.fit", "keras", False),
+    ("eager tape", "eager", False),
+    ("tf_function", "tf_function", False),
+    ("xla", "xla", False),
+    ("xla bfloat16", "xla", True),
+]
+
+
+def create_network(nn_handler, weights, mixed_precision):
+    nn_handler.config.MIXED_PRECISION = mixed_precision
+    network = nn_handler.init_network_agent_only(tf.keras.optimizers.legacy.Adam(learning_rate=1e-3))
+    network.set_weights(weights)
+    return network
+
+
+def create_eager_train_function(network):
+    """ An eager GradientTape step per minibatch, as RL.train_trajectory / RL.apply_gradients do """
+    def train(inputs, targets, sample_weight=None, epochs=1):
+        losses = []
+        for start in range(0, len(targets), MINIBATCH_SIZE):
+            with tf.GradientTape() as tape:
+                predictions = network(inputs[start:start + MINIBATCH_SIZE], training=True)
+                loss = tf.reduce_mean(tf.keras.losses.mean_squared_error(targets[start:start + MINIBATCH_SIZE],
+                                                                         predictions))
+            gradients = tape.gradient(loss, network.trainable_variables)
+            network.optimizer.apply_gradients(zip(gradients, network.trainable_variables))
+            losses.append(float(loss))
+        return np.mean(losses)
+
+    return train
+
+
+def create_eager_trajectory_train_function(network):
+    """ RL.apply_gradients: the gradients of the summed per-row loss of the trajectory """
+    def train(inputs, targets):
+        with tf.GradientTape() as tape:
+            loss = tf.keras.losses.mean_squared_error(targets, network(inputs))
+        gradients = tape.gradient(loss, network.trainable_variables)
+        network.optimizer.apply_gradients(zip(gradients, network.trainable_variables))
+        return float(np.mean(loss)), gradients
+
+    return train
+
+
+def create_trajectory_train_function(nn_handler, network, backend):
+    if backend == "eager":
+        return create_eager_trajectory_train_function(network)
+    return nn_handler.create_trajectory_train_function(network, backend)
+
+
+def create_train_function(nn_handler, network, backend, minibatch_size=MINIBATCH_SIZE):
+    if backend == "eager":
+        return create_eager_train_function(network)
+    return nn_handler.create_train_function(network, backend, minibatch_size)
+
+
+def time_per_call(train, states, targets):
+    for _ in range(10):  # warm up (tracing, XLA compilation)
+        train(states, targets)
+    start = time.perf_counter()
+    for _ in range(N_CALLS):
+        train(states, targets)
+    return (time.perf_counter() - start) / N_CALLS
+
+
+if __name__ == "__main__":
+    config = Config()
+    nn_handler = NN_handler(config)
+    rng = np.random.default_rng(0)
+    states = rng.standard_normal((config.REPLAY_BATCH_SIZE, config.AGENT_INPUT_SIZE)).astype(np.float32)
+    targets = rng.standard_normal((config.REPLAY_BATCH_SIZE, 2)).astype(np.float32)
+    initial_weights = nn_handler.init_network_agent_only(tf.keras.optimizers.legacy.Adam()).get_weights()
+
+    # one full batch step from the same weights has to give the same weights as model.fit
+    reference = create_network(nn_handler, initial_weights, mixed_precision=False)
+    reference.fit(states, targets, batch_size=len(states), epochs=1, verbose=0)
+    for name, backend, mixed_precision in VARIANTS[2:]:
+        network = create_network(nn_handler, initial_weights, mixed_precision)
+        create_train_function(nn_handler, network, backend, minibatch_size=len(states))(states, targets)
+        tolerance = 1e-2 if mixed_precision else 1e-5
+        for weights, reference_weights in zip(network.get_weights(), reference.get_weights()):
+            assert np.allclose(weights, reference_weights, atol=tolerance), name
+
+    n_steps_per_call = -(-config.REPLAY_BATCH_SIZE // MINIBATCH_SIZE)
+    baseline_time = None
+    for name, backend, mixed_precision in VARIANTS:
+        network = create_network(nn_handler, initial_weights, mixed_precision)
+        train = create_train_function(nn_handler, network, backend)
+        step_time = time_per_call(train, states, targets) / n_steps_per_call
+        baseline_time = baseline_time or step_time
+        print(f"{name:>14}: {step_time * 1e6:9.1f} us per gradient step ({baseline_time / step_time:5.1f}x)")
+
+    print(f"train_trajectory ({TRAJECTORY_LENGTH} rows):")
+    trajectory_states, trajectory_targets = states[:TRAJECTORY_LENGTH], targets[:TRAJECTORY_LENGTH]
+    reference = create_network(nn_handler, initial_weights, mixed_precision=False)
+    reference_loss, _ = create_eager_trajectory_train_function(reference)(trajectory_states, trajectory_targets)
+    for name, backend, mixed_precision in VARIANTS[2:]:
+        network = create_network(nn_handler, initial_weights, mixed_precision)
+        loss, _ = nn_handler.create_trajectory_train_function(network, backend)(trajectory_states,
+                                                                                 trajectory_targets)
+        tolerance = 1e-2 if mixed_precision else 1e-5
+        assert np.isclose(loss, reference_loss, rtol=tolerance), name
+        for weights, reference_weights in zip(network.get_weights(), reference.get_weights()):
+            assert np.allclose(weights, reference_weights, atol=tolerance), name
+
+    baseline_time = None
+    for name, backend, mixed_precision in [("eager tape", "eager", False)] + VARIANTS[2:]:
+        network = create_network(nn_handler, initial_weights, mixed_precision)
+        train = create_trajectory_train_function(nn_handler, network, backend)
+        step_time = time_per_call(train, trajectory_states, trajectory_targets)
+        baseline_time = baseline_time or step_time
+        print(f"{name:>14}: {step_time * 1e6:9.1f} us per gradient step ({baseline_time / step_time:5.1f}x)")
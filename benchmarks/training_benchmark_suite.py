@@ -0,0 +1,258 @@
+"""
+Reproducible end-to-end training benchmarks, run against the local fake simulator (no AirSim server needed).
+Every workload runs with fixed seeds in a fresh process. Its ops/sec (median over the repeats) and the peak RSS of
+its process are compared with the stored baselines, and the run fails when ops/sec drops by more than the tolerance.
+Every baseline keeps the machine, CPU and Python it was measured on: compare on the same host.
+usage:
+    python benchmarks/training_benchmark_suite.py                          # all workloads, compared with baselines
+    python benchmarks/training_benchmark_suite.py replay_sampling_1M ...   # only the given workloads
+    python benchmarks/training_benchmark_suite.py --save-baseline          # store the results as the new baselines
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIRECTORY, ".."))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIRECTORY, "..", "utils"))
+from config import Config
+
+BASELINES_PATH = os.path.join(BENCHMARKS_DIRECTORY, "baselines.json")
+SEED = 0
+DQN_EPISODES = 5
+PPO_TIMESTEPS = 4096
+TARGET_UPDATE_CALLS = 5000
+REPLAY_SAMPLE_CALLS = 5000
+
+
+def seed_everything():
+    random.seed(SEED)
+    np.random.seed(SEED)
+
+
+def benchmark_config():
+    """ Config of every workload: the fake simulator in lockstep, so the episodes do not depend on wall time """
+    config = Config()
+    config.set_config({
+        'EXPERIMENT_ID': 'benchmark',
+        'AGENT_ONLY': True,
+        'SIMULATOR_BACKEND': 'fake',
+        'SIMULATION_STEPPING': 'lockstep',
+        'CAR2_INITIAL_DIRECTION': 1,
+        'LOG_ACTIONS_SELECTED': False,
+        'LOG_SAME_ACTION_SELECTED_IN_TRAJECTORY': False,
+        'LOG_CAR_STATES': False,
+        'LOG_Q_VALUES': False,
+    })
+    return config
+
+
+def create_rl(config):
+    import tensorflow as tf
+    from airsim_manager import AirsimManager
+    from logger import Logger
+    from NN_utils import NN_handler
+    from rl import RL
+    tf.random.set_seed(SEED)
+    return RL(config, Logger(config), AirsimManager(config), NN_handler(config))
+
+
+# Workloads: set up, then return a function that runs one timed round and returns the amount of ops it did
+def dqn_episodes_workload():
+    config = benchmark_config()
+    rl = create_rl(config)
+
+    def run_episodes():
+        steps = 0
+        for _ in range(DQN_EPISODES):
+            rl.airsim.reset_cars_to_initial_positions()
+            for _ in range(config.MAX_EPISODE_STEPS):
+                car1_state, car1_action, car1_next_state, collision_occurred, reached_target, reward = \
+                    rl.step_agent_only()
+                done = collision_occurred or reached_target
+                rl.memory.append(car1_state[:config.AGENT_INPUT_SIZE], car1_action, reward,
+                                 car1_next_state[:config.AGENT_INPUT_SIZE], done)
+                rl.replay()
+                rl.update_target_model()
+                steps += 1
+                if done:
+                    break
+            rl.updateEpsilon()
+        return steps
+    return run_episodes, "steps"
+
+
+def ppo_training_workload():
+    from stable_baselines3.common.utils import set_random_seed
+    from training_loop import model_training
+    config = benchmark_config()
+    config.set_config({
+        'SIMULATOR_BACKEND': 'vectorized',
+        'PPO_TRAINING_MODE': 'learn',
+        'TOTAL_TIMESTEPS': PPO_TIMESTEPS,
+        'MAX_EPISODES': PPO_TIMESTEPS,  # only TOTAL_TIMESTEPS stops the training
+    })
+
+    def run_training():
+        set_random_seed(SEED)
+        with tempfile.TemporaryDirectory() as path:
+            model_training(config, path)
+        return PPO_TIMESTEPS
+    return run_training, "timesteps"
+
+
+def target_update_workload():
+    rl = create_rl(benchmark_config())
+
+    def run_updates():
+        for _ in range(TARGET_UPDATE_CALLS):
+            rl.update_target_model()
+        return TARGET_UPDATE_CALLS
+    return run_updates, "updates"
+
+
+def replay_sampling_workload(buffer_size, prioritized):
+    from replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+    config = benchmark_config()
+    if prioritized:
+        memory = PrioritizedReplayBuffer(buffer_size, config.AGENT_INPUT_SIZE, config.PER_ALPHA, config.PER_BETA,
+                                         config.PER_BETA_INCREMENT, config.PER_EPSILON)
+    else:
+        memory = ReplayBuffer(buffer_size, config.AGENT_INPUT_SIZE)
+    # fill the buffer directly instead of appending transitions one by one
+    rng = np.random.default_rng(SEED)
+    memory.transitions["state"] = rng.standard_normal((buffer_size, config.AGENT_INPUT_SIZE))
+    memory.transitions["action"] = rng.integers(0, 2, buffer_size)
+    memory.transitions["reward"] = rng.standard_normal(buffer_size)
+    memory.transitions["next_state"] = rng.standard_normal((buffer_size, config.AGENT_INPUT_SIZE))
+    memory.transitions["done"] = rng.random(buffer_size) < 0.01
+    memory.size = buffer_size
+    if prioritized:
+        memory.sum_tree.update(np.arange(buffer_size), rng.random(buffer_size) + config.PER_EPSILON)
+
+    def run_sampling():
+        for _ in range(REPLAY_SAMPLE_CALLS):
+            memory.sample(config.REPLAY_BATCH_SIZE)
+        return REPLAY_SAMPLE_CALLS
+    return run_sampling, "minibatches"
+
+
+WORKLOADS = {
+    "dqn_episodes": dqn_episodes_workload,
+    "ppo_training": ppo_training_workload,
+    "target_update": target_update_workload,
+}
+for buffer_size, size_name in [(10_000, "10k"), (100_000, "100k"), (1_000_000, "1M")]:
+    WORKLOADS[f"replay_sampling_{size_name}"] = \
+        lambda buffer_size=buffer_size: replay_sampling_workload(buffer_size, prioritized=False)
+    WORKLOADS[f"prioritized_replay_sampling_{size_name}"] = \
+        lambda buffer_size=buffer_size: replay_sampling_workload(buffer_size, prioritized=True)
+
+
+def cpu_model():
+    """ e.g. "Intel(R) Xeon(R) Platinum 8488C" (platform.processor() only gives the architecture on Linux) """
+    if os.path.exists("/proc/cpuinfo"):
+        with open("/proc/cpuinfo") as cpuinfo_file:
+            for line in cpuinfo_file:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    return platform.processor()
+
+
+def host():
+    return {"machine": platform.platform(), "cpu": cpu_model(), "cpu_count": os.cpu_count(),
+            "python": platform.python_version()}
+
+
+def run_workload(workload_name, repeats):
+    """ Runs in a fresh process, so peak RSS and framework state belong to this workload only """
+    os.environ["MPLBACKEND"] = "Agg"  # the plots at the end of model_training are saved, not shown (blocking)
+    seed_everything()
+    with tempfile.TemporaryDirectory() as working_directory, open(os.devnull, "w") as devnull:
+        os.chdir(working_directory)  # the loggers write to experiments/... relative to the working directory
+        with contextlib.redirect_stdout(devnull):
+            run_round, unit = WORKLOADS[workload_name]()
+            ops_per_second = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                ops = run_round()
+                ops_per_second.append(ops / (time.perf_counter() - start))
+    return {
+        "unit": unit,
+        "ops_per_second": float(np.median(ops_per_second)),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # KB on Linux
+        "host": host(),
+    }
+
+
+def load_baselines():
+    if not os.path.exists(BASELINES_PATH):
+        return {}
+    with open(BASELINES_PATH) as baselines_file:
+        return json.load(baselines_file)["workloads"]
+
+
+def save_baselines(results):
+    workloads = load_baselines()
+    workloads.update(results)
+    with open(BASELINES_PATH, "w") as baselines_file:
+        json.dump({"workloads": workloads}, baselines_file, indent=2, sort_keys=True)
+        baselines_file.write("\n")
+
+
+def percent_change(value, baseline_value):
+    return (value - baseline_value) / baseline_value * 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fixed seed training workloads against the fake simulator")
+    parser.add_argument("workloads", nargs="*", default=list(WORKLOADS), help=f"any of {list(WORKLOADS)}")
+    parser.add_argument("--repeats", type=int, default=3, help="timed rounds per workload (the median is kept)")
+    parser.add_argument("--tolerance", type=float, default=10.0, help="allowed ops/sec drop in percent")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baselines")
+    args = parser.parse_args()
+
+    baselines = load_baselines()
+    results = {}
+    regressions = []
+    print(f"{'workload':>34} | {'ops/sec':>12} | {'vs baseline':>11} | {'peak RSS':>9} | {'vs baseline':>11}")
+    for workload_name in args.workloads:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            result = executor.submit(run_workload, workload_name, args.repeats).result()
+        results[workload_name] = result
+
+        ops_delta = memory_delta = "no baseline"
+        if workload_name in baselines:
+            baseline = baselines[workload_name]
+            ops_change = percent_change(result["ops_per_second"], baseline["ops_per_second"])
+            ops_delta = f"{ops_change:+.1f}%"
+            memory_delta = f"{percent_change(result['peak_rss_mb'], baseline['peak_rss_mb']):+.1f}%"
+            if ops_change < -args.tolerance:
+                regressions.append(workload_name)
+            if baseline.get("host", {}).get("cpu") != result["host"]["cpu"]:
+                print(f"{workload_name}: the baseline was measured on {baseline.get('host', {}).get('cpu')}, "
+                      f"this run on {result['host']['cpu']}")
+        print(f"{workload_name:>34} | {result['ops_per_second']:>12.1f} | {ops_delta:>11} | "
+              f"{result['peak_rss_mb']:>6.0f} MB | {memory_delta:>11}   ({result['unit']}/sec)")
+
+    if args.save_baseline:
+        save_baselines(results)
+        print(f"Saved baselines to {BASELINES_PATH}")
+    elif regressions:
+        print(f"Regressions (ops/sec more than {args.tolerance}% below baseline): {regressions}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
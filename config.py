@@ -1,4 +1,6 @@
 from datetime import datetime
+import json
+import os
 import numpy as np
 class Config:
 
@@ -8,9 +10,14 @@ class Config:
         self.EXPERIMENT_DATE_TIME = datetime.now().strftime("%d_%m_%Y-%H_%M_%S")
         self.WEIGHTS_TO_SAVE_NAME = "PPO_model"
         self.LOAD_WEIGHT_DIRECTORY = None
+        self.MAX_PARALLEL_EXPERIMENTS = 1  # experiments run by ExperimentScheduler at the same time
+        self.EXPERIMENT_RETRIES = 1  # a failed experiment is rerun (from its last checkpoint) up to this many times
 
         # Path Configuration
         self.SAVE_WEIGHT_DIRECTORY = f"experiments/{self.EXPERIMENT_DATE_TIME}_{self.EXPERIMENT_ID}"
+        self.CHECKPOINT_EVERY_X_EPISODES = 10  # to SAVE_WEIGHT_DIRECTORY/checkpoints, 0 -> no checkpoints
+        self.CHECKPOINTS_TO_KEEP = 2  # training resumes from LOAD_WEIGHT_DIRECTORY when it holds a checkpoint
+        self.RECORD_TRAJECTORIES = False  # every transition to SAVE_WEIGHT_DIRECTORY/trajectories, see TrajectoryStore
 
         # Training Configuration
         self.AGENT_ONLY = False
@@ -19,13 +26,32 @@ class Config:
         self.ALTERNATE_TRAINING_EPISODE_AMOUNT = 20
         self.MAX_EPISODES = 50
         self.MAX_STEPS = 10
+        self.MAX_EPISODE_STEPS = 2000  # truncation of the episodes of IntersectionVecEnv
         self.LEARNING_RATE = 0.0001
-        self.N_STEPS = 160
+        self.N_STEPS = 160  # per rollout worker
+        self.NUM_ROLLOUT_WORKERS = 1  # > 1 -> PPO collects from parallel simulators (one subprocess each)
+        self.TRAINING_ALGORITHM = "ppo"  # model_training: "ppo" - stable_baselines3 PPO (see PPO_TRAINING_MODE), "dqn" - RL with ActorLearner (AGENT_ONLY)
+        self.PPO_TRAINING_MODE = "episode_loop"  # "episode_loop" - learn after every collected episode, "learn" - PPO.learn collects the episodes (opt-in per experiment)
+        self.TOTAL_TIMESTEPS = 16000  # upper bound of "learn" mode, summed over workers (MAX_EPISODES also stops it)
         self.BATCH_SIZE = 160
         self.LOSS_FUNCTION = "mse"
         self.TIME_BETWEEN_STEPS = 0.005
         self.EPOCHS = 1
+        self.REPLAY_BUFFER_SIZE = 1000000  # transitions
+        self.REPLAY_BATCH_SIZE = 64  # None -> replay the whole buffer
+        self.ACTOR_LEARNER_QUEUE_SIZE = 10000  # transitions the actor may be ahead of the learner
+        self.ACTOR_MAX_WEIGHT_LAG = 10  # learner updates before the actor refreshes its weights snapshot
+        self.LEARNER_UPDATES_PER_TRANSITION = 1.0  # replay ratio: the learner waits for transitions beyond it
+        self.PRIORITIZED_REPLAY = False
+        self.PER_ALPHA = 0.6  # how much prioritization is used (0 -> uniform)
+        self.PER_BETA = 0.4  # initial importance sampling correction, annealed to 1
+        self.PER_BETA_INCREMENT = 0.001  # per sampled minibatch
+        self.PER_EPSILON = 0.01  # keeps transitions with zero TD error replayable
         self.ONLY_INFERENCE = False
+        self.PPO_INFERENCE_BACKEND = "numpy"  # ONLY_INFERENCE PPO: "numpy" - NumpyMlpPolicy (no torch), "sb3" - PPO.load
+        self.TRAIN_STEP_BACKEND = "keras"  # replay / train_trajectory: "keras" (model.fit / eager GradientTape step), "tf_function", "xla" (tf.function(jit_compile=True))
+        self.MIXED_PRECISION = False  # RL networks built with the mixed_bfloat16 Keras policy: bfloat16 compute, float32 weights and outputs (AVX512-BF16 / AMX CPUs)
+        self.INFERENCE_BACKEND = "keras"  # action selection: "keras" (model.predict), "tf_function", "numpy" (sequential networks, the master and agent network falls back to "tf_function")
         self.COPY_CAR1_NETWORK_TO_CAR2 = True
         self.COPY_CAR1_NETWORK_TO_CAR2_EPISODE_AMOUNT = 1
         self.CAR2_CONSTANT_ACTION = (0.75 + 0.5) / 2
@@ -33,6 +59,15 @@ class Config:
         self.CAR2_INITIAL_DIRECTION = 1
         self.FIXED_THROTTLE = (0.75 + 0.5) / 2
 
+        # Simulation Configuration
+        self.SIMULATOR_BACKEND = "airsim"  # "airsim" - Unreal AirSim server, "fake" - local kinematic simulator, "fake_server" - fake simulator behind AirSim's RPC server, "vectorized" - IntersectionVecEnv (PPO "learn" mode)
+        self.AIRSIM_IP = ""  # "" -> localhost
+        self.AIRSIM_PORT = 41451  # rollout worker i connects to AIRSIM_PORT + i
+        self.ASYNC_RPC = False  # pipeline the RPCs of both cars, RPC latencies are logged at the end of the run
+        self.SIMULATION_STEPPING = "sleep"  # "sleep" - wall clock TIME_BETWEEN_STEPS, "lockstep" - paused sim advanced by TIME_BETWEEN_STEPS
+        self.LOCKSTEP_POLL_INTERVAL = 0.0002  # seconds between simIsPause polls while the simulator advances
+        self.LOCKSTEP_TIMEOUT = 10.0  # seconds to wait for the simulator to pause again before raising
+
         # Logging Configuration
         self.LOG_WEIGHTS_AND_GRADIENTS_EVERY_X_EPISODES = 5
         self.LOG_ACTIONS_SELECTED = True
@@ -40,6 +75,12 @@ class Config:
         self.LOG_CAR_STATES = False
         self.LOG_Q_VALUES = False
         self.LOG_WEIGHTS_ARE_IDENTICAL = False
+        self.LOG_QUEUE_SIZE = 10000  # summaries waiting for the writer thread, more are dropped instead of blocking
+        self.LOG_FLUSH_INTERVAL = 5.0  # seconds between flushes of the TensorBoard files
+        self.LOG_SCALARS_EVERY_X_CALLS = 1  # sampling rate of every scalar (per log name)
+        self.LOG_HISTOGRAM_MAX_VALUES = 1000  # weights / gradients are strided down to this many values on device
+        self.LOG_CONSOLE_SUMMARY_EVERY_X_STEPS = 100  # per step console values are printed as periodic means
+        self.PROFILING = False  # per-phase latency histograms of the hot path, exported at the end of training
 
         # Cars Configuration
         self.CAR1_NAME = "Car1"
@@ -62,6 +103,10 @@ class Config:
         self.KEEPING_SAFETY_DISTANCE_REWARD = 2
         self.SAFETY_DISTANCE_FOR_PUNISH = 1200
         self.NOT_KEEPING_SAFETY_DISTANCE_REWARD = -2
+        self.REWARD_SAFETY_DISTANCE = False  # bonus / punish by the squared distance between the cars (SAFETY_DISTANCE_FOR_*, m^2)
+        self.REWARD_SAME_ACTION = False  # AGENT_ONLY: reward is DIFFERENT_ACTION_REWARD / SAME_ACTION_REWARD only
+        self.DIFFERENT_ACTION_REWARD = 15
+        self.SAME_ACTION_REWARD = -10
         self.EXPLORATION_EXPLOTATION_THRESHOLD = 2500
 
 
@@ -69,3 +114,10 @@ class Config:
         for attr_name, attr_value in config_dict.items():
             print(attr_name, attr_value)
             setattr(self, attr_name, attr_value)
+
+    def save(self, directory):
+        """ directory/config.json - the settings of the run, indexed by ResultsStore """
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "config.json"), "w") as config_file:
+            json.dump(vars(self), config_file, indent=2,
+                      default=lambda value: value.tolist() if isinstance(value, np.ndarray) else str(value))
@@ -2,6 +2,7 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from scipy.signal import lfilter
+from utils.results_store import ResultsStore
 
 
 def smooth(y, n=15):
@@ -112,6 +113,27 @@ def create_graph_of_global_experiment():
     plt.show()
 
 
+def create_graph_of_experiments(metric_name, experiments_directory="experiments", n_columns=2, **config_filters):
+    """ One subplot per experiment that logged metric_name, e.g.
+        create_graph_of_experiments("rollout/ep_rew_mean", EXPERIMENT_ID="Car_2_Random_Side") """
+    results = ResultsStore(experiments_directory).query(metric_name, **config_filters)
+    if not results:
+        print(f"No experiment logged {metric_name}")
+        return
+    n_rows = -(-len(results) // n_columns)
+    fig, axes = plt.subplots(n_rows, n_columns, squeeze=False, sharey=True, figsize=(6 * n_columns, 3 * n_rows))
+    for ax, (experiment, (steps, values)) in zip(axes.flat, results.items()):
+        ax.plot(steps, values)
+        ax.set_title(experiment, fontsize=9)
+        ax.set_xlabel('Step')
+        ax.set_ylabel(metric_name)
+        ax.grid(linestyle='dashed')
+    for ax in axes.flat[len(results):]:
+        ax.set_visible(False)
+    fig.tight_layout()
+    plt.show()
+
+
 if __name__ == '__main__':
     # create_graph_of_local_experiment()
     create_graph_of_global_experiment()
\ No newline at end of file
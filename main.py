@@ -1,7 +1,6 @@
 import config
-from utils.experiment import Experiment
-from utils.training_loop import *
-from training_loop import model_training
+from utils.experiment import Experiment, grid_sweep
+from experiment_scheduler import ExperimentScheduler
 
 if __name__ == "__main__":
     config_exp1 = {
@@ -27,11 +26,11 @@ if __name__ == "__main__":
     print("Setting up experiment...")
     experiment1 = Experiment(config_exp1)
     experiments = [experiment1]
-    for experiment in experiments:
-        print("Starting experiment")
-        config = config.Config()
-        config.set_config(experiment.config_dict)
-        print(config.SAVE_WEIGHT_DIRECTORY)
-        print("Config set up complete")
-        model_training(config, config.SAVE_WEIGHT_DIRECTORY)
-        print("Experiment completed.\n")
+    # experiments = [Experiment({**config_exp1, 'TRAINING_ALGORITHM': 'dqn'})]  # RL + ActorLearner instead of PPO
+    # experiments = grid_sweep(config_exp1, {'LEARNING_RATE': [1e-4, 3e-4], 'N_STEPS': [160, 320]})
+    default_config = config.Config()
+    scheduler = ExperimentScheduler(default_config.MAX_PARALLEL_EXPERIMENTS, default_config.EXPERIMENT_RETRIES)
+    print("Starting experiments")
+    for summary in scheduler.run(experiments):
+        print(summary["SAVE_WEIGHT_DIRECTORY"], summary["status"], summary.get("mean_reward"))
+    print("Experiments completed.\n")
@@ -1,12 +1,30 @@
+import contextlib
 import os
-from tensorflow import keras
 import numpy as np
-from stable_baselines3 import PPO
+from lazy_import import lazy_import
+from numpy_network import NumpyNetwork
+
+tf = lazy_import("tensorflow")
+keras = lazy_import("tensorflow", "keras")
 
 class NN_handler:
     def __init__(self, config):
         self.config = config
+    @contextlib.contextmanager
+    def dtype_policy(self):
+        """ Layers built inside use the mixed_bfloat16 policy if MIXED_PRECISION (bfloat16 compute, float32 weights),
+            the global policy is restored afterwards so networks built elsewhere are unaffected """
+        previous_policy = keras.mixed_precision.global_policy()
+        if self.config.MIXED_PRECISION:
+            keras.mixed_precision.set_global_policy("mixed_bfloat16")
+        try:
+            yield
+        finally:
+            keras.mixed_precision.set_global_policy(previous_policy)
     def init_network_master_and_agent(self, optimizer):
+        with self.dtype_policy():
+            return self.build_network_master_and_agent(optimizer)
+    def build_network_master_and_agent(self, optimizer):
         # Define master_input and agent_input
         master_input = keras.layers.Input(shape=(10,), name="master_input")
         agent_input = keras.layers.Input(shape=(5,), name="agent_input")
@@ -25,13 +43,16 @@ class NN_handler:
         agent_layer_3 = keras.layers.Dense(units=16, kernel_initializer='he_uniform', name="agent_layer_3")(agent_layer_2)
         agent_layer_3 = keras.layers.BatchNormalization()(agent_layer_3)
         agent_layer_3 = keras.layers.LeakyReLU()(agent_layer_3)
-        # Output layer
-        outputs = keras.layers.Dense(units=2, activation='linear', name="outputs")(agent_layer_3)
+        # Output layer (float32 under the mixed_bfloat16 policy as well, for numerically stable losses)
+        outputs = keras.layers.Dense(units=2, activation='linear', name="outputs", dtype="float32")(agent_layer_3)
         # Create the model
         model = keras.Model(inputs=[master_input, agent_input], outputs=outputs)
         model.compile(optimizer=optimizer, loss=self.config.LOSS_FUNCTION)
         return model
     def init_network_agent_only(self, optimizer):
+        with self.dtype_policy():
+            return self.build_network_agent_only(optimizer)
+    def build_network_agent_only(self, optimizer):
         # Define agent_input
         agent_input = keras.Input(shape=(self.config.AGENT_INPUT_SIZE,), name="agent_input")
         # Normalization layer
@@ -39,8 +60,8 @@ class NN_handler:
         # Agent layers
         agent_layer_2 = keras.layers.Dense(units=16, activation='relu', kernel_initializer=keras.initializers.HeUniform(), name="agent_layer_2")(agent_input)
         agent_layer_3 = keras.layers.Dense(units=8, activation='relu', kernel_initializer=keras.initializers.HeUniform(), name="agent_layer_3")(agent_layer_2)
-        # Output layer
-        outputs = keras.layers.Dense(units=2, activation='linear', name="outputs")(agent_layer_3)
+        # Output layer (float32 under the mixed_bfloat16 policy as well, for numerically stable losses)
+        outputs = keras.layers.Dense(units=2, activation='linear', name="outputs", dtype="float32")(agent_layer_3)
         # Create the model
         model = keras.Model(inputs=agent_input, outputs=outputs)
         model.compile(optimizer=optimizer, loss=self.config.LOSS_FUNCTION)
@@ -95,13 +116,170 @@ class NN_handler:
     @staticmethod
     def create_network_copy(network):
         network_copy = keras.models.clone_model(network)
-        network_copy.set_weights(network.get_weights())
+        NN_handler.create_target_update_function(network, network_copy)(hard_copy=True)
         return network_copy
 
+    @staticmethod
+    def create_target_update_function(source_network, target_network):
+        """ Build a compiled function that updates the variables of target_network in place, on device:
+            update(tau) -> target = tau * source + (1 - tau) * target  (Polyak averaging)
+            update(hard_copy=True) -> target = source
+            Variables are paired layer by layer, so freezing layers (which reorders model.weights) is safe. """
+        variable_pairs = [(source_variable, target_variable)
+                          for source_layer, target_layer in zip(source_network.layers, target_network.layers)
+                          for source_variable, target_variable in zip(source_layer.weights, target_layer.weights)]
+
+        @tf.function
+        def update_target_variables(tau=tf.constant(1.0), hard_copy=False):
+            for source_variable, target_variable in variable_pairs:
+                if hard_copy:
+                    target_variable.assign(source_variable)
+                else:
+                    tau_of_variable = tf.cast(tau, target_variable.dtype)
+                    target_variable.assign(tau_of_variable * source_variable + (1 - tau_of_variable) * target_variable)
+
+        return update_target_variables
+
+    @staticmethod
+    def create_inference_function(network, backend):
+        """ Build a low latency predict function: NumPy inputs (one array, or a list for multi input networks)
+            -> NumPy Q-values. Avoids the per call setup of keras.Model.predict.
+            backend: "keras" - keras.Model.predict (reference)
+                     "tf_function" - traced call of the network, reads the live weights
+                     "numpy" - NumpyNetwork forward pass (sequential networks only), weight snapshot """
+        if backend == "keras":
+            return lambda inputs: network.predict(inputs, verbose=0)
+        if backend == "numpy":
+            return NumpyNetwork(network).predict
+
+        input_signature = [tf.TensorSpec(shape=(None,) + tuple(network_input.shape[1:]), dtype=tf.float32)
+                           for network_input in network.inputs]
+
+        @tf.function(input_signature=input_signature)
+        def traced_network_call(*inputs):
+            return network(list(inputs) if len(inputs) > 1 else inputs[0], training=False)
+
+        def predict(inputs):
+            if not isinstance(inputs, (list, tuple)):
+                inputs = [inputs]
+            return traced_network_call(*[np.asarray(x, dtype=np.float32) for x in inputs]).numpy()
+
+        return predict
+
+    @staticmethod
+    def create_train_step(network, backend):
+        """ One optimizer step, traced ("tf_function") or compiled by XLA ("xla", tf.function(jit_compile=True)):
+            step(*inputs, targets, sample_weight, normalizer) -> loss, gradients
+            loss = sum(compiled loss of every row * sample_weight) / normalizer (+ the regularization losses), applied
+            by the optimizer the network was compiled with (its state persists across calls). The step is traced once
+            with a free batch dimension, XLA compiles it once per batch size, so callers pad their batches to a few
+            sizes. The trainable variables are the ones at construction. """
+        loss_function = keras.losses.get(network.loss)
+        variables = network.trainable_variables
+        input_signature = [tf.TensorSpec(shape=(None,) + tuple(network_input.shape[1:]), dtype=tf.float32)
+                           for network_input in network.inputs]
+        input_signature += [
+            tf.TensorSpec(shape=(None,) + tuple(network.outputs[0].shape[1:]), dtype=tf.float32),  # targets
+            tf.TensorSpec(shape=(None,), dtype=tf.float32),  # sample weights, 0 for the padding rows
+            tf.TensorSpec(shape=(), dtype=tf.float32),  # normalizer of the summed loss
+        ]
+
+        @tf.function(input_signature=input_signature, jit_compile=backend == "xla")
+        def train_step(*tensors):
+            inputs, (targets, sample_weight, normalizer) = list(tensors[:-3]), tensors[-3:]
+            with tf.GradientTape() as tape:
+                # the output is float32 under the mixed_bfloat16 policy as well (see MIXED_PRECISION)
+                predictions = tf.cast(network(inputs if len(inputs) > 1 else inputs[0], training=True), tf.float32)
+                loss = tf.reduce_sum(loss_function(targets, predictions) * sample_weight) / normalizer
+                if network.losses:
+                    loss += tf.add_n(network.losses)
+            gradients = tape.gradient(loss, variables)
+            network.optimizer.apply_gradients(zip(gradients, variables))
+            return loss, gradients
+
+        return train_step
+
+    @staticmethod
+    def create_train_function(network, backend, minibatch_size=32):
+        """ Build a training function with the semantics of network.fit(inputs, targets, sample_weight=sample_weight,
+            epochs=epochs, batch_size=minibatch_size): every epoch the rows are shuffled and one gradient step of the
+            compiled loss is applied per minibatch. train(inputs, targets, sample_weight=None, epochs=1) -> mean loss
+            of the first epoch (RL.replay, see TRAIN_STEP_BACKEND)
+            backend: "keras" - network.fit (reference, rebuilds its data pipeline on every call)
+                     "tf_function" / "xla" - create_train_step
+            Minibatches have a fixed shape, so the step is compiled once: the last partial minibatch is filled up with
+            repeated rows of zero sample weight (repeated rather than zeros, to keep the BatchNormalization batch
+            statistics close). Layers set (un)trainable afterwards need a new train function. """
+        if backend == "keras":
+            def fit(inputs, targets, sample_weight=None, epochs=1):
+                history = network.fit(inputs, targets, sample_weight=sample_weight, epochs=epochs,
+                                      batch_size=minibatch_size, verbose=0)
+                return history.history['loss'][0]
+
+            return fit
+
+        train_step = NN_handler.create_train_step(network, backend)
+
+        def train(inputs, targets, sample_weight=None, epochs=1):
+            if not isinstance(inputs, (list, tuple)):
+                inputs = [inputs]
+            inputs = [np.asarray(x, dtype=np.float32) for x in inputs]
+            targets = np.asarray(targets, dtype=np.float32)
+            n_rows = len(targets)
+            sample_weight = np.ones(n_rows, dtype=np.float32) if sample_weight is None else \
+                np.asarray(sample_weight, dtype=np.float32)
+            n_minibatches = -(-n_rows // minibatch_size)
+            epoch_losses = []
+            for _ in range(epochs):
+                rows = np.resize(np.random.permutation(n_rows), n_minibatches * minibatch_size)
+                rows_sample_weight = sample_weight[rows]
+                rows_sample_weight[n_rows:] = 0.0
+                epoch_loss = 0.0
+                for start in range(0, len(rows), minibatch_size):
+                    minibatch_rows = rows[start:start + minibatch_size]
+                    n_minibatch_rows = min(minibatch_size, n_rows - start)
+                    loss, _ = train_step(*[x[minibatch_rows] for x in inputs], targets[minibatch_rows],
+                                         rows_sample_weight[start:start + minibatch_size],
+                                         np.float32(n_minibatch_rows))
+                    epoch_loss += float(loss) * n_minibatch_rows
+                epoch_losses.append(epoch_loss / n_rows)
+            return epoch_losses[0]
+
+        return train
+
+    @staticmethod
+    def create_trajectory_train_function(network, backend):
+        """ The optimizer step of RL.apply_gradients on a whole trajectory, traced or compiled by XLA (see
+            create_train_step): the gradients of the summed loss of all rows are applied once.
+            train(inputs, targets) -> mean loss of the rows, gradients
+            Trajectories are padded to the next power of two rows (repeated rows of zero sample weight), so XLA only
+            compiles a few batch sizes. A new step is built whenever the trainable layers change (see
+            alternate_master_and_agent_training). """
+        train_steps = {}  # names of the trainable variables -> step
+
+        def train(inputs, targets):
+            if not isinstance(inputs, (list, tuple)):
+                inputs = [inputs]
+            inputs = [np.asarray(x, dtype=np.float32) for x in inputs]
+            targets = np.asarray(targets, dtype=np.float32)
+            trainable_variables = tuple(variable.name for variable in network.trainable_variables)
+            if trainable_variables not in train_steps:
+                train_steps[trainable_variables] = NN_handler.create_train_step(network, backend)
+            n_rows = len(targets)
+            rows = np.resize(np.arange(n_rows), 1 << (n_rows - 1).bit_length())
+            sample_weight = np.zeros(len(rows), dtype=np.float32)
+            sample_weight[:n_rows] = 1.0
+            loss, gradients = train_steps[trainable_variables](*[x[rows] for x in inputs], targets[rows],
+                                                               sample_weight, np.float32(1.0))
+            return float(loss) / n_rows, gradients
+
+        return train
+
     def load_weights_to_network(self, network):
         weight_directory = self.config.LOAD_WEIGHT_DIRECTORY
         if not os.path.exists(weight_directory):
             raise FileNotFoundError(f"Weight directory {weight_directory} does not exist.")
+        from stable_baselines3 import PPO
         network=PPO.load(weight_directory)
         print(f"Weights from: {weight_directory} were loaded successfully.")
         return network
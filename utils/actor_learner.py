@@ -0,0 +1,202 @@
+import os
+import queue
+import random
+import threading
+
+import numpy as np
+
+from checkpoint import CheckpointManager
+from profiler import profiler
+from trajectory_store import TrajectoryRecorder
+
+
+class ActorLearner:
+    """ Runs the acting and the learning of the DQN path of RL concurrently instead of in sequence:
+        actor thread: keeps stepping the simulator (RL.step_agent_only) with a snapshot of RL.model and pushes the
+            transitions to a bounded queue (the actor blocks when the learner falls ACTOR_LEARNER_QUEUE_SIZE behind)
+        learner thread: drains the queue into RL.memory and runs RL.replay / RL.update_target_model, at most
+            LEARNER_UPDATES_PER_TRANSITION updates per received transition
+        Bounded staleness: the actor refreshes its snapshot before a step whenever it is ACTOR_MAX_WEIGHT_LAG or
+        more learner updates old. Queue depth and weight lag are logged every learner update.
+        Every CHECKPOINT_EVERY_X_EPISODES episodes the whole training state is checkpointed to path/checkpoints (see
+        CheckpointManager), and run() resumes from LOAD_WEIGHT_DIRECTORY when it holds a checkpoint.
+        RECORD_TRAJECTORIES -> the actor also records every transition (full car1 state) to path/trajectories. """
+
+    def __init__(self, config, rl, path):
+        self.config = config
+        self.rl = rl
+        self.path = path  # of the experiment (see model_training)
+        self.transitions_queue = queue.Queue(maxsize=self.config.ACTOR_LEARNER_QUEUE_SIZE)
+        self.weights_lock = threading.Lock()  # RL.model is read by the snapshot copy and written by the learner
+        self.stop_learning = threading.Event()
+        self.learner_thread = None  # started by run()
+
+        self.actor_model = self.rl.nn_handler.create_network_copy(self.rl.model)
+        self.actor_inference = self.rl.nn_handler.create_inference_function(self.actor_model,
+                                                                            self.config.INFERENCE_BACKEND)
+        self.copy_model_to_actor = self.rl.nn_handler.create_target_update_function(self.rl.model, self.actor_model)
+
+        self.learner_updates = 0
+        self.transitions_received = 0  # by the learner in this run
+        self.actor_weights_version = 0
+        self.all_rewards = []
+        self.losses = []
+        self.start_episode = 0
+        self.checkpoint_manager = None
+        if self.config.CHECKPOINT_EVERY_X_EPISODES > 0:
+            self.checkpoint_manager = CheckpointManager(os.path.join(self.path, "checkpoints"),
+                                                        self.config.CHECKPOINTS_TO_KEEP)
+        self.trajectory_recorder = None  # created with the size of the first car state
+
+    def weight_lag(self):
+        return self.learner_updates - self.actor_weights_version
+
+    def refresh_actor_weights(self):
+        with self.weights_lock:
+            learner_updates = self.learner_updates
+            self.copy_model_to_actor(hard_copy=True)
+        if self.config.INFERENCE_BACKEND == "numpy":  # the numpy forward pass holds its own copy of the weights
+            self.actor_inference = self.rl.nn_handler.create_inference_function(self.actor_model, "numpy")
+        self.actor_weights_version = learner_updates
+
+    def checkpoint_snapshot(self):
+        with self.weights_lock:
+            arrays, rl_state = self.rl.checkpoint()
+        random_generator, random_keys, random_position, has_gauss, cached_gaussian = np.random.get_state()
+        arrays["numpy_random_keys"] = random_keys
+        state = {
+            "rl": rl_state,
+            "episode": len(self.all_rewards),
+            "learner_updates": self.learner_updates,
+            "all_rewards": [float(episode_reward) for episode_reward in self.all_rewards],
+            "numpy_random": [random_generator, int(random_position), int(has_gauss), float(cached_gaussian)],
+            "python_random": random.getstate(),
+        }
+        return arrays, state, {}
+
+    def check_learner_alive(self):
+        if not self.learner_thread.is_alive():
+            raise RuntimeError("The learner thread died, see its traceback above")
+
+    def put_transition(self, transition):
+        """ Blocks while the queue is full, raises if the learner died (nobody would ever make room) """
+        while True:
+            try:
+                self.transitions_queue.put(transition, timeout=1.0)
+                return
+            except queue.Full:
+                self.check_learner_alive()
+
+    def wait_for_learner(self):
+        """ transitions_queue.join() that raises if the learner died before storing every queued transition """
+        with self.transitions_queue.all_tasks_done:
+            while self.transitions_queue.unfinished_tasks > 0:
+                self.check_learner_alive()
+                self.transitions_queue.all_tasks_done.wait(timeout=1.0)
+
+    def save_checkpoint(self):
+        """ Called by the actor between episodes. Once the learner stored every queued transition, the state is
+            copied under the weights lock and written to disk in the background. """
+        self.wait_for_learner()
+        episode = len(self.all_rewards)
+        self.checkpoint_manager.save(episode, self.checkpoint_snapshot)
+        self.checkpoint_manager.log(self.rl.logger.log_scaler, episode)
+
+    def resume_from_checkpoint(self):
+        checkpoint_path = CheckpointManager.latest_checkpoint(self.config.LOAD_WEIGHT_DIRECTORY)
+        if checkpoint_path is None:
+            return
+        arrays, state, _ = CheckpointManager.load(checkpoint_path)
+        self.rl.restore_checkpoint(arrays, state["rl"])
+        self.start_episode = state["episode"]
+        self.learner_updates = state["learner_updates"]
+        self.all_rewards = state["all_rewards"]
+        random_generator, random_position, has_gauss, cached_gaussian = state["numpy_random"]
+        np.random.set_state((random_generator, np.array(arrays["numpy_random_keys"]), random_position, has_gauss,
+                             cached_gaussian))
+        python_random_version, python_random_keys, python_random_gauss = state["python_random"]
+        random.setstate((python_random_version, tuple(python_random_keys), python_random_gauss))
+        print(f"Resumed from {checkpoint_path} at episode {self.start_episode}")
+
+    def act(self):
+        for episode in range(self.start_episode, self.config.MAX_EPISODES):
+            self.rl.airsim.reset_cars_to_initial_positions()
+            episode_sum_of_rewards = 0
+            for _ in range(self.config.MAX_EPISODE_STEPS):
+                if self.weight_lag() >= self.config.ACTOR_MAX_WEIGHT_LAG:
+                    self.refresh_actor_weights()
+                car1_state, car1_action, car1_next_state, collision_occurred, reached_target, reward = \
+                    self.rl.step_agent_only(self.actor_inference)
+                done = collision_occurred or reached_target
+                # the agent input is the head of the car state (see Logger.log_state)
+                self.put_transition((car1_state[:self.config.AGENT_INPUT_SIZE], car1_action, reward,
+                                     car1_next_state[:self.config.AGENT_INPUT_SIZE], done))
+                if self.config.RECORD_TRAJECTORIES:
+                    if self.trajectory_recorder is None:
+                        self.trajectory_recorder = TrajectoryRecorder(
+                            os.path.join(self.path, "trajectories"), len(car1_state))
+                    self.trajectory_recorder.append(car1_state, car1_action, reward, car1_next_state, done,
+                                                    collision_occurred, self.rl.last_cars_distance)
+                episode_sum_of_rewards += reward
+                if done:
+                    break
+            if self.trajectory_recorder is not None:
+                self.trajectory_recorder.end_episode()
+            self.rl.updateEpsilon()
+            self.all_rewards.append(episode_sum_of_rewards)
+            self.rl.logger.log_scaler("actor_learner/episode_reward", episode, episode_sum_of_rewards)
+            print(f"Episode {episode + 1} finished with reward: {episode_sum_of_rewards}")
+            if self.checkpoint_manager is not None and (episode + 1) % self.config.CHECKPOINT_EVERY_X_EPISODES == 0:
+                self.save_checkpoint()
+
+    def drain_transitions_queue(self, wait):
+        try:
+            self.rl.memory.append(*self.transitions_queue.get(timeout=0.1 if wait else None, block=wait))
+            self.transitions_received += 1
+            self.transitions_queue.task_done()
+            while True:
+                self.rl.memory.append(*self.transitions_queue.get_nowait())
+                self.transitions_received += 1
+                self.transitions_queue.task_done()
+        except queue.Empty:
+            pass
+
+    def can_update(self, learner_updates_at_start):
+        """ Enough transitions to replay, and the replay ratio leaves room for another update """
+        update_budget = int(self.transitions_received * self.config.LEARNER_UPDATES_PER_TRANSITION)
+        return len(self.rl.memory) >= self.rl.train_start and \
+            self.learner_updates - learner_updates_at_start < update_budget
+
+    def learn(self):
+        learner_updates_at_start = self.learner_updates  # continues from a checkpoint, the budget is per run
+        while not self.stop_learning.is_set():
+            self.drain_transitions_queue(wait=not self.can_update(learner_updates_at_start))
+            if not self.can_update(learner_updates_at_start):
+                continue
+            with self.weights_lock:
+                loss = self.rl.replay()
+                self.rl.update_target_model()
+                self.learner_updates += 1
+            self.losses.append(loss)
+            self.rl.logger.log_scaler("actor_learner/loss", self.learner_updates, loss)
+            self.rl.logger.log_scaler("actor_learner/queue_depth", self.learner_updates, self.transitions_queue.qsize())
+            self.rl.logger.log_scaler("actor_learner/weight_lag", self.learner_updates, self.weight_lag())
+
+    def run(self):
+        """ Act for MAX_EPISODES episodes while learning in the background. returns: episode sums of rewards """
+        self.resume_from_checkpoint()
+        self.refresh_actor_weights()
+        self.learner_thread = threading.Thread(target=self.learn, name="learner", daemon=True)
+        self.learner_thread.start()
+        self.act()  # the actor runs on the calling thread
+        self.stop_learning.set()
+        self.learner_thread.join()
+        profiler.log(self.rl.logger.log_scaler, self.learner_updates)
+        self.rl.airsim.log_rpc_latencies(self.rl.logger.log_scaler, self.learner_updates)
+        self.rl.airsim.close()
+        profiler.save_csv(self.path)
+        if self.checkpoint_manager is not None:
+            self.checkpoint_manager.close()
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.close()
+        return np.array(self.all_rewards)
@@ -1,13 +1,28 @@
 import random
+import time
 import airsim
 import numpy as np
 
+from profiler import profiler
+
+# One record per car, filled in place by AirsimManager.snapshot()
+CARS_SNAPSHOT_DTYPE = np.dtype([
+    ("x", np.float64),
+    ("y", np.float64),
+    ("Vx", np.float64),
+    ("Vy", np.float64),
+    ("has_collided", np.bool_),
+])
+CAR1_SNAPSHOT_INDEX = 0
+CAR2_SNAPSHOT_INDEX = 1
+
 
 class AirsimManager:
 
     def __init__(self, config):
         self.config = config
-        self.airsim_client = airsim.CarClient()  # Create an AirSim client for car simulation
+        profiler.configure(self.config)
+        self.airsim_client = self.create_client()  # Create an AirSim client for car simulation
         self.airsim_client.confirmConnection()  # Confirm the connection to the AirSim simulator
 
         self.airsim_client.enableApiControl(True, self.config.CAR1_NAME)  # Enable API control for Car1
@@ -31,13 +46,56 @@ class AirsimManager:
         self.car2_x_offset = self.airsim_client.simGetObjectPose(self.config.CAR2_NAME).position.x_val
         self.car2_y_offset = self.airsim_client.simGetObjectPose(self.config.CAR2_NAME).position.y_val
 
-        self.reset_cars_to_initial_positions()
-
         self.simulation_paused = False  # New flag
 
+        # non-blocking RPC layer: both cars' calls are in flight together
+        self.async_client = None
+        if self.config.ASYNC_RPC:
+            from async_airsim import AsyncAirsimClient
+            self.async_client = AsyncAirsimClient(self.airsim_client)
+        # lockstep: the world only moves in advance_simulation / resets, until then the last snapshot is current
+        self.snapshot_is_current = False
+
+        self.reset_cars_to_initial_positions()
+
+        # preallocated record of both cars, reused by every snapshot() call
+        self.cars_snapshot = np.zeros(2, dtype=CARS_SNAPSHOT_DTYPE)
+
+
+    def create_client(self):
+        if self.config.SIMULATOR_BACKEND == "fake":
+            from fake_airsim import FakeCarClient
+            return FakeCarClient(self.config)
+        # "airsim" and "fake_server" both talk to a server over RPC
+        return airsim.CarClient(ip=self.config.AIRSIM_IP, port=self.config.AIRSIM_PORT)
+
+    def is_lockstep(self):
+        return self.config.SIMULATION_STEPPING == "lockstep"
+
+    def advance_simulation(self):
+        """ Let the world move on by TIME_BETWEEN_STEPS between two consecutive states.
+            sleep: the simulator runs freely and we wait TIME_BETWEEN_STEPS of wall clock time.
+            lockstep: the simulator is kept paused and advanced by exactly TIME_BETWEEN_STEPS of simulated time,
+            so a step takes only as long as the simulator needs to compute it. """
+        with profiler.phase("airsim/advance"):
+            self.snapshot_is_current = False
+            if not self.is_lockstep():
+                time.sleep(self.config.TIME_BETWEEN_STEPS)
+                return
+            self.airsim_client.simContinueForTime(self.config.TIME_BETWEEN_STEPS)
+            # simContinueForTime returns right away, the simulator pauses itself when the time is up
+            deadline = time.perf_counter() + self.config.LOCKSTEP_TIMEOUT
+            while not self.airsim_client.simIsPause():
+                if time.perf_counter() > deadline:
+                    raise TimeoutError(f"The simulator did not pause within {self.config.LOCKSTEP_TIMEOUT} s of "
+                                       f"simContinueForTime({self.config.TIME_BETWEEN_STEPS})")
+                time.sleep(self.config.LOCKSTEP_POLL_INTERVAL)
 
     def reset_cars_to_initial_positions(self):
+        self.snapshot_is_current = False
         self.airsim_client.reset()
+        if self.is_lockstep():
+            self.airsim_client.simPause(True)
         # pick at random (car 2 goes from left/right)
         left_or_right = random.choice([1, -1])
         if self.config.SET_CAR2_INITIAL_DIRECTION_MANUALLY:
@@ -71,6 +129,7 @@ class AirsimManager:
         self.airsim_client.simSetVehiclePose(initial_pose_car2, True, self.config.CAR2_NAME)
 
     def reset_cars_to_initial_settings_file_positions(self):
+        self.snapshot_is_current = False
         self.airsim_client.reset()
 
         # car1_start_location_x = self.config.CAR1_INITIAL_POSITION[0] - self.car1_x_offset
@@ -124,23 +183,108 @@ class AirsimManager:
     def set_car_controls(self, updated_car_controls, car_name):
         self.airsim_client.setCarControls(updated_car_controls, car_name)
 
+    def get_cars_controls(self, car_names):
+        with profiler.phase("airsim/get_controls"):
+            if self.async_client is None:
+                return [self.get_car_controls(car_name) for car_name in car_names]
+            return self.async_client.get_all([self.async_client.get_car_controls_async(car_name)
+                                              for car_name in car_names])
+
+    def set_cars_controls(self, cars_controls, car_names):
+        """ Send the controls of several cars - concurrently with ASYNC_RPC """
+        with profiler.phase("airsim/set_controls"):
+            if self.async_client is None:
+                for car_controls, car_name in zip(cars_controls, car_names):
+                    self.set_car_controls(car_controls, car_name)
+                return
+            self.async_client.get_all([self.async_client.set_car_controls_async(car_controls, car_name)
+                                       for car_controls, car_name in zip(cars_controls, car_names)])
+
     def get_car_position_and_speed(self, car_name):
         car_position = self.airsim_client.simGetObjectPose(car_name).position
+        car_velocity = self.airsim_client.getCarState(car_name).kinematics_estimated.linear_velocity
         car_position_and_speed = {
             "x": car_position.x_val,
             "y": car_position.y_val,
-            "Vx": self.airsim_client.getCarState(car_name).kinematics_estimated.linear_velocity.x_val,
-            "Vy": self.airsim_client.getCarState(car_name).kinematics_estimated.linear_velocity.y_val,
+            "Vx": car_velocity.x_val,
+            "Vy": car_velocity.y_val,
         }
         return car_position_and_speed
 
+    def snapshot(self):
+        """ Fetch pose, velocity and collision info of both cars with a single getCarState RPC per car.
+            The returned record is preallocated and overwritten by the next call - copy what you need to keep.
+            In lockstep the record of the previous call is returned as is while the world has not moved since
+            (the next state of a step is the state of the next step).
+            kinematics_estimated.position is relative to the car's spawn point, so the settings file offsets are
+            added back to get the same coordinates as simGetObjectPose. """
+        if self.snapshot_is_current:
+            return self.cars_snapshot
+        cars = [
+            (CAR1_SNAPSHOT_INDEX, self.config.CAR1_NAME, self.car1_x_offset, self.car1_y_offset),
+            (CAR2_SNAPSHOT_INDEX, self.config.CAR2_NAME, self.car2_x_offset, self.car2_y_offset),
+        ]
+        with profiler.phase("airsim/snapshot"):
+            if self.async_client is not None:
+                car_states = self.async_client.get_all([self.async_client.get_car_state_async(car_name)
+                                                        for _, car_name, _, _ in cars])
+            else:
+                car_states = [self.airsim_client.getCarState(car_name) for _, car_name, _, _ in cars]
+        for (index, car_name, x_offset, y_offset), car_state in zip(cars, car_states):
+            kinematics = car_state.kinematics_estimated
+            record = self.cars_snapshot[index]
+            record["x"] = kinematics.position.x_val + x_offset
+            record["y"] = kinematics.position.y_val + y_offset
+            record["Vx"] = kinematics.linear_velocity.x_val
+            record["Vy"] = kinematics.linear_velocity.y_val
+            record["has_collided"] = car_state.collision.has_collided
+        self.snapshot_is_current = self.is_lockstep()
+        return self.cars_snapshot
+
+    def close(self):
+        """ Shut down the threads of the ASYNC_RPC client, later calls go through the blocking client """
+        if self.async_client is not None:
+            self.async_client.close()
+            self.async_client = None
+
+    def log_rpc_latencies(self, log_scaler, step):
+        """ ASYNC_RPC only: p50/p95/p99 latency of every RPC, log_scaler(log_name, step, value) """
+        if self.async_client is not None:
+            self.async_client.log_latencies(log_scaler, step)
+
+    @staticmethod
+    def get_car_state_from_snapshot(snapshot, car_index):
+        record = snapshot[car_index]
+        return np.array([record["x"], record["y"], record["Vx"], record["Vy"]])
+
+    def get_car1_state_from_snapshot(self, snapshot, logger=None):
+        car1_state = self.get_car_state_from_snapshot(snapshot, CAR1_SNAPSHOT_INDEX)
+        if logger is not None and self.config.LOG_CAR_STATES:
+            logger.log_state(car1_state, self.config.CAR1_NAME)
+        return car1_state
+
+    def get_car2_state_from_snapshot(self, snapshot, logger=None):
+        car2_state = self.get_car_state_from_snapshot(snapshot, CAR2_SNAPSHOT_INDEX)
+        if logger is not None and self.config.LOG_CAR_STATES:
+            logger.log_state(car2_state, self.config.CAR2_NAME)
+        return car2_state
+
+    @staticmethod
+    def collision_occurred_in_snapshot(snapshot):
+        has_collided = bool(snapshot["has_collided"].any())
+        if has_collided:
+            print('************************************Colission!!!!!**********************************************')
+            print(has_collided)
+        return has_collided
+
+    @staticmethod
+    def get_cars_distance_from_snapshot(snapshot):
+        car1 = snapshot[CAR1_SNAPSHOT_INDEX]
+        car2 = snapshot[CAR2_SNAPSHOT_INDEX]
+        return (car1["x"] - car2["x"]) ** 2 + (car1["y"] - car2["y"]) ** 2
+
     def get_cars_distance(self):
-        car1_position_and_speed = self.get_car_position_and_speed(self.config.CAR1_NAME)
-        car2_position_and_speed = self.get_car_position_and_speed(self.config.CAR2_NAME)
-        dist_c1_c2 = np.sum(np.square(
-            np.array([[car1_position_and_speed["x"], car1_position_and_speed["y"]]]) -
-            np.array([[car2_position_and_speed["x"], car2_position_and_speed["y"]]])))
-        return dist_c1_c2
+        return self.get_cars_distance_from_snapshot(self.snapshot())
 
     def get_car1_state(self, logger=None):
         car1_position_and_speed = self.get_car_position_and_speed(self.config.CAR1_NAME)
@@ -182,7 +326,8 @@ class AirsimManager:
 
     def resume_simulation(self):
         self.simulation_paused = False
-        self.airsim_client.simPause(False)
+        if not self.is_lockstep():  # in lockstep the simulator only runs inside advance_simulation
+            self.airsim_client.simPause(False)
 
     def is_simulation_paused(self):
         return self.simulation_paused
@@ -0,0 +1,87 @@
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import airsim
+
+from latency import LatencyHistogram
+
+
+class RpcFuture:
+    """ Result of an RPC issued by AsyncAirsimClient. get() blocks until the result is there and records the
+        latency of the RPC in its histogram. get_result(future) returns the result and that latency. """
+
+    def __init__(self, future, get_result, decode, latency_histogram):
+        self.future = future
+        self.get_result = get_result
+        self.decode = decode
+        self.latency_histogram = latency_histogram
+        self.result = None
+        self.done = False
+
+    def get(self):
+        if not self.done:
+            result, latency = self.get_result(self.future)
+            self.result = self.decode(result)
+            self.latency_histogram.record(latency)
+            self.done = True
+        return self.result
+
+
+class AsyncAirsimClient:
+    """ Non-blocking layer over an airsim.CarClient: every call returns an RpcFuture right away, so several RPCs
+        can be in flight at once and overlap with computation.
+        airsim.CarClient -> msgpack-rpc call_async on its own connection
+        other clients (e.g. FakeCarClient) -> the calls run in order on a dedicated I/O thread """
+
+    def __init__(self, airsim_client):
+        self.airsim_client = airsim_client
+        self.rpc_client = airsim_client.client if isinstance(airsim_client, airsim.CarClient) else None
+        self.io_executor = None if self.rpc_client is not None else ThreadPoolExecutor(max_workers=1)
+        self.latency_histograms = defaultdict(LatencyHistogram)  # RPC name -> round trip latencies
+
+    def call_async(self, method_name, *args, decode=lambda result: result):
+        """ method_name: the AirSim RPC name, which is also the CarClient method name for the calls used here """
+        if self.rpc_client is not None:
+            start_time = time.perf_counter()
+            future = self.rpc_client.call_async(method_name, *args)
+            # msgpack-rpc only reads the response while get() waits for it, so this is the round trip as long as
+            # the result is waited for right after the calls are issued (as AirsimManager does)
+            return RpcFuture(future, lambda rpc_future: (rpc_future.get(), time.perf_counter() - start_time),
+                             decode, self.latency_histograms[method_name])
+        future = self.io_executor.submit(self.timed_call, getattr(self.airsim_client, method_name), *args)
+        return RpcFuture(future, lambda thread_future: thread_future.result(), lambda result: result,
+                         self.latency_histograms[method_name])
+
+    @staticmethod
+    def timed_call(method, *args):
+        """ Runs on the I/O thread, so the latency leaves out the time the call waited behind the others """
+        start_time = time.perf_counter()
+        result = method(*args)
+        return result, time.perf_counter() - start_time
+
+    def get_car_state_async(self, car_name):
+        return self.call_async("getCarState", car_name, decode=airsim.CarState.from_msgpack)
+
+    def get_car_controls_async(self, car_name):
+        return self.call_async("getCarControls", car_name, decode=airsim.CarControls.from_msgpack)
+
+    def set_car_controls_async(self, car_controls, car_name):
+        return self.call_async("setCarControls", car_controls, car_name)
+
+    @staticmethod
+    def get_all(futures):
+        return [future.get() for future in futures]
+
+    def latency_summaries(self):
+        return {method_name: histogram.summary() for method_name, histogram in self.latency_histograms.items()}
+
+    def log_latencies(self, log_scaler, step):
+        """ log_scaler(log_name, step, value), e.g. Logger.log_scaler """
+        for method_name, summary in self.latency_summaries().items():
+            for statistic in ["p50", "p95", "p99"]:
+                log_scaler(f"rpc_latency/{method_name}_{statistic}", step, summary[statistic])
+
+    def close(self):
+        if self.io_executor is not None:
+            self.io_executor.shutdown()
@@ -0,0 +1,137 @@
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from latency import LatencyHistogram
+
+LATEST_CHECKPOINT_FILE = "latest"
+STATE_FILE = "state.json"
+
+
+class CheckpointManager:
+    """ Periodic checkpoints written by a background thread:
+            directory/checkpoint_<step>/ state.json (counters, epsilon, ...), <name>.npy per array, raw files
+            directory/latest - name of the newest complete checkpoint
+        save() runs the snapshot function on the calling thread (it must return copies), the files are written to a
+        .tmp directory that is renamed once complete and only then becomes latest, so a crash mid-write never leaves
+        a partial checkpoint behind. Arrays are plain .npy, so load() memory-maps them instead of reading them.
+        The snapshot and write durations and the size of every checkpoint are kept for log(). """
+
+    def __init__(self, directory, checkpoints_to_keep):
+        self.directory = directory
+        self.checkpoints_to_keep = checkpoints_to_keep
+        self.snapshot_histogram = LatencyHistogram()
+        self.write_histogram = LatencyHistogram()
+        self.last_checkpoint_bytes = 0
+        self.checkpoints_queue = queue.Queue(maxsize=1)  # a save waits while the previous one is still written
+        self.writer_thread = threading.Thread(target=self.write_checkpoints, name="checkpoint", daemon=True)
+        self.writer_thread.start()
+
+    def save(self, step, snapshot_function):
+        """ snapshot_function() -> arrays {name: ndarray}, state (JSON serializable), files {name: bytes} """
+        start = time.perf_counter()
+        arrays, state, files = snapshot_function()
+        self.snapshot_histogram.record(time.perf_counter() - start)
+        self.checkpoints_queue.put((step, arrays, state, files))
+
+    def write_checkpoints(self):
+        while True:
+            checkpoint = self.checkpoints_queue.get()
+            if checkpoint is None:
+                self.checkpoints_queue.task_done()
+                return
+            start = time.perf_counter()
+            self.write_checkpoint(*checkpoint)
+            self.write_histogram.record(time.perf_counter() - start)
+            self.checkpoints_queue.task_done()
+
+    def write_checkpoint(self, step, arrays, state, files):
+        checkpoint_name = f"checkpoint_{step}"
+        temporary_path = os.path.join(self.directory, f"{checkpoint_name}.tmp")
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        os.makedirs(temporary_path)
+        checkpoint_bytes = 0
+        for name, array in arrays.items():
+            with open(os.path.join(temporary_path, f"{name}.npy"), "wb") as array_file:
+                np.save(array_file, array)
+                array_file.flush()
+                os.fsync(array_file.fileno())
+            checkpoint_bytes += array.nbytes
+        for name, content in files.items():
+            with open(os.path.join(temporary_path, name), "wb") as raw_file:
+                raw_file.write(content)
+                raw_file.flush()
+                os.fsync(raw_file.fileno())
+            checkpoint_bytes += len(content)
+        with open(os.path.join(temporary_path, STATE_FILE), "w") as state_file:
+            json.dump({"step": step, "arrays": list(arrays), "files": list(files), "state": state}, state_file)
+            state_file.flush()
+            os.fsync(state_file.fileno())
+
+        checkpoint_path = os.path.join(self.directory, checkpoint_name)
+        shutil.rmtree(checkpoint_path, ignore_errors=True)
+        os.rename(temporary_path, checkpoint_path)
+        latest_temporary_path = os.path.join(self.directory, f"{LATEST_CHECKPOINT_FILE}.tmp")
+        with open(latest_temporary_path, "w") as latest_file:
+            latest_file.write(checkpoint_name)
+            latest_file.flush()
+            os.fsync(latest_file.fileno())
+        os.replace(latest_temporary_path, os.path.join(self.directory, LATEST_CHECKPOINT_FILE))
+        self.last_checkpoint_bytes = checkpoint_bytes
+        self.remove_old_checkpoints()
+
+    def remove_old_checkpoints(self):
+        checkpoint_names = [name for name in os.listdir(self.directory)
+                            if name.startswith("checkpoint_") and not name.endswith(".tmp")]
+        checkpoint_names.sort(key=lambda name: int(name[len("checkpoint_"):]))
+        for checkpoint_name in checkpoint_names[:-self.checkpoints_to_keep]:
+            shutil.rmtree(os.path.join(self.directory, checkpoint_name), ignore_errors=True)
+
+    def wait(self):
+        """ Block until every requested checkpoint is on disk """
+        self.checkpoints_queue.join()
+
+    def close(self):
+        self.checkpoints_queue.put(None)
+        self.writer_thread.join()
+
+    def log(self, log_scalar, step):
+        """ log_scalar(log_name, step, value), e.g. Logger.log_scaler """
+        if self.snapshot_histogram.count > 0:
+            log_scalar("checkpoint/snapshot_ms_p50", step, self.snapshot_histogram.percentile(50) * 1e3)
+        if self.write_histogram.count > 0:
+            log_scalar("checkpoint/write_ms_p50", step, self.write_histogram.percentile(50) * 1e3)
+            log_scalar("checkpoint/megabytes", step, self.last_checkpoint_bytes / 2 ** 20)
+
+    @staticmethod
+    def latest_checkpoint(path):
+        """ path: a checkpoint, a checkpoints directory or a run directory (SAVE_WEIGHT_DIRECTORY)
+            returns: path of the newest complete checkpoint, None if there is none """
+        if path is None or not os.path.isdir(path):
+            return None
+        if os.path.exists(os.path.join(path, STATE_FILE)):
+            return path
+        for checkpoints_directory in [path, os.path.join(path, "checkpoints")]:
+            latest_path = os.path.join(checkpoints_directory, LATEST_CHECKPOINT_FILE)
+            if os.path.exists(latest_path):
+                with open(latest_path) as latest_file:
+                    return os.path.join(checkpoints_directory, latest_file.read().strip())
+        return None
+
+    @staticmethod
+    def load(checkpoint_path):
+        """ returns: arrays {name: read-only memory-mapped ndarray}, state, files {name: bytes} """
+        with open(os.path.join(checkpoint_path, STATE_FILE)) as state_file:
+            checkpoint = json.load(state_file)
+        arrays = {name: np.load(os.path.join(checkpoint_path, f"{name}.npy"), mmap_mode="r")
+                  for name in checkpoint["arrays"]}
+        files = {}
+        for name in checkpoint["files"]:
+            with open(os.path.join(checkpoint_path, name), "rb") as raw_file:
+                files[name] = raw_file.read()
+        return arrays, checkpoint["state"], files
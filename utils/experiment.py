@@ -1,3 +1,5 @@
+import itertools
+import random
 
 
 class Experiment:
@@ -6,3 +8,31 @@ class Experiment:
         self.config_dict = config_dict
         self.output = ""
 
+
+def grid_sweep(base_config_dict, grid):
+    """ One experiment per combination of the grid values, e.g.
+        grid_sweep(config_exp1, {'LEARNING_RATE': [1e-4, 3e-4], 'N_STEPS': [160, 320]}) -> 4 experiments """
+    keys = list(grid)
+    return [Experiment({**base_config_dict, **dict(zip(keys, values))})
+            for values in itertools.product(*[grid[key] for key in keys])]
+
+
+def random_sweep(base_config_dict, distributions, n_experiments, seed=0):
+    """ n_experiments experiments with values drawn independently per key:
+        a list -> uniform choice, a (low, high) tuple -> uniform float (log-uniform when low > 0 and high / low >= 100)
+        e.g. random_sweep(config_exp1, {'LEARNING_RATE': (1e-5, 1e-2), 'BATCH_SIZE': [64, 160]}, 8) """
+    rng = random.Random(seed)
+    experiments = []
+    for _ in range(n_experiments):
+        config_dict = dict(base_config_dict)
+        for key, distribution in distributions.items():
+            if isinstance(distribution, tuple):
+                low, high = distribution
+                if low > 0 and high / low >= 100:
+                    config_dict[key] = low * (high / low) ** rng.random()
+                else:
+                    config_dict[key] = rng.uniform(low, high)
+            else:
+                config_dict[key] = rng.choice(distribution)
+        experiments.append(Experiment(config_dict))
+    return experiments
@@ -0,0 +1,139 @@
+import csv
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from multiprocessing import get_context
+
+import numpy as np
+
+from checkpoint import CheckpointManager
+from config import Config
+
+
+def bind_to_simulator(config, slot):
+    """ The experiment in slot i gets its own simulators: AIRSIM_PORT + i * NUM_ROLLOUT_WORKERS + rollout worker """
+    if config.SIMULATOR_BACKEND in ["airsim", "fake_server"]:
+        config.AIRSIM_PORT += slot * config.NUM_ROLLOUT_WORKERS
+
+
+def run_experiment(config_dict, slot, attempt):
+    """ Runs in a worker process. returns: summary of the run """
+    os.environ["MPLBACKEND"] = "Agg"  # no plot windows blocking the worker
+    from training_loop import model_training
+    config = Config()
+    config.set_config(config_dict)
+    bind_to_simulator(config, slot)
+    if attempt > 0 and CheckpointManager.latest_checkpoint(config.SAVE_WEIGHT_DIRECTORY) is not None:
+        config.LOAD_WEIGHT_DIRECTORY = config.SAVE_WEIGHT_DIRECTORY  # a retry resumes from the last checkpoint
+    start = time.perf_counter()
+    all_rewards = np.asarray(model_training(config, config.SAVE_WEIGHT_DIRECTORY), dtype=np.float64)
+    return {
+        "duration_s": time.perf_counter() - start,
+        "episodes": len(all_rewards),
+        "mean_reward": float(all_rewards.mean()) if len(all_rewards) else float("nan"),
+        "last_10_mean_reward": float(all_rewards[-10:].mean()) if len(all_rewards) else float("nan"),
+    }
+
+
+class ExperimentScheduler:
+    """ Runs a list of experiments (e.g. from grid_sweep / random_sweep), max_parallel at a time, every attempt in a
+        new process.
+        - every running experiment holds one of max_parallel slots, which binds it to its own simulator ports
+          (see bind_to_simulator), or simulator_backend overrides SIMULATOR_BACKEND of all of them (e.g. "fake")
+        - every experiment gets its own SAVE_WEIGHT_DIRECTORY
+        - a failed experiment (an exception, or its process died) is retried up to retries times, resuming from
+          its last checkpoint when it has one. The summary keeps the error of every failed attempt
+        - run() returns one summary per experiment (also stored in Experiment.output) and writes them to a CSV """
+
+    def __init__(self, max_parallel, retries, simulator_backend=None):
+        self.max_parallel = max_parallel
+        self.retries = retries
+        self.simulator_backend = simulator_backend
+        self.sweep_date_time = datetime.now().strftime("%d_%m_%Y-%H_%M_%S")
+
+    def isolate(self, experiments):
+        """ returns: the config dict of every experiment, with its own SAVE_WEIGHT_DIRECTORY """
+        config_dicts = []
+        for index, experiment in enumerate(experiments):
+            config_dict = dict(experiment.config_dict)
+            experiment_id = config_dict.get("EXPERIMENT_ID", Config().EXPERIMENT_ID)
+            save_weight_directory = config_dict.get("SAVE_WEIGHT_DIRECTORY",
+                                                    f"experiments/{self.sweep_date_time}_{experiment_id}")
+            if len(experiments) > 1:
+                save_weight_directory = f"{save_weight_directory}_{index:03d}"
+            config_dict["SAVE_WEIGHT_DIRECTORY"] = save_weight_directory
+            if self.simulator_backend is not None:
+                config_dict["SIMULATOR_BACKEND"] = self.simulator_backend
+            config_dicts.append(config_dict)
+        return config_dicts
+
+    @staticmethod
+    def create_executor():
+        """ Every attempt of an experiment runs in a new process of its own: a crashing worker only breaks its own
+            executor, and no state (profiler, Keras dtype policy, TensorFlow graphs) carries over to the next run """
+        return ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn"))
+
+    def run(self, experiments, summary_path=None):
+        config_dicts = self.isolate(experiments)
+        # replaced when an experiment completes or runs out of retries
+        summaries = [{"status": "failed", "attempts": 0, "error": "not run"} for _ in experiments]
+        errors = [[] for _ in experiments]  # error of every failed attempt
+        pending = deque((index, 0) for index in range(len(experiments)))  # (experiment index, attempt)
+        free_slots = list(range(self.max_parallel))
+        running = {}  # future -> (experiment index, attempt, slot, executor)
+
+        try:
+            while pending or running:
+                while pending and free_slots:
+                    index, attempt = pending.popleft()
+                    slot = free_slots.pop(0)
+                    executor = self.create_executor()
+                    running[executor.submit(run_experiment, config_dicts[index], slot, attempt)] = \
+                        (index, attempt, slot, executor)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, attempt, slot, executor = running.pop(future)
+                    executor.shutdown()
+                    free_slots.append(slot)
+                    error = future.exception()
+                    experiment_name = config_dicts[index]['SAVE_WEIGHT_DIRECTORY']
+                    if error is None:
+                        summaries[index] = {"status": "completed", "attempts": attempt + 1, **future.result()}
+                        print(f"Experiment {experiment_name} completed")
+                        continue
+                    if isinstance(error, BrokenProcessPool):
+                        error = RuntimeError("worker process died (e.g. killed by the simulator or out of memory)")
+                    errors[index].append(repr(error))
+                    if attempt < self.retries:
+                        print(f"Experiment {experiment_name} failed: {error!r}, retrying")
+                        pending.append((index, attempt + 1))
+                    else:
+                        summaries[index] = {"status": "failed", "attempts": attempt + 1, "error": "; ".join(errors[index])}
+                        print(f"Experiment {experiment_name} failed: {error!r}")
+        finally:
+            for _, _, _, executor in running.values():
+                executor.shutdown(cancel_futures=True)
+
+        for experiment, config_dict, summary, experiment_errors in zip(experiments, config_dicts, summaries, errors):
+            if summary["status"] == "completed" and experiment_errors:
+                summary["error"] = "; ".join(experiment_errors)  # of the attempts before it completed
+        for experiment, config_dict, summary in zip(experiments, config_dicts, summaries):
+            summary.update(SAVE_WEIGHT_DIRECTORY=config_dict["SAVE_WEIGHT_DIRECTORY"],
+                           **{key: value for key, value in experiment.config_dict.items()
+                              if key != "SAVE_WEIGHT_DIRECTORY" and isinstance(value, (int, float, str, bool))})
+            experiment.output = summary
+        self.write_summaries(summaries, summary_path or f"experiments/sweep_{self.sweep_date_time}.csv")
+        return summaries
+
+    @staticmethod
+    def write_summaries(summaries, summary_path):
+        columns = list(dict.fromkeys(column for summary in summaries for column in summary))
+        os.makedirs(os.path.dirname(summary_path) or ".", exist_ok=True)
+        with open(summary_path, "w", newline="") as summary_file:
+            writer = csv.DictWriter(summary_file, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(summaries)
+        print(f"Summary of {len(summaries)} experiments saved at: {summary_path}")
@@ -0,0 +1,220 @@
+import copy
+import time
+
+import airsim
+import numpy as np
+
+from intersection_simulator import IntersectionSimulator
+
+
+class FakeCarClient:
+    """ Local stand-in for airsim.CarClient that simulates the two cars of the intersection with the kinematics of
+        IntersectionSimulator. Only the part of the API used by AirsimManager is implemented. Like AirSim, the world
+        keeps running in wall clock time unless paused, and simContinueForTime advances it by exactly the requested
+        simulated time. """
+
+    def __init__(self, config):
+        self.config = config
+        self.car_names = [self.config.CAR1_NAME, self.config.CAR2_NAME]
+        # spawn positions play the role of the settings file positions (world frame)
+        self.spawn_positions = np.array([self.config.CAR1_INITIAL_POSITION, self.config.CAR2_INITIAL_POSITION],
+                                        dtype=np.float64)
+        self.spawn_yaws = np.radians([self.config.CAR1_INITIAL_YAW, self.config.CAR2_INITIAL_YAW])
+        self.simulator = IntersectionSimulator(n_episodes=1)
+        # views of the single simulated episode
+        self.positions = self.simulator.positions[0]
+        self.yaws = self.simulator.yaws[0]
+        self.speeds = self.simulator.speeds[0]
+        self.car_controls = [airsim.CarControls() for _ in self.car_names]
+        self.paused = False
+        self.last_wall_time = time.perf_counter()
+        self.reset()
+
+    def _car_index(self, vehicle_name):
+        if vehicle_name == "":
+            return 0  # AirSim falls back to the first vehicle
+        return self.car_names.index(vehicle_name)
+
+    def _sync_wall_clock(self):
+        now = time.perf_counter()
+        if not self.paused:
+            self.simulator.advance(now - self.last_wall_time)
+        self.last_wall_time = now
+
+    def _has_collided(self):
+        return bool(self.simulator.collided[0])
+
+    # Connection
+    def confirmConnection(self):
+        print("Connected to fake simulator!")
+
+    def enableApiControl(self, is_enabled, vehicle_name=""):
+        pass
+
+    # Controls
+    def setCarControls(self, controls, vehicle_name=""):
+        self._sync_wall_clock()
+        self.car_controls[self._car_index(vehicle_name)] = copy.copy(controls)
+        self.simulator.throttles[0, self._car_index(vehicle_name)] = controls.throttle
+
+    def getCarControls(self, vehicle_name=""):
+        self._sync_wall_clock()
+        return copy.copy(self.car_controls[self._car_index(vehicle_name)])
+
+    # State
+    def getCarState(self, vehicle_name=""):
+        self._sync_wall_clock()
+        index = self._car_index(vehicle_name)
+        local_position = self.positions[index] - self.spawn_positions[index]
+        # airsim message defaults are shared class attributes, so nested messages are always replaced, never mutated
+        kinematics = airsim.KinematicsState()
+        kinematics.position = airsim.Vector3r(local_position[0], local_position[1], -1)
+        kinematics.orientation = airsim.to_quaternion(0, 0, self.yaws[index])
+        kinematics.linear_velocity = airsim.Vector3r(
+            self.speeds[index] * np.cos(self.yaws[index]), self.speeds[index] * np.sin(self.yaws[index]), 0)
+        collision_info = airsim.CollisionInfo()
+        collision_info.has_collided = self._has_collided()
+        car_state = airsim.CarState()
+        car_state.speed = self.speeds[index]
+        car_state.kinematics_estimated = kinematics
+        car_state.collision = collision_info
+        car_state.timestamp = int(self.simulator.simulation_time * 1e9)
+        return car_state
+
+    def simGetObjectPose(self, object_name):
+        self._sync_wall_clock()
+        index = self._car_index(object_name)
+        position = airsim.Vector3r(self.positions[index][0], self.positions[index][1], -1)
+        return airsim.Pose(position, airsim.to_quaternion(0, 0, self.yaws[index]))
+
+    def simGetCollisionInfo(self, vehicle_name=""):
+        self._sync_wall_clock()
+        collision_info = airsim.CollisionInfo()
+        collision_info.has_collided = self._has_collided()
+        return collision_info
+
+    # World
+    def reset(self):
+        self._sync_wall_clock()
+        self.positions[:] = self.spawn_positions
+        self.yaws[:] = self.spawn_yaws
+        self.speeds[:] = 0.0
+        self.simulator.throttles[:] = 0.0
+        self.simulator.collided[:] = False
+        self.car_controls = [airsim.CarControls() for _ in self.car_names]
+
+    def simSetVehiclePose(self, pose, ignore_collision, vehicle_name=""):
+        # poses are set in the vehicle frame, i.e. relative to the spawn position
+        self._sync_wall_clock()
+        index = self._car_index(vehicle_name)
+        self.positions[index] = self.spawn_positions[index] + [pose.position.x_val, pose.position.y_val]
+        self.yaws[index] = airsim.to_eularian_angles(pose.orientation)[2]
+        self.speeds[index] = 0.0
+        self.simulator.collided[:] = False
+
+    # Clock
+    def simPause(self, is_paused):
+        self._sync_wall_clock()
+        self.paused = is_paused
+
+    def simIsPause(self):
+        self._sync_wall_clock()
+        return self.paused
+
+    def simContinueForTime(self, seconds):
+        self._sync_wall_clock()
+        self.simulator.advance(seconds)
+        self.paused = True
+
+
+def to_msgpack(message):
+    """ Convert airsim messages (and NumPy scalars) to plain msgpack types, recursively """
+    if isinstance(message, airsim.MsgpackMixin):
+        return {key: to_msgpack(value) for key, value in message.__dict__.items()}
+    if isinstance(message, np.generic):
+        return message.item()
+    return message
+
+
+class FakeAirsimServer:
+    """ msgpack-rpc server exposing a FakeCarClient under the RPC names of the AirSim server,
+        so an unmodified airsim.CarClient can connect to it (e.g. one server per rollout worker port). """
+
+    def __init__(self, config):
+        self.fake_client = FakeCarClient(config)
+
+    def ping(self):
+        return True
+
+    def getServerVersion(self):
+        return 1
+
+    def getMinRequiredClientVersion(self):
+        return 1
+
+    def enableApiControl(self, is_enabled, vehicle_name):
+        self.fake_client.enableApiControl(is_enabled, vehicle_name)
+
+    def setCarControls(self, controls, vehicle_name):
+        self.fake_client.setCarControls(airsim.CarControls.from_msgpack(controls), vehicle_name)
+
+    def getCarControls(self, vehicle_name):
+        return to_msgpack(self.fake_client.getCarControls(vehicle_name))
+
+    def getCarState(self, vehicle_name):
+        return to_msgpack(self.fake_client.getCarState(vehicle_name))
+
+    def simGetObjectPose(self, object_name):
+        return to_msgpack(self.fake_client.simGetObjectPose(object_name))
+
+    def simGetCollisionInfo(self, vehicle_name):
+        return to_msgpack(self.fake_client.simGetCollisionInfo(vehicle_name))
+
+    def reset(self):
+        self.fake_client.reset()
+
+    def simSetVehiclePose(self, pose, ignore_collision, vehicle_name):
+        self.fake_client.simSetVehiclePose(airsim.Pose.from_msgpack(pose), ignore_collision, vehicle_name)
+
+    def simPause(self, is_paused):
+        self.fake_client.simPause(is_paused)
+
+    def simIsPaused(self):
+        return self.fake_client.simIsPause()
+
+    def simContinueForTime(self, seconds):
+        self.fake_client.simContinueForTime(seconds)
+
+
+def serve_fake_simulator(config, port, ready=None):
+    """ Blocking - run a FakeAirsimServer on the given port (AirSim's default is 41451).
+        ready (multiprocessing.Event) is set once the server accepts connections """
+    import msgpackrpc
+    server = msgpackrpc.Server(FakeAirsimServer(config), pack_encoding="utf-8", unpack_encoding="utf-8")
+    server.listen(msgpackrpc.Address(config.AIRSIM_IP or "127.0.0.1", port))
+    if ready is not None:
+        ready.set()
+    server.start()
+
+
+def start_fake_simulator_servers(config, ports, timeout=30.0):
+    """ Start one fake simulator server process per port, and wait until every one of them accepts connections,
+        so clients never connect before their server listens. returns: the started processes """
+    import multiprocessing
+    processes = []
+    ready_events = []
+    for port in ports:
+        ready = multiprocessing.Event()
+        process = multiprocessing.Process(target=serve_fake_simulator, args=(config, port, ready), daemon=True)
+        process.start()
+        processes.append(process)
+        ready_events.append(ready)
+    deadline = time.perf_counter() + timeout
+    for port, process, ready in zip(ports, processes, ready_events):
+        while not ready.wait(0.1):
+            if not process.is_alive() or time.perf_counter() > deadline:
+                for started_process in processes:
+                    started_process.terminate()
+                raise RuntimeError(f"Fake simulator server on port {port} did not start "
+                                   f"(exit code {process.exitcode}, e.g. the port is taken)")
+    return processes
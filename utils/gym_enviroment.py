@@ -0,0 +1,65 @@
+import gymnasium as gym
+import numpy as np
+from gymnasium import spaces
+
+from reward_relabeling import calculate_rewards
+
+# throttle of car1 for each action, as in RL.action_to_controls
+ACTION_TO_THROTTLE = np.array([0.4, 0.75])
+
+
+class AirSimGymEnv(gym.Env):
+    """ One intersection episode on the simulator of an AirsimManager (AirSim, the fake simulator or a fake simulator
+        server), with the spaces and rewards of IntersectionVecEnv:
+        observation: car1 (x, y, Vx, Vy) followed by car2 (x, y, Vx, Vy)
+        action: throttle of car1 (0 -> 0.4, 1 -> 0.75), car2 drives at CAR2_CONSTANT_ACTION throttle
+        reward: RL.calculate_reward (reward_relabeling.calculate_rewards)
+        An episode ends on collision, when car1 reaches its target, or after MAX_EPISODE_STEPS (truncation).
+        reset() does not move the cars: placing them is up to the caller (the episode loop of model_training,
+        EpisodeResetWrapper). """
+
+    def __init__(self, config, airsim_manager):
+        super().__init__()
+        self.config = config
+        self.airsim_manager = airsim_manager
+        self.observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(8,), dtype=np.float32)
+        self.action_space = spaces.Discrete(len(ACTION_TO_THROTTLE))
+        self.episode_steps = 0
+
+    def get_observation(self, snapshot):
+        return np.concatenate([self.airsim_manager.get_car1_state_from_snapshot(snapshot),
+                               self.airsim_manager.get_car2_state_from_snapshot(snapshot)]).astype(np.float32)
+
+    def reset(self, seed=None, options=None):
+        super().reset(seed=seed)
+        self.episode_steps = 0
+        return self.get_observation(self.airsim_manager.snapshot()), {}
+
+    def step(self, action):
+        car_names = [self.config.CAR1_NAME, self.config.CAR2_NAME]
+        car1_controls, car2_controls = self.airsim_manager.get_cars_controls(car_names)
+        car1_controls.throttle = float(ACTION_TO_THROTTLE[int(action)])
+        car2_controls.throttle = self.config.CAR2_CONSTANT_ACTION
+        self.airsim_manager.set_cars_controls([car1_controls, car2_controls], car_names)
+        self.airsim_manager.advance_simulation()
+        self.episode_steps += 1
+
+        snapshot = self.airsim_manager.snapshot()
+        observation = self.get_observation(snapshot)
+        collision_occurred = self.airsim_manager.collision_occurred_in_snapshot(snapshot)
+        reached_target = bool(self.airsim_manager.has_reached_target(observation[:4]))
+        reward = calculate_rewards(self.config, observation[np.newaxis, :4], np.array([collision_occurred]),
+                                   np.array([int(action)]), self.config.CAR2_CONSTANT_ACTION,
+                                   np.array([self.airsim_manager.get_cars_distance_from_snapshot(snapshot)]))[0]
+        terminated = collision_occurred or reached_target
+        truncated = not terminated and self.episode_steps >= self.config.MAX_EPISODE_STEPS
+        return observation, float(reward), terminated, truncated, {}
+
+    def pause_simulation(self):
+        self.airsim_manager.pause_simulation()
+
+    def resume_simulation(self):
+        self.airsim_manager.resume_simulation()
+
+    def close(self):
+        self.airsim_manager.close()
@@ -0,0 +1,169 @@
+import types
+
+import numpy as np
+
+# Kinematic model of the intersection
+MAX_SPEED = 20.0  # m/s reached with throttle = 1
+SPEED_TIME_CONSTANT = 1.0  # seconds for the speed to close ~63% of the gap to the target speed
+COLLISION_DISTANCE = 3.0  # meters between car centers
+MAX_INTEGRATION_STEP = 0.01  # seconds, keeps collision detection from tunneling
+CAR1_INDEX = 0
+CAR2_INDEX = 1
+
+
+class IntersectionSimulator:
+    """ Pure NumPy kinematics of two cars crossing an intersection, for n_episodes independent episodes at once.
+        Every car drives straight along its yaw, its speed following throttle * MAX_SPEED with a first order lag.
+        Cars of an episode that get closer than COLLISION_DISTANCE collide and stop. """
+
+    def __init__(self, n_episodes):
+        self.n_episodes = n_episodes
+        self.positions = np.zeros((n_episodes, 2, 2))  # episode, car, (x, y)
+        self.yaws = np.zeros((n_episodes, 2))  # radians
+        self.speeds = np.zeros((n_episodes, 2))
+        self.throttles = np.zeros((n_episodes, 2))
+        self.collided = np.zeros(n_episodes, dtype=bool)
+        self.simulation_time = 0.0
+
+    def velocities(self):
+        """ returns: (n_episodes, 2 cars, (Vx, Vy)) """
+        return self.speeds[..., np.newaxis] * np.stack([np.cos(self.yaws), np.sin(self.yaws)], axis=-1)
+
+    def states(self):
+        """ returns: (n_episodes, 2 cars, (x, y, Vx, Vy)) """
+        return np.concatenate([self.positions, self.velocities()], axis=-1)
+
+    def advance(self, duration):
+        if duration <= 0:
+            return
+        n_steps = int(np.ceil(duration / MAX_INTEGRATION_STEP))
+        dt = duration / n_steps
+        speed_blend = min(1.0, dt / SPEED_TIME_CONSTANT)
+        directions = np.stack([np.cos(self.yaws), np.sin(self.yaws)], axis=-1)
+        for _ in range(n_steps):
+            self.speeds += (self.throttles * MAX_SPEED - self.speeds) * speed_blend
+            self.speeds[self.collided] = 0.0
+            self.positions += self.speeds[..., np.newaxis] * directions * dt
+            cars_offset = self.positions[:, CAR1_INDEX] - self.positions[:, CAR2_INDEX]
+            self.collided |= np.einsum("ij,ij->i", cars_offset, cars_offset) < COLLISION_DISTANCE ** 2
+        self.speeds[self.collided] = 0.0
+        self.simulation_time += duration
+
+
+class VectorizedAirsimManager:
+    """ Drop-in replacement of AirsimManager backed by IntersectionSimulator instead of AirSim, running n_episodes
+        episodes side by side. States, collisions and rewards are returned with a leading episode axis; with
+        n_episodes=1 that axis is dropped, so RL can use it unmodified (e.g. for benchmarks and regression tests).
+        The simulation always runs in lockstep: advance_simulation() moves it on by TIME_BETWEEN_STEPS. """
+
+    def __init__(self, config, n_episodes=1):
+        self.config = config
+        self.n_episodes = n_episodes
+        self.simulator = IntersectionSimulator(n_episodes)
+        self.car_indices = {self.config.CAR1_NAME: CAR1_INDEX, self.config.CAR2_NAME: CAR2_INDEX}
+        self.simulation_paused = False
+        # per manager, set_car2_initial_position_and_yaw must not change the config other managers / RL read
+        self.set_car2_initial_direction_manually = self.config.SET_CAR2_INITIAL_DIRECTION_MANUALLY
+        self.reset_cars_to_initial_positions()
+
+    def _unbatch(self, values):
+        return values[0] if self.n_episodes == 1 else values
+
+    def reset_cars_to_initial_positions(self, episodes=None):
+        """ episodes: boolean mask or indices of the episodes to reset (None -> all) """
+        if episodes is None:
+            episodes = np.arange(self.n_episodes)
+        episodes = np.arange(self.n_episodes)[episodes]
+        # pick at random (car 2 goes from left/right)
+        left_or_right = np.random.choice([1, -1], size=len(episodes))
+        if self.set_car2_initial_direction_manually:
+            left_or_right[:] = self.config.CAR2_INITIAL_DIRECTION
+        simulator = self.simulator
+        simulator.positions[episodes, CAR1_INDEX, 0] = self.config.CAR1_INITIAL_POSITION[0]
+        simulator.positions[episodes, CAR1_INDEX, 1] = left_or_right * self.config.CAR1_INITIAL_POSITION[1]
+        simulator.positions[episodes, CAR2_INDEX, 0] = self.config.CAR2_INITIAL_POSITION[0]
+        simulator.positions[episodes, CAR2_INDEX, 1] = left_or_right * self.config.CAR2_INITIAL_POSITION[1]
+        simulator.yaws[episodes, CAR1_INDEX] = np.radians(self.config.CAR1_INITIAL_YAW)
+        simulator.yaws[episodes, CAR2_INDEX] = np.radians(left_or_right * self.config.CAR2_INITIAL_YAW)
+        simulator.speeds[episodes] = 0.0
+        simulator.throttles[episodes] = 0.0
+        simulator.collided[episodes] = False
+
+    def set_car2_initial_position_and_yaw(self):
+        # the side of car2 is drawn for every episode in reset_cars_to_initial_positions
+        self.set_car2_initial_direction_manually = False
+
+    # Simulation clock
+    def advance_simulation(self):
+        if not self.simulation_paused:
+            self.simulator.advance(self.config.TIME_BETWEEN_STEPS)
+
+    def pause_simulation(self):
+        self.simulation_paused = True
+
+    def resume_simulation(self):
+        self.simulation_paused = False
+
+    def is_simulation_paused(self):
+        return self.simulation_paused
+
+    # Controls
+    def get_car_controls(self, car_name):
+        throttles = self.simulator.throttles[:, self.car_indices[car_name]]
+        return types.SimpleNamespace(throttle=self._unbatch(throttles.copy()))
+
+    def set_car_controls(self, updated_car_controls, car_name):
+        """ updated_car_controls.throttle: a scalar for all episodes or one throttle per episode """
+        self.simulator.throttles[:, self.car_indices[car_name]] = updated_car_controls.throttle
+
+    # State
+    def get_car1_state(self, logger=None):
+        car1_state = self._unbatch(self.simulator.states()[:, CAR1_INDEX])
+        if logger is not None and self.config.LOG_CAR_STATES:
+            logger.log_state(car1_state, self.config.CAR1_NAME)
+        return car1_state
+
+    def get_car2_state(self, logger=None):
+        car2_state = self._unbatch(self.simulator.states()[:, CAR2_INDEX])
+        if logger is not None and self.config.LOG_CAR_STATES:
+            logger.log_state(car2_state, self.config.CAR2_NAME)
+        return car2_state
+
+    def snapshot(self):
+        """ returns: (n_episodes, 2 cars, (x, y, Vx, Vy, has_collided)) - collision as 0 / 1 """
+        states = self.simulator.states()
+        collided = np.broadcast_to(self.simulator.collided[:, np.newaxis, np.newaxis], (self.n_episodes, 2, 1))
+        return self._unbatch(np.concatenate([states, collided], axis=-1))
+
+    def get_car1_state_from_snapshot(self, snapshot, logger=None):
+        car1_state = snapshot[..., CAR1_INDEX, :4].copy()
+        if logger is not None and self.config.LOG_CAR_STATES:
+            logger.log_state(car1_state, self.config.CAR1_NAME)
+        return car1_state
+
+    def get_car2_state_from_snapshot(self, snapshot, logger=None):
+        car2_state = snapshot[..., CAR2_INDEX, :4].copy()
+        if logger is not None and self.config.LOG_CAR_STATES:
+            logger.log_state(car2_state, self.config.CAR2_NAME)
+        return car2_state
+
+    @staticmethod
+    def collision_occurred_in_snapshot(snapshot):
+        return snapshot[..., CAR1_INDEX, 4] > 0
+
+    @staticmethod
+    def get_cars_distance_from_snapshot(snapshot):
+        cars_offset = snapshot[..., CAR1_INDEX, :2] - snapshot[..., CAR2_INDEX, :2]
+        return np.sum(np.square(cars_offset), axis=-1)
+
+    def get_cars_distance(self):
+        return self.get_cars_distance_from_snapshot(self.snapshot())
+
+    def collision_occurred(self):
+        return self._unbatch(self.simulator.collided.copy())
+
+    def get_collision_occured_outside(self):
+        return self._unbatch(self.simulator.collided.astype(int))
+
+    def has_reached_target(self, car_state):
+        return car_state[..., 0] > self.config.CAR1_DESIRED_POSITION[0]
@@ -0,0 +1,91 @@
+import types
+
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.vec_env import VecEnv
+
+from intersection_simulator import VectorizedAirsimManager
+from reward_relabeling import calculate_rewards
+
+# throttle of car1 for each action, as in RL.action_to_controls
+ACTION_TO_THROTTLE = np.array([0.4, 0.75])
+
+
+class IntersectionVecEnv(VecEnv):
+    """ n_envs intersection episodes stepped together by VectorizedAirsimManager, usable directly by
+        Stable-Baselines3 (e.g. PPO('MlpPolicy', IntersectionVecEnv(config, 1024))).
+        observation: car1 (x, y, Vx, Vy) followed by car2 (x, y, Vx, Vy)
+        action: throttle of car1 (0 -> 0.4, 1 -> 0.75), car2 drives at CAR2_CONSTANT_ACTION throttle
+        reward: RL.calculate_reward of every episode (reward_relabeling.calculate_rewards)
+        An episode ends on collision, when car1 reaches its target, or after MAX_EPISODE_STEPS (truncation),
+        after which it is reset automatically (the last observation is in info["terminal_observation"]). """
+
+    def __init__(self, config, n_envs):
+        self.render_mode = None
+        observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(8,), dtype=np.float32)
+        super().__init__(n_envs, observation_space, spaces.Discrete(len(ACTION_TO_THROTTLE)))
+        self.config = config
+        self.airsim_manager = VectorizedAirsimManager(config, n_envs)
+        self.episode_steps = np.zeros(n_envs, dtype=np.int64)
+        self.actions = np.zeros(n_envs, dtype=np.int64)
+        self.car1_controls = types.SimpleNamespace(throttle=np.zeros(n_envs))
+        self.car2_controls = types.SimpleNamespace(throttle=self.config.CAR2_CONSTANT_ACTION)
+
+    def get_observations(self):
+        return self.airsim_manager.simulator.states().reshape(self.num_envs, 8).astype(np.float32)
+
+    def reset(self):
+        if self._seeds[0] is not None:
+            np.random.seed(self._seeds[0])
+        self._reset_seeds()
+        self.airsim_manager.reset_cars_to_initial_positions()
+        self.episode_steps[:] = 0
+        return self.get_observations()
+
+    def step_async(self, actions):
+        self.actions = np.asarray(actions, dtype=np.int64).reshape(self.num_envs)
+
+    def step_wait(self):
+        self.car1_controls.throttle = ACTION_TO_THROTTLE[self.actions]
+        self.airsim_manager.set_car_controls(self.car1_controls, self.config.CAR1_NAME)
+        self.airsim_manager.set_car_controls(self.car2_controls, self.config.CAR2_NAME)
+        self.airsim_manager.advance_simulation()
+        self.episode_steps += 1
+
+        states = self.airsim_manager.simulator.states()  # (n_envs, 2 cars, (x, y, Vx, Vy))
+        observations = states.reshape(self.num_envs, 8).astype(np.float32)
+        collision_occurred = self.airsim_manager.simulator.collided.copy()
+        reached_target = self.airsim_manager.has_reached_target(observations[:, :4])
+        rewards = calculate_rewards(self.config, observations[:, :4], collision_occurred, self.actions,
+                                    self.config.CAR2_CONSTANT_ACTION,
+                                    self.airsim_manager.get_cars_distance_from_snapshot(states))
+        terminated = collision_occurred | reached_target
+        truncated = ~terminated & (self.episode_steps >= self.config.MAX_EPISODE_STEPS)
+        dones = terminated | truncated
+
+        infos = [{} for _ in range(self.num_envs)]
+        done_envs = np.flatnonzero(dones)
+        if len(done_envs) > 0:
+            for env_index in done_envs:
+                infos[env_index]["terminal_observation"] = observations[env_index].copy()
+                infos[env_index]["TimeLimit.truncated"] = bool(truncated[env_index])
+            self.airsim_manager.reset_cars_to_initial_positions(done_envs)
+            self.episode_steps[done_envs] = 0
+            observations[done_envs] = self.get_observations()[done_envs]
+        return observations, rewards, dones, infos
+
+    def close(self):
+        pass
+
+    # The episodes are not separate gym environments, so there is nothing to forward attributes or methods to
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self, method_name)(*method_args, **method_kwargs) for _ in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
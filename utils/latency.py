@@ -0,0 +1,52 @@
+import math
+
+import numpy as np
+
+MIN_LATENCY = 1e-6  # seconds, lower edge of the first bucket
+MAX_LATENCY = 100.0  # seconds, upper edge of the last bucket
+BUCKETS_PER_DECADE = 20  # ~12% relative bucket width
+
+
+class LatencyHistogram:
+    """ Fixed size histogram of durations with log-spaced buckets: O(1) record, constant memory,
+        percentiles accurate to the bucket width. """
+
+    def __init__(self):
+        self.n_buckets = int(math.log10(MAX_LATENCY / MIN_LATENCY) * BUCKETS_PER_DECADE)
+        self.bucket_upper_edges = MIN_LATENCY * 10 ** (np.arange(1, self.n_buckets + 1) / BUCKETS_PER_DECADE)
+        self.counts = np.zeros(self.n_buckets, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds):
+        if seconds <= MIN_LATENCY:
+            bucket = 0
+        else:
+            bucket = min(int(math.log10(seconds / MIN_LATENCY) * BUCKETS_PER_DECADE), self.n_buckets - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        """ Upper edge of the bucket holding the given percentile, in seconds """
+        if self.count == 0:
+            return 0.0
+        bucket = np.searchsorted(np.cumsum(self.counts), percent / 100 * self.count)
+        return float(self.bucket_upper_edges[min(bucket, self.n_buckets - 1)])
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.mean(),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+    def reset(self):
+        self.counts[:] = 0
+        self.count = 0
+        self.total = 0.0
@@ -0,0 +1,29 @@
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """ Stand-in for a module (or an attribute of a module, e.g. tensorflow.keras) that is only imported on first
+        attribute access, so importing our modules does not pay for TensorFlow / torch until a backend is used.
+        After the first access the attributes of the real module are copied in, so later lookups are plain. """
+
+    def __init__(self, module_name, attribute_name=None):
+        super().__init__(module_name if attribute_name is None else f"{module_name}.{attribute_name}")
+        self._lazy_module_name = module_name
+        self._lazy_attribute_name = attribute_name
+
+    def _load(self):
+        module = importlib.import_module(self._lazy_module_name)
+        if self._lazy_attribute_name is not None:
+            module = getattr(module, self._lazy_attribute_name)
+        self.__dict__.update({name: value for name, value in vars(module).items() if not name.startswith("__")})
+        return module
+
+    def __getattr__(self, name):
+        # only called for attributes not copied in yet (first access, or submodules the module loads lazily itself)
+        return getattr(self._load(), name)
+
+
+def lazy_import(module_name, attribute_name=None):
+    """ tf = lazy_import("tensorflow") / keras = lazy_import("tensorflow", "keras") """
+    return LazyModule(module_name, attribute_name)
@@ -1,7 +1,21 @@
-import tensorflow as tf
+import atexit
+import queue
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from lazy_import import lazy_import
+
+tf = lazy_import("tensorflow")
 
 
 class Logger:
+    """ The training thread only puts summaries on a bounded queue, and a writer thread writes them to TensorBoard in
+        batches, flushing every LOG_FLUSH_INTERVAL seconds. When the queue is full the summary is dropped (and counted),
+        so logging never blocks the simulator loop. Per step console values are aggregated into periodic summaries.
+        close() writes what is left (called at exit for loggers that were not closed). """
 
     def __init__(self, config):
         self.config = config
@@ -11,35 +25,103 @@ class Logger:
         self.weights_and_gradients_logger = tf.summary.create_file_writer(self.weights_and_gradients_log_dir)
         self.same_action_selected_list = []
 
+        self.summaries_queue = queue.Queue(maxsize=self.config.LOG_QUEUE_SIZE)
+        self.dropped_summaries = 0
+        self.scalar_calls = defaultdict(int)  # log name -> calls, for the sampling rate
+        self.console_sums = defaultdict(float)
+        self.console_counts = defaultdict(int)
+        self.stop_writing = threading.Event()
+        self.writer_thread = threading.Thread(target=self.write_summaries, name="logger", daemon=True)
+        self.writer_thread.start()
+        atexit.register(self.close)
+
+    def enqueue_summary(self, summary):
+        """ summary: (file writer, tf.summary function, name, step, value) """
+        try:
+            self.summaries_queue.put_nowait(summary)
+        except queue.Full:
+            self.dropped_summaries += 1
+
+    def write_summaries(self):
+        last_flush_time = time.perf_counter()
+        while not (self.stop_writing.is_set() and self.summaries_queue.empty()):
+            summaries = []
+            try:
+                summaries.append(self.summaries_queue.get(timeout=0.1))
+                while True:
+                    summaries.append(self.summaries_queue.get_nowait())
+            except queue.Empty:
+                pass
+            for file_writer in [self.rewards_and_losses_logger, self.weights_and_gradients_logger]:
+                with file_writer.as_default():
+                    for summary_writer, summary_function, name, step, value in summaries:
+                        if summary_writer is file_writer:
+                            summary_function(name, value, step=step)
+            if time.perf_counter() - last_flush_time > self.config.LOG_FLUSH_INTERVAL:
+                self.flush_file_writers()
+                last_flush_time = time.perf_counter()
+        self.flush_file_writers()
+
+    def flush_file_writers(self):
+        self.rewards_and_losses_logger.flush()
+        self.weights_and_gradients_logger.flush()
+
+    def close(self):
+        if self.stop_writing.is_set():
+            return
+        atexit.unregister(self.close)  # the exit hook would keep a closed logger (and its file writers) alive
+        self.stop_writing.set()
+        self.writer_thread.join()
+        if self.dropped_summaries > 0:
+            print(f"Logger dropped {self.dropped_summaries} summaries (LOG_QUEUE_SIZE = {self.config.LOG_QUEUE_SIZE})")
+
     def log_scaler(self, log_name, log_x_value, log_y_value):
-        with self.rewards_and_losses_logger.as_default():
-            tf.summary.scalar(log_name, step=log_x_value, data=log_y_value)
+        self.scalar_calls[log_name] += 1
+        if (self.scalar_calls[log_name] - 1) % self.config.LOG_SCALARS_EVERY_X_CALLS != 0:
+            return
+        self.enqueue_summary((self.rewards_and_losses_logger, tf.summary.scalar, log_name, int(log_x_value),
+                              float(log_y_value)))
+
+    def downsample_on_device(self, tensor):
+        """ Strided subset of at most LOG_HISTOGRAM_MAX_VALUES values, taken before copying off the device """
+        values = tf.reshape(tensor, [-1])
+        stride = -(-int(values.shape[0]) // self.config.LOG_HISTOGRAM_MAX_VALUES)
+        return values[::stride].numpy()
 
     def log_weights_and_gradients(self, gradients, episode_counter, network):
         """ Log gradients and weights to TensorBoard. """
         if episode_counter % self.config.LOG_WEIGHTS_AND_GRADIENTS_EVERY_X_EPISODES == 0:
-            with self.weights_and_gradients_logger.as_default():
-                # weights
-                for var in network.trainable_variables:
-                    if "bias" not in var.name:
-                        tf.summary.histogram(var.name, var, step=episode_counter)
-                # gradients
-                for grad, var in zip(gradients, network.trainable_variables):
-                    if "bias" not in var.name:
-                        tf.summary.histogram(f'{var.name}_gradient', grad, step=episode_counter)
-
-    @staticmethod
-    def log_actions_selected_random(random_action_selected):
-        print(f"random action: {random_action_selected}")
-        print("-" * 10)
+            # weights
+            for var in network.trainable_variables:
+                if "bias" not in var.name:
+                    self.enqueue_summary((self.weights_and_gradients_logger, tf.summary.histogram, var.name,
+                                          episode_counter, self.downsample_on_device(var)))
+            # gradients
+            for grad, var in zip(gradients, network.trainable_variables):
+                if "bias" not in var.name:
+                    self.enqueue_summary((self.weights_and_gradients_logger, tf.summary.histogram,
+                                          f'{var.name}_gradient', episode_counter, self.downsample_on_device(grad)))
+
+    def log_console(self, name, value):
+        """ Aggregate a per step console value, printed as its mean every LOG_CONSOLE_SUMMARY_EVERY_X_STEPS values """
+        self.console_sums[name] += value
+        self.console_counts[name] += 1
+        if self.console_counts[name] >= self.config.LOG_CONSOLE_SUMMARY_EVERY_X_STEPS:
+            print(f"{name}: mean {self.console_sums[name] / self.console_counts[name]:.3f} "
+                  f"over the last {self.console_counts[name]} steps")
+            self.console_sums[name] = 0.0
+            self.console_counts[name] = 0
+
+    def log_actions_selected_random(self, random_action_selected):
+        self.log_console("random action", np.mean(random_action_selected))
 
     def log_actions_selected(self, network, car1_state, car2_state, car1_action_using_master, car2_action_using_master):
         # network_agent_only = create_network_using_agent_only_from_original(network)
         # actions_from_agent_only = [network_agent_only.predict(np.reshape(state, (1, -1)), verbose=0).argmax()
         #                            for state in [car1_state, car2_state]]
         # print(f"Actions with agent only: {tuple(actions_from_agent_only)}")
-        print(f"Actions with master:     {(car1_action_using_master, car2_action_using_master)}")
-        print("-" * 10)
+        self.log_console("car1 action with master", car1_action_using_master)
+        self.log_console("car2 action with master", car2_action_using_master)
 
         if self.config.LOG_SAME_ACTION_SELECTED_IN_TRAJECTORY:
             if car1_action_using_master == car2_action_using_master:
@@ -0,0 +1,52 @@
+import numpy as np
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0.0),
+    "tanh": np.tanh,
+    "sigmoid": lambda x: 1.0 / (1.0 + np.exp(-x)),
+}
+
+
+class NumpyNetwork:
+    """ Pure NumPy forward pass of a sequential stack of Dense / BatchNormalization / activation / Dropout layers
+        (e.g. the network of NN_handler.init_network_agent_only), in inference mode.
+        The weights are a snapshot - call refresh() after the Keras model was trained. """
+
+    def __init__(self, keras_network):
+        self.keras_network = keras_network
+        self.forward_steps = []
+        self.refresh()
+
+    def refresh(self):
+        self.forward_steps = [self.layer_to_forward_step(layer) for layer in self.keras_network.layers]
+        self.forward_steps = [step for step in self.forward_steps if step is not None]
+
+    @staticmethod
+    def layer_to_forward_step(layer):
+        layer_type = type(layer).__name__
+        if layer_type in ["InputLayer", "Dropout"]:
+            return None
+        if layer_type == "Dense":
+            kernel, bias = [np.asarray(weight, dtype=np.float32) for weight in layer.get_weights()]
+            activation = ACTIVATIONS[layer.get_config()["activation"]]
+            return lambda x: activation(x @ kernel + bias)
+        if layer_type == "BatchNormalization":
+            gamma, beta, moving_mean, moving_variance = layer.get_weights()
+            scale = (gamma / np.sqrt(moving_variance + layer.epsilon)).astype(np.float32)
+            shift = (beta - moving_mean * scale).astype(np.float32)
+            return lambda x: x * scale + shift
+        if layer_type == "LeakyReLU":
+            layer_config = layer.get_config()
+            negative_slope = layer_config.get("negative_slope", layer_config.get("alpha"))
+            return lambda x: np.where(x > 0, x, x * negative_slope)
+        if layer_type in ["ReLU", "Activation"]:
+            activation = ACTIVATIONS[layer.get_config().get("activation", "relu")]
+            return activation
+        raise ValueError(f"NumpyNetwork does not support layer {layer.name} of type {layer_type}")
+
+    def predict(self, inputs):
+        x = np.asarray(inputs, dtype=np.float32)
+        for forward_step in self.forward_steps:
+            x = forward_step(x)
+        return x
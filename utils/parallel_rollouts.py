@@ -0,0 +1,65 @@
+import copy
+
+import gymnasium as gym
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv
+from gym_enviroment import AirSimGymEnv
+from airsim_manager import AirsimManager
+from fake_airsim import start_fake_simulator_servers
+from intersection_vec_env import IntersectionVecEnv
+
+
+class EpisodeResetWrapper(gym.Wrapper):
+    """ Does inside the environment what the episode loop of model_training does around it, so that whoever
+        drives env.reset() (e.g. PPO.learn, a subprocess worker) gets the same episodes:
+        reset -> resume the simulation, place car2 on a random side, reset the cars
+        step -> pause the simulation on collision """
+
+    def __init__(self, env, config):
+        super().__init__(env)
+        self.config = config
+
+    def reset(self, **kwargs):
+        self.env.resume_simulation()
+        self.env.airsim_manager.set_car2_initial_position_and_yaw()
+        self.env.airsim_manager.reset_cars_to_initial_positions()
+        return self.env.reset(**kwargs)
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        if reward == self.config.COLLISION_REWARD:
+            self.env.pause_simulation()
+        return obs, reward, terminated, truncated, info
+
+
+def get_worker_config(config, worker_index):
+    worker_config = copy.deepcopy(config)
+    worker_config.AIRSIM_PORT = config.AIRSIM_PORT + worker_index
+    return worker_config
+
+
+def make_env(config, worker_index):
+    def init_env():
+        worker_config = get_worker_config(config, worker_index)
+        return EpisodeResetWrapper(AirSimGymEnv(worker_config, AirsimManager(worker_config)), worker_config)
+    return init_env
+
+
+def create_rollout_vec_env(config):
+    """ One environment per rollout worker, each with its own AirsimManager connected to AIRSIM_PORT + index.
+        NUM_ROLLOUT_WORKERS > 1 -> every environment runs in its own subprocess.
+        SIMULATOR_BACKEND = "fake_server" -> a fake simulator server is started for every worker port first.
+        SIMULATOR_BACKEND = "vectorized" -> a single process IntersectionVecEnv with NUM_ROLLOUT_WORKERS episodes.
+        returns: vec_env, fake simulator server processes (to terminate when done) """
+    n_workers = config.NUM_ROLLOUT_WORKERS
+    if config.SIMULATOR_BACKEND == "vectorized":
+        return IntersectionVecEnv(config, n_workers), []
+    server_processes = []
+    if config.SIMULATOR_BACKEND == "fake_server":
+        server_processes = start_fake_simulator_servers(config, [config.AIRSIM_PORT + index
+                                                                 for index in range(n_workers)])
+    env_fns = [make_env(config, worker_index) for worker_index in range(n_workers)]
+    if n_workers > 1:
+        vec_env = SubprocVecEnv(env_fns, start_method="spawn")
+    else:
+        vec_env = DummyVecEnv(env_fns)
+    return vec_env, server_processes
@@ -0,0 +1,44 @@
+import csv
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+
+class PlottingUtils:
+    """ Training curves drawn at the end of model_training. Every plot_* call opens a figure, show_plots shows them
+        (returns right away with a non interactive matplotlib backend, e.g. MPLBACKEND=Agg) and closes them. """
+
+    @staticmethod
+    def plot_losses(path):
+        """ Losses the stable_baselines3 logger wrote to path/progress.csv, also saved as path/losses.png
+            (no progress.csv, e.g. a DQN run -> nothing to plot) """
+        progress_path = os.path.join(path, "progress.csv")
+        if not os.path.exists(progress_path):
+            return
+        with open(progress_path, newline="") as progress_file:
+            rows = list(csv.DictReader(progress_file))
+        loss_columns = [column for column in (rows[0] if rows else {}) if column.endswith("loss")]
+        if not loss_columns:
+            return
+        plt.figure()
+        for column in loss_columns:
+            values = np.array([float(row[column]) if row[column] else np.nan for row in rows])
+            plt.plot(np.flatnonzero(~np.isnan(values)), values[~np.isnan(values)], label=column)
+        plt.xlabel("Update")
+        plt.ylabel("Loss")
+        plt.legend()
+        plt.savefig(os.path.join(path, "losses.png"))
+
+    @staticmethod
+    def plot_rewards(rewards):
+        """ rewards: sum of rewards of every episode """
+        plt.figure()
+        plt.plot(np.ravel(np.asarray(rewards, dtype=np.float64)))
+        plt.xlabel("Episode")
+        plt.ylabel("Sum of rewards")
+
+    @staticmethod
+    def show_plots():
+        plt.show()
+        plt.close("all")
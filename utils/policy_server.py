@@ -0,0 +1,170 @@
+import io
+import json
+import pickle
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+
+# torch storage classes of a saved state dict -> dtype of their raw bytes
+TORCH_STORAGE_DTYPES = {
+    "FloatStorage": np.float32,
+    "DoubleStorage": np.float64,
+    "HalfStorage": np.float16,
+    "LongStorage": np.int64,
+    "IntStorage": np.int32,
+    "ShortStorage": np.int16,
+    "CharStorage": np.int8,
+    "ByteStorage": np.uint8,
+    "BoolStorage": np.bool_,
+}
+ACTIVATIONS = {
+    "Tanh": np.tanh,  # default activation_fn of the SB3 ActorCriticPolicy
+    "ReLU": lambda x: np.maximum(x, 0.0),
+}
+
+
+def rebuild_tensor(storage, storage_offset, size, stride, *args):
+    """ torch._utils._rebuild_tensor_v2, returning a NumPy array """
+    return np.lib.stride_tricks.as_strided(storage[storage_offset:], shape=tuple(size),
+                                           strides=[element_stride * storage.itemsize for element_stride in stride]
+                                           ).copy()
+
+
+class StateDictUnpickler(pickle.Unpickler):
+    """ Reads the state dict of a torch.save archive (e.g. policy.pth of an SB3 model.zip) into NumPy arrays,
+        without torch. Only the globals a plain state dict is made of are allowed, anything else is an error. """
+
+    def __init__(self, pickle_file, archive, archive_prefix):
+        super().__init__(pickle_file)
+        self.archive = archive
+        self.archive_prefix = archive_prefix
+        byteorder = archive.read(f"{archive_prefix}/byteorder").decode() if \
+            f"{archive_prefix}/byteorder" in archive.namelist() else "little"
+        self.byteorder = "<" if byteorder == "little" else ">"
+
+    def find_class(self, module, name):
+        if (module, name) == ("collections", "OrderedDict"):
+            return OrderedDict
+        if (module, name) == ("torch._utils", "_rebuild_tensor_v2"):
+            return rebuild_tensor
+        if (module, name) == ("torch._utils", "_rebuild_parameter"):
+            return lambda data, requires_grad, backward_hooks: data
+        if module == "torch" and name in TORCH_STORAGE_DTYPES:
+            return TORCH_STORAGE_DTYPES[name]
+        raise pickle.UnpicklingError(f"{module}.{name} is not part of a state dict")
+
+    def persistent_load(self, persistent_id):
+        # ('storage', storage type, key, location, number of elements)
+        _, storage_dtype, key, _, _ = persistent_id
+        storage_bytes = self.archive.read(f"{self.archive_prefix}/data/{key}")
+        return np.frombuffer(storage_bytes, dtype=np.dtype(storage_dtype).newbyteorder(self.byteorder))
+
+
+def load_state_dict(pth_bytes):
+    """ pth_bytes: content of a torch.save(state_dict) zip archive -> {parameter name: NumPy array} """
+    with zipfile.ZipFile(io.BytesIO(pth_bytes)) as archive:
+        pickle_name = next(name for name in archive.namelist() if name.endswith("data.pkl"))
+        archive_prefix = pickle_name[:-len("/data.pkl")]
+        with archive.open(pickle_name) as pickle_file:
+            return StateDictUnpickler(pickle_file, archive, archive_prefix).load()
+
+
+class NumpyMlpPolicy:
+    """ Inference only forward pass of the MlpPolicy of a PPO model.zip (Box observations, Discrete actions) in NumPy:
+        loads the policy weights once, no torch / stable_baselines3 / environment needed.
+            policy = NumpyMlpPolicy.load("experiments/<run>/model.zip")
+            actions = policy.act(observations)  # (n_cars or n_envs, observation size) -> (n,)
+        predict() mirrors PPO.predict, so it can stand in for the loaded PPO model in the episode loop. """
+
+    def __init__(self, state_dict, activation_name="Tanh"):
+        self.activation = ACTIVATIONS[activation_name]
+        self.policy_layers = []
+        layer_index = 0
+        while f"mlp_extractor.policy_net.{layer_index}.weight" in state_dict:
+            self.policy_layers.append(self.dense_weights(state_dict, f"mlp_extractor.policy_net.{layer_index}"))
+            layer_index += 2  # policy_net is Sequential(Linear, activation, Linear, activation, ...)
+        self.action_kernel, self.action_bias = self.dense_weights(state_dict, "action_net")
+        self.value_layers = []
+        layer_index = 0
+        while f"mlp_extractor.value_net.{layer_index}.weight" in state_dict:
+            self.value_layers.append(self.dense_weights(state_dict, f"mlp_extractor.value_net.{layer_index}"))
+            layer_index += 2
+        self.value_kernel, self.value_bias = self.dense_weights(state_dict, "value_net")
+        self.observation_size = self.policy_layers[0][0].shape[0] if self.policy_layers else \
+            self.action_kernel.shape[0]
+
+    @staticmethod
+    def dense_weights(state_dict, layer_name):
+        """ torch Linear (out, in) weight -> (in, out) kernel, so that layer(x) = x @ kernel + bias """
+        kernel = np.ascontiguousarray(state_dict[f"{layer_name}.weight"].T, dtype=np.float32)
+        return kernel, state_dict[f"{layer_name}.bias"].astype(np.float32)
+
+    @classmethod
+    def load(cls, model_path):
+        with zipfile.ZipFile(model_path) as model_archive:
+            data = json.loads(model_archive.read("data"))
+            state_dict = load_state_dict(model_archive.read("policy.pth"))
+        if "Discrete" not in data["action_space"][":type:"] or "Box" not in data["observation_space"][":type:"]:
+            raise ValueError(f"{model_path}: only Box observations and Discrete actions are supported")
+        # policy_kwargs is cloudpickled, but the repr of every kwarg is stored next to it
+        activation_repr = data.get("policy_kwargs", {}).get("activation_fn", "Tanh")
+        activation_name = next((name for name in ACTIVATIONS if name in activation_repr), None)
+        if activation_name is None:
+            raise ValueError(f"{model_path}: activation_fn {activation_repr} is not supported")
+        return cls(state_dict, activation_name)
+
+    @staticmethod
+    def forward(x, layers, activation):
+        for kernel, bias in layers:
+            x = activation(x @ kernel + bias)
+        return x
+
+    def action_logits(self, observations):
+        latent = self.forward(np.asarray(observations, dtype=np.float32).reshape(-1, self.observation_size),
+                              self.policy_layers, self.activation)
+        return latent @ self.action_kernel + self.action_bias
+
+    def values(self, observations):
+        latent = self.forward(np.asarray(observations, dtype=np.float32).reshape(-1, self.observation_size),
+                              self.value_layers, self.activation)
+        return (latent @ self.value_kernel + self.value_bias)[:, 0]
+
+    def act(self, observations, deterministic=True, rng=np.random):
+        """ observations: (n, observation size) or a single observation -> actions (n,) """
+        logits = self.action_logits(observations)
+        if not deterministic:
+            # sampling from the categorical distribution of the logits (Gumbel-max)
+            logits = logits - np.log(-np.log(rng.random(logits.shape)))
+        return logits.argmax(axis=1)
+
+    def predict(self, observation, deterministic=True):
+        return self.act(observation, deterministic), None
+
+
+class InferenceVecEnv:
+    """ The part of the DummyVecEnv interface the episode loop of model_training uses, for one gymnasium
+        environment, so that serving a NumpyMlpPolicy does not import stable_baselines3 (torch):
+        batched observations / rewards / dones, and automatic reset with info["terminal_observation"]. """
+
+    def __init__(self, env):
+        self.envs = [env]
+        self.num_envs = 1
+        self.observation_space = env.observation_space
+        self.action_space = env.action_space
+
+    def reset(self):
+        observation, _ = self.envs[0].reset()
+        return np.asarray(observation)[None]
+
+    def step(self, actions):
+        observation, reward, terminated, truncated, info = self.envs[0].step(actions[0])
+        done = terminated or truncated
+        if done:
+            info["terminal_observation"] = observation
+            info["TimeLimit.truncated"] = truncated and not terminated
+            observation, _ = self.envs[0].reset()
+        return np.asarray(observation)[None], np.array([reward], dtype=np.float32), np.array([done]), [info]
+
+    def close(self):
+        self.envs[0].close()
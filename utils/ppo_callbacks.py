@@ -0,0 +1,123 @@
+import io
+
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+
+from profiler import profiler
+
+
+class EpisodeTrackingCallback(BaseCallback):
+    """ Per-episode bookkeeping of the episode loop, done from inside PPO.learn:
+        sums episode rewards and counts collisions of every environment, and stops learning after MAX_EPISODES. """
+
+    def __init__(self, config):
+        super().__init__()
+        self.config = config
+        self.all_rewards = []
+        self.collision_counter = 0
+        self.episode_sums_of_rewards = None
+
+    def _on_training_start(self):
+        self.episode_sums_of_rewards = np.zeros(self.training_env.num_envs)
+
+    def _on_step(self):
+        rewards, dones = self.locals["rewards"], self.locals["dones"]
+        self.episode_sums_of_rewards += rewards
+        self.collision_counter += int(np.sum(rewards == self.config.COLLISION_REWARD))
+        for env_index in np.flatnonzero(dones):
+            self.all_rewards.append(self.episode_sums_of_rewards[env_index])
+            print(f"Episode {len(self.all_rewards)} finished with reward: {self.episode_sums_of_rewards[env_index]}")
+            self.episode_sums_of_rewards[env_index] = 0
+        return len(self.all_rewards) < self.config.MAX_EPISODES
+
+
+class ProfilingCallback(BaseCallback):
+    """ Splits the wall time of PPO.learn into rollout collection and training, and counts environment steps """
+
+    def __init__(self):
+        super().__init__()
+        self.current_phase = None
+
+    def switch_phase(self, phase_name):
+        if self.current_phase is not None:
+            self.current_phase.__exit__(None, None, None)
+        self.current_phase = profiler.phase(phase_name).__enter__() if phase_name is not None else None
+
+    def _on_rollout_start(self):
+        self.switch_phase("ppo/rollout")
+
+    def _on_rollout_end(self):
+        self.switch_phase("ppo/train")
+
+    def _on_training_end(self):
+        self.switch_phase(None)
+
+    def _on_step(self):
+        profiler.count_step()
+        return True
+
+
+class CheckpointCallback(BaseCallback):
+    """ Checkpoints the PPO model (policy and optimizer) with the episode bookkeeping every
+        CHECKPOINT_EVERY_X_EPISODES episodes. The model is serialized in memory between two rollouts (right after
+        training) and written to disk in the background by the CheckpointManager. """
+
+    def __init__(self, config, checkpoint_manager, episode_tracking_callback):
+        super().__init__()
+        self.config = config
+        self.checkpoint_manager = checkpoint_manager
+        self.episode_tracking_callback = episode_tracking_callback
+        self.last_checkpoint_episode = len(episode_tracking_callback.all_rewards)
+
+    def checkpoint_snapshot(self):
+        model_file = io.BytesIO()
+        self.model.save(model_file)
+        state = {
+            "num_timesteps": self.model.num_timesteps,
+            "all_rewards": [float(episode_reward) for episode_reward in self.episode_tracking_callback.all_rewards],
+            "collision_counter": self.episode_tracking_callback.collision_counter,
+        }
+        return {}, state, {"model.zip": model_file.getvalue()}
+
+    def _on_rollout_start(self):
+        episode = len(self.episode_tracking_callback.all_rewards)
+        if episode - self.last_checkpoint_episode >= self.config.CHECKPOINT_EVERY_X_EPISODES:
+            self.checkpoint_manager.save(self.model.num_timesteps, self.checkpoint_snapshot)
+            self.checkpoint_manager.log(lambda log_name, x, y: self.logger.record(log_name, y), episode)
+            self.last_checkpoint_episode = episode
+
+    def _on_step(self):
+        return True
+
+
+class TrajectoryRecordingCallback(BaseCallback):
+    """ Streams every transition collected by PPO.learn to a TrajectoryRecorder. The steps of each environment are
+        kept until its episode ends and then recorded as one episode, so episodes stay contiguous on disk. """
+
+    def __init__(self, config, trajectory_recorder):
+        super().__init__()
+        self.config = config
+        self.trajectory_recorder = trajectory_recorder
+        self.episodes_steps = None
+
+    def _on_training_start(self):
+        self.episodes_steps = [[] for _ in range(self.training_env.num_envs)]
+
+    def _on_step(self):
+        # called after env.step and before PPO replaces _last_obs with the new observations
+        states, actions = self.model._last_obs, self.locals["actions"]
+        new_observations, rewards, dones, infos = \
+            self.locals["new_obs"], self.locals["rewards"], self.locals["dones"], self.locals["infos"]
+        for env_index, episode_steps in enumerate(self.episodes_steps):
+            next_state = new_observations[env_index]
+            terminated = False
+            if dones[env_index]:
+                # new_obs already holds the first observation of the next episode
+                next_state = infos[env_index]["terminal_observation"]
+                terminated = not infos[env_index].get("TimeLimit.truncated", False)
+            episode_steps.append((states[env_index], actions[env_index], rewards[env_index], next_state, terminated,
+                                  rewards[env_index] == self.config.COLLISION_REWARD))
+            if dones[env_index]:
+                self.trajectory_recorder.append_episode(*[np.array(column) for column in zip(*episode_steps)])
+                episode_steps.clear()
+        return True
@@ -0,0 +1,100 @@
+import contextlib
+import csv
+import os
+import threading
+import time
+from collections import defaultdict
+
+from latency import LatencyHistogram
+
+NULL_PHASE = contextlib.nullcontext()
+
+
+class Phase:
+    def __init__(self, latency_histogram, lock):
+        self.latency_histogram = latency_histogram
+        self.lock = lock
+        self.start_time = 0.0
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.start_time
+        with self.lock:
+            self.latency_histogram.record(duration)
+        return False
+
+
+class Profiler:
+    """ Wall time of the phases of the hot path (RPCs, predict, sleep / advance, reward, replay / fit, ...),
+        each phase in its own fixed-size LatencyHistogram.
+            with profiler.phase("step/predict"):
+                ...
+        When disabled, phase() returns a shared no-op context manager, so the instrumentation costs next to nothing.
+        Use the module level `profiler`, set up by configure(config) at the start of every run (enabled iff
+        config.PROFILING). Phases may be timed from several threads (e.g. the actor and learner of ActorLearner). """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.latency_histograms = defaultdict(LatencyHistogram)  # phase name -> durations
+        self.steps = 0
+        self.start_time = time.perf_counter()
+
+    def configure(self, config):
+        """ Starts from empty histograms, so nothing of a previous run in the same process is reported """
+        self.enabled = bool(config.PROFILING)
+        self.reset()
+
+    def phase(self, phase_name):
+        if not self.enabled:
+            return NULL_PHASE
+        with self.lock:
+            return Phase(self.latency_histograms[phase_name], self.lock)
+
+    def count_step(self):
+        if self.enabled:
+            with self.lock:
+                self.steps += 1
+
+    def steps_per_second(self):
+        return self.steps / (time.perf_counter() - self.start_time)
+
+    def summaries(self):
+        with self.lock:
+            return {phase_name: histogram.summary()
+                    for phase_name, histogram in sorted(self.latency_histograms.items())}
+
+    def log(self, log_scalar, step):
+        """ log_scalar(log_name, x, y), e.g. Logger.log_scaler """
+        if not self.enabled:
+            return
+        for phase_name, summary in self.summaries().items():
+            for statistic in ["p50", "p95", "p99"]:
+                log_scalar(f"profiler/{phase_name}_{statistic}_ms", step, summary[statistic] * 1e3)
+        log_scalar("profiler/steps_per_second", step, self.steps_per_second())
+
+    def save_csv(self, directory):
+        """ One row per phase (milliseconds) plus the overall steps per second, in directory/profile.csv """
+        if not self.enabled:
+            return
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "profile.csv"), "w", newline="") as profile_file:
+            writer = csv.writer(profile_file)
+            writer.writerow(["phase", "count", "total_s", "mean_ms", "p50_ms", "p95_ms", "p99_ms"])
+            for phase_name, summary in self.summaries().items():
+                writer.writerow([phase_name, summary["count"], summary["mean"] * summary["count"],
+                                 summary["mean"] * 1e3, summary["p50"] * 1e3, summary["p95"] * 1e3,
+                                 summary["p99"] * 1e3])
+            writer.writerow(["steps_per_second", self.steps, "", self.steps_per_second(), "", "", ""])
+
+    def reset(self):
+        with self.lock:
+            self.latency_histograms.clear()
+            self.steps = 0
+            self.start_time = time.perf_counter()
+
+
+profiler = Profiler()
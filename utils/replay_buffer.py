@@ -0,0 +1,207 @@
+import numpy as np
+
+
+def replay_buffer_dtype(state_size):
+    return np.dtype([
+        ("state", np.float32, (state_size,)),
+        ("action", np.int64),
+        ("reward", np.float32),
+        ("next_state", np.float32, (state_size,)),
+        ("done", np.bool_),
+    ])
+
+
+class ReplayBuffer:
+    """ Fixed size ring buffer of transitions stored in one preallocated structured NumPy array.
+        Appending overwrites the oldest transition once the buffer is full. """
+
+    def __init__(self, capacity, state_size):
+        self.capacity = capacity
+        self.state_size = state_size
+        self.transitions = np.zeros(capacity, dtype=replay_buffer_dtype(state_size))
+        self.position = 0  # index of the next write
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, state, action, reward, next_state, done):
+        transition = self.transitions[self.position]
+        transition["state"] = state
+        transition["action"] = action
+        transition["reward"] = reward
+        transition["next_state"] = next_state
+        transition["done"] = done
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def extend(self, states, actions, rewards, next_states, dones):
+        """ Append a batch of transitions at once, same result as appending them one by one.
+            returns: indices the transitions were stored at """
+        n_overwritten = max(0, len(actions) - self.capacity)  # only the last capacity transitions survive
+        indices = (self.position + n_overwritten + np.arange(len(actions) - n_overwritten)) % self.capacity
+        for name, column in zip(["state", "action", "reward", "next_state", "done"],
+                                [states, actions, rewards, next_states, dones]):
+            self.transitions[name][indices] = column[n_overwritten:]
+        self.position = (self.position + len(actions)) % self.capacity
+        self.size = min(self.size + len(actions), self.capacity)
+        return indices
+
+    def append_trajectory(self, trajectory):
+        """ trajectory: list of (state, action, reward, next_state, done) """
+        for transition in trajectory:
+            self.append(*transition)
+
+    def stored_transitions(self):
+        """ Zero-copy view of every stored transition (in storage order, not insertion order) """
+        return self.transitions[:self.size]
+
+    def sample_indices(self, batch_size):
+        return np.random.randint(0, self.size, size=batch_size)
+
+    def sample(self, batch_size=None):
+        """ Uniformly sample a minibatch (with replacement).
+            batch_size=None -> the whole buffer, returned as a view without copying.
+            returns: states, actions, rewards, next_states, dones """
+        if batch_size is None:
+            batch = self.stored_transitions()
+        else:
+            batch = self.transitions[self.sample_indices(batch_size)]
+        return batch["state"], batch["action"], batch["reward"], batch["next_state"], batch["done"]
+
+    def clear(self):
+        self.position = 0
+        self.size = 0
+
+    def checkpoint(self):
+        """ returns: arrays (copies of the stored transitions), state - see restore """
+        return {"transitions": self.transitions[:self.size].copy()}, {"position": self.position, "size": self.size}
+
+    def restore(self, arrays, state):
+        """ arrays may be memory-mapped, they are copied into the preallocated buffer """
+        if state["size"] > self.capacity:
+            raise ValueError(f"Checkpoint holds {state['size']} transitions, the capacity is {self.capacity}")
+        self.transitions[:state["size"]] = arrays["transitions"]
+        self.position = state["position"] % self.capacity
+        self.size = state["size"]
+
+
+class SumTree:
+    """ Binary tree where every node holds the sum of its children, stored in a flat array (root at index 1).
+        Leaves hold the priorities. Updates and prefix-sum lookups are O(log n) and done for a whole batch at once.
+        A second tree over the same leaves holds the minimum of the children, unset leaves count as infinite. """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.leaves_offset = 1
+        while self.leaves_offset < capacity:
+            self.leaves_offset *= 2
+        self.nodes = np.zeros(2 * self.leaves_offset, dtype=np.float64)
+        self.min_nodes = np.full(2 * self.leaves_offset, np.inf)
+
+    def total(self):
+        return self.nodes[1]
+
+    def min_leaf(self):
+        """ Smallest priority set so far, O(1) """
+        return self.min_nodes[1]
+
+    def clear(self):
+        self.nodes[:] = 0.0
+        self.min_nodes[:] = np.inf
+
+    def get(self, indices):
+        return self.nodes[self.leaves_offset + np.asarray(indices)]
+
+    def update(self, indices, priorities):
+        nodes = np.unique(self.leaves_offset + np.asarray(indices))
+        # if an index repeats the last priority wins, same as updating them one by one
+        self.nodes[self.leaves_offset + np.asarray(indices)] = priorities
+        self.min_nodes[self.leaves_offset + np.asarray(indices)] = priorities
+        while nodes[0] > 1:
+            nodes = np.unique(nodes // 2)
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+            self.min_nodes[nodes] = np.minimum(self.min_nodes[2 * nodes], self.min_nodes[2 * nodes + 1])
+
+    def find(self, prefix_sums):
+        """ For every prefix sum, return the index of the leaf in which it falls """
+        nodes = np.ones(len(prefix_sums), dtype=np.int64)
+        prefix_sums = np.array(prefix_sums, dtype=np.float64)
+        while nodes[0] < self.leaves_offset:
+            left_children = 2 * nodes
+            left_sums = self.nodes[left_children]
+            go_right = prefix_sums > left_sums
+            prefix_sums -= np.where(go_right, left_sums, 0.0)
+            nodes = left_children + go_right
+        return nodes - self.leaves_offset
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """ Replay buffer that samples transitions proportionally to priority^alpha (Schaul et al., 2016).
+        New transitions get the highest priority seen so far, so rare events (e.g. collisions) are replayed
+        at least once and then keep being replayed for as long as their TD error stays large. """
+
+    def __init__(self, capacity, state_size, alpha, beta, beta_increment, priority_epsilon):
+        super().__init__(capacity, state_size)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.priority_epsilon = priority_epsilon
+        self.sum_tree = SumTree(capacity)
+        self.max_priority = 1.0
+
+    def append(self, state, action, reward, next_state, done):
+        self.sum_tree.update([self.position], self.max_priority ** self.alpha)
+        super().append(state, action, reward, next_state, done)
+
+    def extend(self, states, actions, rewards, next_states, dones):
+        indices = super().extend(states, actions, rewards, next_states, dones)
+        self.sum_tree.update(indices, np.full(len(indices), self.max_priority ** self.alpha))
+        return indices
+
+    def sample_indices(self, batch_size):
+        # stratified sampling: one uniform draw from each of batch_size equal segments of the total priority
+        segment = self.sum_tree.total() / batch_size
+        prefix_sums = (np.arange(batch_size) + np.random.random(batch_size)) * segment
+        indices = self.sum_tree.find(prefix_sums)
+        return np.minimum(indices, self.size - 1)  # guard against floating point overshoot
+
+    def sample(self, batch_size=None):
+        """ returns: states, actions, rewards, next_states, dones, indices, importance sampling weights """
+        if batch_size is None:
+            batch_size = self.size
+        indices = self.sample_indices(batch_size)
+        batch = self.transitions[indices]
+
+        # importance sampling weights, normalized by the largest possible weight
+        probabilities = self.sum_tree.get(indices) / self.sum_tree.total()
+        min_probability = self.sum_tree.min_leaf() / self.sum_tree.total()
+        weights = (probabilities / min_probability) ** -self.beta
+        self.beta = min(1.0, self.beta + self.beta_increment)
+
+        return (batch["state"], batch["action"], batch["reward"], batch["next_state"], batch["done"],
+                indices, weights.astype(np.float32))
+
+    def update_priorities(self, indices, td_errors):
+        priorities = np.abs(td_errors) + self.priority_epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.sum_tree.update(indices, priorities ** self.alpha)
+
+    def clear(self):
+        super().clear()
+        self.sum_tree.clear()
+        self.max_priority = 1.0
+
+    def checkpoint(self):
+        arrays, state = super().checkpoint()
+        arrays["priorities"] = self.sum_tree.get(np.arange(self.size)).copy()
+        state.update(max_priority=self.max_priority, beta=self.beta)
+        return arrays, state
+
+    def restore(self, arrays, state):
+        super().restore(arrays, state)
+        self.sum_tree.clear()
+        if self.size > 0:
+            self.sum_tree.update(np.arange(self.size), np.asarray(arrays["priorities"]))
+        self.max_priority = state["max_priority"]
+        self.beta = state["beta"]
@@ -0,0 +1,172 @@
+import csv
+import glob
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+CACHE_DIRECTORY_NAME = ".results_cache"
+CONFIG_FILE = "config.json"
+PROGRESS_FILE = "progress.csv"
+PROGRESS_STEP_COLUMN = "time/total_timesteps"
+# <EXPERIMENT_DATE_TIME>_<EXPERIMENT_ID> (older runs have no underscore in between)
+EXPERIMENT_DIRECTORY_PATTERN = re.compile(r"^(\d\d_\d\d_\d{4}-\d\d_\d\d_\d\d)_?(.*)$")
+
+
+def experiment_sources(experiment_path):
+    """ The files the results of an experiment are read from, with their modification time and size """
+    paths = [os.path.join(experiment_path, PROGRESS_FILE), os.path.join(experiment_path, CONFIG_FILE)]
+    paths += glob.glob(os.path.join(experiment_path, "**", "events.out.tfevents.*"), recursive=True)
+    return {os.path.relpath(path, experiment_path): [os.stat(path).st_mtime_ns, os.stat(path).st_size]
+            for path in paths if os.path.exists(path)}
+
+
+def read_progress_csv(progress_path):
+    """ SB3 CSV logger output -> {column: (steps, values)}, rows where the column is empty are skipped """
+    with open(progress_path, newline="") as progress_file:
+        rows = list(csv.DictReader(progress_file))
+    if not rows:
+        return {}
+    columns = {column: np.array([float(row[column]) if row[column] not in ("", None) else np.nan for row in rows])
+               for column in rows[0]}
+    steps = columns.get(PROGRESS_STEP_COLUMN, np.arange(len(rows), dtype=np.float64))
+    metrics = {}
+    for column, values in columns.items():
+        logged = ~np.isnan(values)
+        metrics[column] = (steps[logged].astype(np.int64), values[logged])
+    return metrics
+
+
+def read_tfevents_scalars(events_path):
+    """ Scalars of a TensorBoard event file -> {tag: (steps, values)}. Reads both summary flavours:
+        simple_value (torch / SB3 writer) and scalar tensors (tf.summary.scalar) """
+    from tensorboard.backend.event_processing.event_file_loader import EventFileLoader
+    from tensorboard.util import tensor_util
+    scalars = {}
+    for event in EventFileLoader(events_path).Load():
+        for value in event.summary.value:
+            if value.HasField("simple_value"):
+                scalar = value.simple_value
+            elif value.HasField("tensor") and not value.tensor.tensor_shape.dim:
+                scalar = tensor_util.make_ndarray(value.tensor).item()
+            else:
+                continue  # histograms, images, text
+            steps, values = scalars.setdefault(value.tag, ([], []))
+            steps.append(event.step)
+            values.append(scalar)
+    return {tag: (np.array(steps, dtype=np.int64), np.array(values, dtype=np.float64))
+            for tag, (steps, values) in scalars.items()}
+
+
+def read_experiment(experiment_path):
+    """ Parse every source of an experiment once. returns: config, {metric: (steps, values)} """
+    config = {}
+    if os.path.exists(os.path.join(experiment_path, CONFIG_FILE)):
+        with open(os.path.join(experiment_path, CONFIG_FILE)) as config_file:
+            config = json.load(config_file)
+    match = EXPERIMENT_DIRECTORY_PATTERN.match(os.path.basename(experiment_path))
+    if match is not None:
+        config.setdefault("EXPERIMENT_DATE_TIME", match.group(1))
+        config.setdefault("EXPERIMENT_ID", match.group(2))
+
+    metrics = {}
+    if os.path.exists(os.path.join(experiment_path, PROGRESS_FILE)):
+        metrics.update(read_progress_csv(os.path.join(experiment_path, PROGRESS_FILE)))
+    for events_path in sorted(glob.glob(os.path.join(experiment_path, "**", "events.out.tfevents.*"),
+                                        recursive=True)):
+        for tag, metric in read_tfevents_scalars(events_path).items():
+            if tag not in metrics or len(metric[0]) > len(metrics[tag][0]):
+                metrics[tag] = metric
+    return config, metrics
+
+
+def convert_experiment(experiment_path, cache_path, sources):
+    """ Parse an experiment and store it as a columnar .npz (two arrays per metric) keyed by its sources """
+    config, metrics = read_experiment(experiment_path)
+    metric_names = sorted(metrics)
+    arrays = {}
+    for index, metric_name in enumerate(metric_names):
+        arrays[f"steps_{index}"], arrays[f"values_{index}"] = metrics[metric_name]
+    index = {"sources": sources, "config": config, "metrics": metric_names}
+    temporary_path = f"{cache_path}.tmp.npz"
+    np.savez(temporary_path, index=np.array(json.dumps(index)), **arrays)
+    os.replace(temporary_path, cache_path)
+    return cache_path
+
+
+class ResultsStore:
+    """ Index of the results of every experiment directory (progress.csv, tfevents scalars, config.json).
+        Each experiment is parsed once into a cache file in experiments/.results_cache, rebuilt only when the
+        modification time or size of one of its sources changed. Stale experiments are parsed in parallel.
+            store = ResultsStore("experiments")
+            store.experiments(EXPERIMENT_ID="Car_2_Random_Side")
+            steps, values = store.metric(experiment, "rollout/ep_rew_mean")
+            store.query("rollout/ep_rew_mean", LEARNING_RATE=0.0001)  # {experiment: (steps, values)} """
+
+    def __init__(self, experiments_directory="experiments", max_workers=None):
+        self.experiments_directory = experiments_directory
+        self.cache_directory = os.path.join(experiments_directory, CACHE_DIRECTORY_NAME)
+        self.max_workers = max_workers
+        self.index = {}  # experiment -> {"sources", "config", "metrics"}
+        self.scan()
+
+    def scan(self):
+        """ (Re)index the experiments directory. returns: the experiments that were (re)parsed """
+        os.makedirs(self.cache_directory, exist_ok=True)
+        stale_experiments = {}
+        self.index = {}
+        for experiment in sorted(os.listdir(self.experiments_directory)):
+            experiment_path = os.path.join(self.experiments_directory, experiment)
+            if experiment == CACHE_DIRECTORY_NAME or not os.path.isdir(experiment_path):
+                continue
+            sources = experiment_sources(experiment_path)
+            cache_path = os.path.join(self.cache_directory, f"{experiment}.npz")
+            if os.path.exists(cache_path):
+                index = self.read_cache_index(cache_path)
+                if index["sources"] == sources:
+                    self.index[experiment] = index
+                    continue
+            stale_experiments[experiment] = (experiment_path, cache_path, sources)
+
+        if stale_experiments:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                cache_paths = executor.map(convert_experiment, *zip(*stale_experiments.values()))
+                for experiment, cache_path in zip(stale_experiments, cache_paths):
+                    self.index[experiment] = self.read_cache_index(cache_path)
+            self.index = dict(sorted(self.index.items()))
+        return list(stale_experiments)
+
+    @staticmethod
+    def read_cache_index(cache_path):
+        with np.load(cache_path) as cache_file:
+            return json.loads(cache_file["index"].item())
+
+    def config(self, experiment):
+        return self.index[experiment]["config"]
+
+    def metrics(self, experiment):
+        return self.index[experiment]["metrics"]
+
+    def experiments(self, **config_filters):
+        """ Experiments whose config has the given values, e.g. experiments(AGENT_ONLY=True, N_STEPS=160) """
+        return [experiment for experiment, index in self.index.items()
+                if all(index["config"].get(key) == value for key, value in config_filters.items())]
+
+    def metric(self, experiment, metric_name):
+        """ returns: steps, values (empty arrays when the experiment did not log the metric) """
+        metric_names = self.index[experiment]["metrics"]
+        if metric_name not in metric_names:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+        metric_index = metric_names.index(metric_name)
+        # only the arrays of this metric are read from the cache file
+        with np.load(os.path.join(self.cache_directory, f"{experiment}.npz")) as cache_file:
+            return cache_file[f"steps_{metric_index}"], cache_file[f"values_{metric_index}"]
+
+    def query(self, metric_name, experiments=None, **config_filters):
+        """ returns: {experiment: (steps, values)} for the given (or config filtered) experiments that logged it """
+        if experiments is None:
+            experiments = self.experiments(**config_filters)
+        return {experiment: self.metric(experiment, metric_name) for experiment in experiments
+                if metric_name in self.index[experiment]["metrics"]}
@@ -0,0 +1,92 @@
+import copy
+
+import numpy as np
+
+
+def reward_config(config, reward_spec):
+    """ reward_spec: Reward Configuration overrides, e.g. {'REWARD_SAFETY_DISTANCE': True,
+        'SAFETY_DISTANCE_FOR_BONUS': 800} -> copy of config with them applied """
+    spec_config = copy.copy(config)
+    for name, value in reward_spec.items():
+        setattr(spec_config, name, value)
+    return spec_config
+
+
+def calculate_rewards(config, next_states, collision_occurred, car1_actions, car2_actions, cars_distances):
+    """ RL.calculate_reward for a batch of steps, next_states are car1 states (x, same action flag, Vx, Vy in the
+        AGENT_ONLY runs, see RL.step_agent_only). Steps recorded without cars_distances (NaN) get no safety
+        distance reward. """
+    x_car1 = next_states[:, 0]
+    reached_target = x_car1 > config.CAR1_DESIRED_POSITION[0]  # AirsimManager.has_reached_target
+
+    rewards = np.full(len(next_states), config.STARVATION_REWARD, dtype=np.float32)
+    if config.REWARD_SAFETY_DISTANCE:
+        rewards[(x_car1 < 2) & (cars_distances < config.SAFETY_DISTANCE_FOR_PUNISH)] = \
+            config.NOT_KEEPING_SAFETY_DISTANCE_REWARD
+        rewards[cars_distances > config.SAFETY_DISTANCE_FOR_BONUS] = config.KEEPING_SAFETY_DISTANCE_REWARD
+    rewards[reached_target] = config.REACHED_TARGET_REWARD
+    rewards[collision_occurred] = config.COLLISION_REWARD
+    if config.REWARD_SAME_ACTION and config.AGENT_ONLY:
+        rewards[:] = np.where(car1_actions != car2_actions, config.DIFFERENT_ACTION_REWARD,
+                              config.SAME_ACTION_REWARD)
+    return rewards
+
+
+class RewardRelabeler:
+    """ Recomputes the rewards of recorded transitions (TrajectoryStore of a DQN run, RECORD_TRAJECTORIES) under
+        other reward specs, and retrains the DQN replay path on them, without the simulator:
+            relabeler = RewardRelabeler(config, TrajectoryStore("experiments/<run>/trajectories"))
+            rewards = relabeler.relabel({'REWARD_SAFETY_DISTANCE': True})
+            relabeler.episode_rewards(rewards).mean()
+            losses = relabeler.train(rl, rewards, n_updates=10000)
+        The memory-mapped columns are read in chunks of chunk_size rows, so the whole recording is never loaded. """
+
+    def __init__(self, config, trajectory_store, chunk_size=1000000):
+        self.config = config
+        self.trajectory_store = trajectory_store
+        self.chunk_size = chunk_size
+
+    def chunks(self):
+        for start in range(0, len(self.trajectory_store), self.chunk_size):
+            yield slice(start, min(start + self.chunk_size, len(self.trajectory_store)))
+
+    def relabel(self, reward_spec):
+        """ returns: reward of every recorded step under config + reward_spec """
+        spec_config = reward_config(self.config, reward_spec)
+        rewards = np.empty(len(self.trajectory_store), dtype=np.float32)
+        for rows in self.chunks():
+            # car2 drives at a constant action in the recorded AGENT_ONLY runs (see RL.step_agent_only)
+            rewards[rows] = calculate_rewards(spec_config, self.trajectory_store.next_state[rows],
+                                              self.trajectory_store.collision[rows],
+                                              self.trajectory_store.action[rows], spec_config.CAR2_CONSTANT_ACTION,
+                                              self.trajectory_store.cars_distance[rows])
+        return rewards
+
+    def episode_rewards(self, rewards):
+        """ returns: sum of rewards of every recorded episode """
+        if len(rewards) == 0:
+            return np.zeros(0)
+        return np.add.reduceat(rewards.astype(np.float64), self.trajectory_store.episode_starts)
+
+    def train(self, rl, rewards, n_updates):
+        """ Offline DQN: RL.memory is refilled with the relabeled transitions (agent inputs only), in recording
+            order and REPLAY_BUFFER_SIZE transitions at a time when the recording is larger, and n_updates
+            RL.replay / RL.update_target_model steps are spread evenly over the refills. returns: losses """
+        store = self.trajectory_store
+        agent_input_size = self.config.AGENT_INPUT_SIZE
+        blocks = [slice(start, min(start + rl.memory.capacity, len(store)))
+                  for start in range(0, len(store), rl.memory.capacity)]
+        losses = []
+        for block_index, rows in enumerate(blocks):
+            rl.memory.clear()
+            rl.memory.extend(store.state[rows, :agent_input_size], store.action[rows], rewards[rows],
+                             store.next_state[rows, :agent_input_size], store.done[rows])
+            block_updates = n_updates * (block_index + 1) // len(blocks) - n_updates * block_index // len(blocks)
+            for _ in range(block_updates):
+                loss = rl.replay()
+                rl.update_target_model()
+                if loss is None:  # fewer transitions than RL.train_start
+                    break
+                losses.append(loss)
+                rl.logger.log_scaler("offline/loss", len(losses), loss)
+        return losses
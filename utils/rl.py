@@ -1,140 +1,201 @@
 import random
-import time
-from collections import deque
 
-import tensorflow as tf
 import numpy as np
 
+from lazy_import import lazy_import
+from replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+from profiler import profiler
+
+tf = lazy_import("tensorflow")
+
 
 class RL:
     def __init__(self, config, logger, airsim, nn_handler):
         self.config = config
+        profiler.configure(self.config)
         self.logger = logger
         self.airsim = airsim
         self.nn_handler = nn_handler
-        self.optimizer = tf.keras.optimizers.legacy.Adam(learning_rate=self.config.LEARNING_RATE)
-        # self.discount_factor = 0.95
+        self.optimizer = self.create_optimizer()  # trains self.model in replay, saved with the checkpoints
+        self.discount_factor = 0.95  # of train_trajectory (replay uses gamma)
         if self.config.AGENT_ONLY:
-            self.network = self.nn_handler.init_network_agent_only(self.optimizer)
+            self.network = self.nn_handler.init_network_agent_only(self.create_optimizer())
         else:
-            self.network = self.nn_handler.init_network_master_and_agent(self.optimizer) # TODO: change name network and network_car2
+            self.network = self.nn_handler.init_network_master_and_agent(self.create_optimizer()) # TODO: change name network and network_car2
             self.network_car2 = self.nn_handler.create_network_copy(self.network)  # TODO: change name network and network_car2
         self.current_trajectory = []
         self.trajectories = []
         self.freeze_master = False
         ############################################################
-        self.memory = deque(maxlen=100000)
+        if self.config.PRIORITIZED_REPLAY:
+            self.memory = PrioritizedReplayBuffer(self.config.REPLAY_BUFFER_SIZE, self.config.AGENT_INPUT_SIZE,
+                                                  self.config.PER_ALPHA, self.config.PER_BETA,
+                                                  self.config.PER_BETA_INCREMENT, self.config.PER_EPSILON)
+        else:
+            self.memory = ReplayBuffer(self.config.REPLAY_BUFFER_SIZE, self.config.AGENT_INPUT_SIZE)
         self.gamma = 0.999  # discount rate
         self.epsilon_min = 0.1
         self.epsilon = 1.0
         self.epsilon_decay = 0.9975
         self.TAU = 0.1
-        self.train_start = 10  # from this size of memory we start to train
+        self.train_start = 10  # from this amount of transitions in memory we start to train
         self.ddqn = True
         self.Soft_Update = True
         self.distribution = True
         self.model = self.nn_handler.init_network_agent_only(self.optimizer)
-        self.target_model = self.nn_handler.init_network_agent_only(self.optimizer)
+        self.target_model = self.nn_handler.init_network_agent_only(self.create_optimizer())
+        self.target_model_update = self.nn_handler.create_target_update_function(self.model, self.target_model)
+        # training steps of replay / train_trajectory (see TRAIN_STEP_BACKEND), None -> the eager apply_gradients
+        self.model_train = self.nn_handler.create_train_function(self.model, self.config.TRAIN_STEP_BACKEND)
+        self.network_trajectory_train = None
+        if self.config.TRAIN_STEP_BACKEND != "keras":
+            self.network_trajectory_train = self.nn_handler.create_trajectory_train_function(
+                self.network, self.config.TRAIN_STEP_BACKEND)
+        self.network_car2_update = None  # created on first copy_network
+        self.joint_master_inputs = None  # preallocated batch of sample_actions
+        self.joint_agent_inputs = None
+        self.last_actions_were_random = False
+        self.last_cars_distance = np.nan  # after the last step, recorded with the transition (RECORD_TRAJECTORIES)
+        self.network_inference_backend = self.config.INFERENCE_BACKEND
+        if self.network_inference_backend == "numpy" and not self.config.AGENT_ONLY:
+            print('INFERENCE_BACKEND "numpy" only runs sequential networks, the master and agent network uses '
+                  '"tf_function" (the agent only model still uses "numpy")')
+            self.network_inference_backend = "tf_function"
+        self.network_inference = None
+        self.model_inference = None
+        self.refresh_inference_functions()
+
+    def create_optimizer(self):
+        """ Every network gets its own optimizer, so the Adam moments and step count of one are not advanced by
+            training another """
+        return tf.keras.optimizers.legacy.Adam(learning_rate=self.config.LEARNING_RATE)
 
     def update_target_model(self):
         if not self.Soft_Update and self.ddqn:
-            self.target_model.set_weights(self.model.get_weights())
+            self.target_model_update(hard_copy=True)
             return
         if self.Soft_Update and self.ddqn:
-            q_model_theta = self.model.get_weights()
-            target_model_theta = self.target_model.get_weights()
-            counter = 0
-            for q_weight, target_weight in zip(q_model_theta, target_model_theta):
-                target_weight = target_weight * (1 - self.TAU) + q_weight * self.TAU
-                target_model_theta[counter] = target_weight
-                counter += 1
-            self.target_model.set_weights(target_model_theta)
+            self.target_model_update(tf.constant(self.TAU))
+
+    def refresh_inference_functions(self):
+        """ (Re)build the action selection predict functions. Only the numpy backend holds a copy of the weights,
+            so only it needs a refresh after training. """
+        if self.network_inference is None or self.network_inference_backend == "numpy":
+            self.network_inference = self.nn_handler.create_inference_function(self.network,
+                                                                               self.network_inference_backend)
+        if self.model_inference is None or self.config.INFERENCE_BACKEND == "numpy":
+            self.model_inference = self.nn_handler.create_inference_function(self.model,
+                                                                             self.config.INFERENCE_BACKEND)
 
     def act(self, state):
         if np.random.random() <= self.epsilon:
             return random.randrange(2)
         else:
-            return np.argmax(self.model.predict(state))
+            return np.argmax(self.model_inference(state))
 
     def replay(self):
         if len(self.memory) < self.train_start:
             return
-        # Randomly sample minibatch from the memory
-        # minibatch = random.sample(self.memory, min(self.batch_size, self.batch_size))
-        # trajectories = random.sample(self.memory, min(self.batch_size, len(self.memory)))
-        # trajectories = random.sample(self.memory, min(len(self.memory), len(self.memory)))
-        # trajectories = list(self.memory)[-self.batch_size:]
-        trajectories = list(self.memory)
-
-        state, next_state, action, reward, done = [], [], [], [], []
-
-        # for i in range(self.batch_size):
-        #     # print(f"minibatch[{i}]: {minibatch[i]}")
-        #     state.append(minibatch[i][0])
-        #     action.append(minibatch[i][1])
-        #     reward.append(minibatch[i][2])
-        #     next_state.append(minibatch[i][3])
-        #     done.append(minibatch[i][4])
-        for trajectory in trajectories:
-            for transition in trajectory:
-                state.append(transition[0])
-                action.append(transition[1])
-                reward.append(transition[2])
-                next_state.append(transition[3])
-                done.append(transition[4])
-
-        state = np.array(state)
-        next_state = np.array(next_state)
+        # Randomly sample minibatch from the memory (REPLAY_BATCH_SIZE = None -> train on the whole memory)
+        with profiler.phase("replay/sample"):
+            if self.config.PRIORITIZED_REPLAY:
+                state, action, reward, next_state, done, indices, sample_weight = \
+                    self.memory.sample(self.config.REPLAY_BATCH_SIZE)
+            else:
+                state, action, reward, next_state, done = self.memory.sample(self.config.REPLAY_BATCH_SIZE)
+                sample_weight = None
 
         # do batch prediction to save speed
-        target = self.model.predict(state)
-        target_next = self.model.predict(next_state)
-        target_val = self.target_model.predict(next_state)
-
-        # for i in range(len(minibatch)):
-        #     # correction on the Q value for the action used
-        #     if done[i]:
-        #         target[i][action[i]] = reward[i]
-        #     else:
-        #         if self.ddqn:  # Double - DQN
-        #             # current Q Network selects the action
-        #             # a'_max = argmax_a' Q(s', a')
-        #             a = np.argmax(target_next[i])
-        #             # target Q Network evaluates the action
-        #             # Q_max = Q_target(s', a'_max)
-        #             target[i][action[i]] = reward[i] + self.gamma * (target_val[i][a])
-        #         else:  # Standard - DQN
-        #             # DQN chooses the max Q value among next actions
-        #             # selection and evaluation of action is on the target Q Network
-        #             # Q_max = max_a' Q_target(s', a')
-        #             target[i][action[i]] = reward[i] + self.gamma * (np.amax(target_next[i]))
-        index = 0
-        for trajectory in trajectories:
-            for _ in trajectory:
-                if done[index]:
-                    target[index][action[index]] = reward[index]
-                else:
-                    if self.ddqn:  # Double - DQN
-                        a = np.argmax(target_next[index])
-                        target[index][action[index]] = reward[index] + self.gamma * target_val[index][a]
-                    else:  # Standard - DQN
-                        target[index][action[index]] = reward[index] + self.gamma * np.amax(target_next[index])
-                index += 1
-
-        # Train the Neural Network with batches
+        with profiler.phase("replay/predict"):
+            target = self.model.predict(state)
+            target_next = self.model.predict(next_state)
+            target_val = self.target_model.predict(next_state)
+
+        with profiler.phase("replay/targets"):
+            rows = np.arange(len(action))
+            q_value_before_update = target[rows, action]
+            target = self.compute_q_targets(target, target_next, target_val, action, reward, done, self.gamma,
+                                            self.ddqn)
+
+        # Train the Neural Network with batches (model.fit or its compiled equivalent, see TRAIN_STEP_BACKEND)
         # history = self.model.fit(state, target, epochs=1, batch_size=self.batch_size, verbose=0)
         # history = self.model.fit(state, target, epochs=1, batch_size=len(self.memory), verbose=0)
-        print("self.config.EPOCHS")
-        print(self.config.EPOCHS)
-        history = self.model.fit(state, target, epochs=self.config.EPOCHS, verbose=0)
+        with profiler.phase("replay/fit"):
+            loss = self.model_train(state, target, sample_weight=sample_weight, epochs=self.config.EPOCHS)
+        self.refresh_inference_functions()
+
+        if self.config.PRIORITIZED_REPLAY:
+            # refresh priorities of the replayed transitions with their TD errors
+            with profiler.phase("replay/priorities"):
+                self.memory.update_priorities(indices, target[rows, action] - q_value_before_update)
 
-        return history.history['loss'][0]
+        return loss
 
 
+    @staticmethod
+    def compute_q_targets(target, target_next, target_val, action, reward, done, gamma, ddqn):
+        """ Correct the Q value of the action used in every transition, for the whole batch at once.
+            target: Q(s, .) of the online network - updated in place and returned
+            target_next: Q(s', .) of the online network, target_val: Q_target(s', .) of the target network """
+        rows = np.arange(len(action))
+        if ddqn:  # Double - DQN
+            # current Q Network selects the action: a'_max = argmax_a' Q(s', a')
+            # target Q Network evaluates the action: Q_max = Q_target(s', a'_max)
+            next_q_value = target_val[rows, np.argmax(target_next, axis=1)]
+        else:  # Standard - DQN
+            # DQN chooses the max Q value among next actions: Q_max = max_a' Q(s', a')
+            next_q_value = np.amax(target_next, axis=1)
+        target[rows, action] = np.where(done, reward, reward + gamma * next_q_value)
+        return target
+
     def updateEpsilon(self):
         if self.epsilon > self.epsilon_min:
             self.epsilon *= self.epsilon_decay
 
+    def checkpoint_networks(self):
+        networks = {"network": self.network, "model": self.model, "target_model": self.target_model}
+        if not self.config.AGENT_ONLY:
+            networks["network_car2"] = self.network_car2
+        return networks
+
+    def checkpoint(self):
+        """ Copies of everything needed to resume training exactly: weights of every network, optimizer state,
+            replay buffer and epsilon. returns: arrays, state - see restore_checkpoint """
+        arrays = {}
+        networks_sizes = {}
+        for network_name, network in self.checkpoint_networks().items():
+            network_weights = network.get_weights()
+            networks_sizes[network_name] = len(network_weights)
+            arrays.update({f"{network_name}_{index:03d}": weights for index, weights in enumerate(network_weights)})
+        optimizer_weights = self.optimizer.get_weights()  # iterations and the Adam moments
+        arrays.update({f"optimizer_{index:03d}": weights for index, weights in enumerate(optimizer_weights)})
+        memory_arrays, memory_state = self.memory.checkpoint()
+        arrays.update({f"memory_{name}": array for name, array in memory_arrays.items()})
+        state = {"networks_sizes": networks_sizes, "optimizer_size": len(optimizer_weights),
+                 "memory": memory_state, "epsilon": self.epsilon}
+        return arrays, state
+
+    def restore_checkpoint(self, arrays, state):
+        for network_name, network in self.checkpoint_networks().items():
+            network.set_weights([arrays[f"{network_name}_{index:03d}"]
+                                 for index in range(state["networks_sizes"][network_name])])
+        if state["optimizer_size"] > 0:
+            if len(self.optimizer.get_weights()) != state["optimizer_size"]:
+                # the Adam moments are only created by the first training step: a step with zero gradients creates
+                # them without moving the weights (its step count is overwritten by the checkpoint's below)
+                with tf.init_scope():
+                    self.optimizer.apply_gradients([(tf.zeros_like(variable), variable)
+                                                    for variable in self.model.trainable_variables])
+            if len(self.optimizer.get_weights()) == state["optimizer_size"]:
+                self.optimizer.set_weights([arrays[f"optimizer_{index:03d}"]
+                                            for index in range(state["optimizer_size"])])
+            else:
+                print("Optimizer state of the checkpoint does not match the optimizer, starting it from scratch")
+        self.memory.restore({name[len("memory_"):]: array for name, array in arrays.items()
+                             if name.startswith("memory_")}, state["memory"])
+        self.epsilon = state["epsilon"]
+        self.refresh_inference_functions()
+
 
     #############################################################################
     #############################################################################
@@ -149,14 +210,18 @@ class RL:
     #############################################################################
     #############################################################################
 
-    def step_agent_only(self):
+    def step_agent_only(self, inference_function=None):
+        """ inference_function: predict function to select car1's action with (None -> self.network) """
         # get current state
-        car1_state = self.airsim.get_car1_state(self.logger)
+        snapshot = self.airsim.snapshot()
+        car1_state = self.airsim.get_car1_state_from_snapshot(snapshot, self.logger)
 
         # sample actions
-        car1_action = self.sample_action_agent_only(car1_state)
+        with profiler.phase("step/predict"):
+            car1_action = self.sample_action_agent_only(car1_state, inference_function)
         car2_action = self.config.CAR2_CONSTANT_ACTION
-        print(f"car2 action: {self.config.CAR2_CONSTANT_ACTION}")
+        with profiler.phase("step/logging"):
+            self.logger.log_console("car2 action", car2_action)
 
         if car1_action == car2_action:
             car1_state[1] = 1
@@ -167,14 +232,15 @@ class RL:
             self.logger.log_state(car1_state, self.config.CAR1_NAME)
 
         # set updated controls according to sampled action + car2 is constant speed
-        self.set_controls_according_to_sampled_action(self.config.CAR1_NAME, car1_action)
-        self.set_controls_according_to_sampled_action(self.config.CAR2_NAME, car2_action)
+        self.set_controls_according_to_sampled_actions([self.config.CAR1_NAME, self.config.CAR2_NAME],
+                                                       [car1_action, car2_action])
 
-        # delay code in order to physically get the next state in the simulator
-        time.sleep(self.config.TIME_BETWEEN_STEPS)
+        # let the simulator move on in order to physically get the next state
+        self.airsim.advance_simulation()
 
         # get next state
-        car1_next_state = self.airsim.get_car1_state(self.logger)
+        next_snapshot = self.airsim.snapshot()
+        car1_next_state = self.airsim.get_car1_state_from_snapshot(next_snapshot, self.logger)
 
         if car1_action == car2_action:
             car1_next_state[1] = 1
@@ -182,10 +248,16 @@ class RL:
             car1_next_state[1] = 0
 
         # calculate reward
-        collision_occurred = self.airsim.collision_occurred()
-        reached_target = self.airsim.has_reached_target(car1_next_state)
-        reward = self.calculate_reward(car1_next_state, collision_occurred, reached_target, car1_action, car2_action)
-        print(f"reward: {reward}")
+        with profiler.phase("step/reward"):
+            collision_occurred = self.airsim.collision_occurred_in_snapshot(next_snapshot)
+            reached_target = self.airsim.has_reached_target(car1_next_state)
+            self.last_cars_distance = self.airsim.get_cars_distance_from_snapshot(next_snapshot)
+            reward = self.calculate_reward(car1_next_state, collision_occurred, reached_target, car1_action,
+                                           car2_action, self.last_cars_distance)
+        with profiler.phase("step/logging"):
+            self.logger.log_console("reward", reward)
+
+        profiler.count_step()
 
         # organize output
         # current_state = [[master_input, car1_state], [master_input, car2_state]]
@@ -201,27 +273,35 @@ class RL:
         """
 
         # get current state
-        car1_state = self.airsim.get_car1_state(self.logger)
-        car2_state = self.airsim.get_car2_state(self.logger)
+        snapshot = self.airsim.snapshot()
+        car1_state = self.airsim.get_car1_state_from_snapshot(snapshot, self.logger)
+        car2_state = self.airsim.get_car2_state_from_snapshot(snapshot, self.logger)
 
         # sample actions
-        car1_action, car2_action = self.sample_action(car1_state, car2_state)
+        with profiler.phase("step/predict"):
+            car1_action, car2_action = self.sample_action(car1_state, car2_state)
 
         # set updated controls according to sampled action
-        self.set_controls_according_to_sampled_action(self.config.CAR1_NAME, car1_action)
-        self.set_controls_according_to_sampled_action(self.config.CAR2_NAME, car2_action)
+        self.set_controls_according_to_sampled_actions([self.config.CAR1_NAME, self.config.CAR2_NAME],
+                                                       [car1_action, car2_action])
 
-        # delay code in order to physically get the next state in the simulator
-        time.sleep(self.config.TIME_BETWEEN_STEPS)
+        # let the simulator move on in order to physically get the next state
+        self.airsim.advance_simulation()
 
         # get next state
-        car1_next_state = self.airsim.get_car1_state(self.logger)
-        car2_next_state = self.airsim.get_car2_state(self.logger)
+        next_snapshot = self.airsim.snapshot()
+        car1_next_state = self.airsim.get_car1_state_from_snapshot(next_snapshot, self.logger)
+        car2_next_state = self.airsim.get_car2_state_from_snapshot(next_snapshot, self.logger)
 
         # calculate reward
-        collision_occurred = self.airsim.collision_occurred()
-        reached_target = self.airsim.has_reached_target(car1_next_state)
-        reward = self.calculate_reward(car1_next_state, collision_occurred, reached_target, car1_action, car2_action)
+        with profiler.phase("step/reward"):
+            collision_occurred = self.airsim.collision_occurred_in_snapshot(next_snapshot)
+            reached_target = self.airsim.has_reached_target(car1_next_state)
+            self.last_cars_distance = self.airsim.get_cars_distance_from_snapshot(next_snapshot)
+            reward = self.calculate_reward(car1_next_state, collision_occurred, reached_target, car1_action,
+                                           car2_action, self.last_cars_distance)
+
+        profiler.count_step()
 
         # Put together master input
         master_input = [car1_state, car2_state]
@@ -252,11 +332,15 @@ class RL:
 
         updated_q_values = self.update_q_values(actions, rewards, current_state_q_values, next_state_q_values)
 
-        with tf.GradientTape(persistent=True) as tape:
-            loss, gradients = self.apply_gradients(tape, states, updated_q_values)
+        if self.network_trajectory_train is not None:
+            loss, gradients = self.apply_gradients(None, states, updated_q_values)
+        else:
+            with tf.GradientTape(persistent=True) as tape:
+                loss, gradients = self.apply_gradients(tape, states, updated_q_values)
         self.logger.log_weights_and_gradients(gradients, episode_counter, self.network)
+        self.refresh_inference_functions()
 
-        return loss.numpy().mean()
+        return float(np.mean(loss))
 
     @staticmethod
     def process_trajectory(trajectory):
@@ -343,11 +427,14 @@ class RL:
         """ Calculate and apply gradients to the network.
             Only compute loss and apply gradients on states & q_values of network_Car because this is the one
             that keeps training (network car2 is frozen)
+            tape = None with a compiled TRAIN_STEP_BACKEND: the same step runs as one traced / XLA function
         """
         if self.config.AGENT_ONLY:
             car1_inputs = self.prepare_state_inputs_agent_only(states)
         else:
             car1_inputs, car2_inputs = self.prepare_state_inputs(states, separate_state_for_each_car=True)
+        if self.network_trajectory_train is not None:
+            return self.network_trajectory_train(car1_inputs, updated_q_values)
         current_state_q_values_car1 = self.network(car1_inputs, training=True)  # keep this format
         updated_q_values_car1 = updated_q_values
 
@@ -357,31 +444,47 @@ class RL:
         return loss, gradients
 
     def sample_action(self, car1_state, car2_state):
-        if np.random.binomial(1, p=self.epsilon):
+        car1_action, car2_action = self.sample_actions([car1_state, car2_state])
+        if self.config.LOG_ACTIONS_SELECTED and not self.last_actions_were_random:
+            self.logger.log_actions_selected(self.network, car1_state, car2_state, car1_action, car2_action)
+        return car1_action, car2_action
+
+    def sample_actions(self, cars_states):
+        """ Sample an action for each of N controlled cars with a single forward pass of the network.
+            cars_states: list of N car states -> list of N actions """
+        self.last_actions_were_random = bool(np.random.binomial(1, p=self.epsilon))
+        if self.last_actions_were_random:
+            random_actions = [np.random.randint(2) for _ in cars_states]
             if self.config.LOG_ACTIONS_SELECTED:
-                self.logger.log_actions_selected_random()
-            return np.random.randint(2), np.random.randint(2)
-        else:
-            master_input = np.concatenate((car1_state, car2_state), axis=0).reshape(1, -1)
-            car1_state = np.reshape(car1_state, (1, -1))
-            car2_state = np.reshape(car2_state, (1, -1))
-            car1_action = self.predict_q_values([master_input, car1_state], self.config.CAR1_NAME, self.network)
-            car2_action = self.predict_q_values([master_input, car2_state], self.config.CAR2_NAME, self.network)
-            if self.config.LOG_ACTIONS_SELECTED:
-                self.logger.log_actions_selected(self.network, car1_state, car2_state, car1_action, car2_action)
-            return car1_action, car2_action
-
-    def sample_action_agent_only(self, car1_state):
+                self.logger.log_actions_selected_random(random_actions)
+            return random_actions
+        q_values = self.network_inference(self.prepare_joint_state_inputs(cars_states))
+        return list(q_values.argmax(axis=1))
+
+    def prepare_joint_state_inputs(self, cars_states):
+        """ Fill the preallocated batch of all cars: row i = [master input (all cars states), agent input (car i)] """
+        n_cars, state_size = len(cars_states), len(cars_states[0])
+        if self.joint_agent_inputs is None or self.joint_agent_inputs.shape != (n_cars, state_size):
+            self.joint_master_inputs = np.empty((n_cars, n_cars * state_size), dtype=np.float32)
+            self.joint_agent_inputs = np.empty((n_cars, state_size), dtype=np.float32)
+        for car_index, car_state in enumerate(cars_states):
+            self.joint_agent_inputs[car_index] = car_state
+            self.joint_master_inputs[0, car_index * state_size:(car_index + 1) * state_size] = car_state
+        self.joint_master_inputs[1:] = self.joint_master_inputs[0]  # every car sees the same master input
+        return [self.joint_master_inputs, self.joint_agent_inputs]
+
+    def sample_action_agent_only(self, car1_state, inference_function=None):
         if np.random.binomial(1, p=self.epsilon) and not self.config.ONLY_INFERENCE:
             random_action = np.random.randint(2)
             if self.config.LOG_ACTIONS_SELECTED:
                 self.logger.log_actions_selected_random(random_action)
             return random_action
         else:
-            car1_state = np.reshape(car1_state, (1, -1))
-            car1_action = self.predict_q_values(car1_state, self.config.CAR1_NAME, self.network)
+            # the agent input is the head of the car state, as stored in the replay buffer
+            car1_state = np.reshape(car1_state[:self.config.AGENT_INPUT_SIZE], (1, -1))
+            car1_action = self.predict_q_values(car1_state, self.config.CAR1_NAME, self.network, inference_function)
             if self.config.LOG_ACTIONS_SELECTED:
-                print(f"Action selected: {car1_action}")
+                self.logger.log_console("car1 action", car1_action)
             return car1_action
 
     def set_controls_according_to_sampled_action(self, car_name, sampled_action):
@@ -389,24 +492,33 @@ class RL:
         updated_controls = self.action_to_controls(current_controls, sampled_action)
         self.airsim.set_car_controls(updated_controls, car_name)
 
-    def calculate_reward(self, car1_state, collision_occurred, reached_target, car1_action, car2_action):
+    def set_controls_according_to_sampled_actions(self, car_names, sampled_actions):
+        """ Same as set_controls_according_to_sampled_action for several cars, letting the manager pipeline the RPCs """
+        current_controls = self.airsim.get_cars_controls(car_names)
+        updated_controls = [self.action_to_controls(car_controls, sampled_action)
+                            for car_controls, sampled_action in zip(current_controls, sampled_actions)]
+        self.airsim.set_cars_controls(updated_controls, car_names)
+
+    def calculate_reward(self, car1_state, collision_occurred, reached_target, car1_action, car2_action,
+                         cars_distance):
+        """ The reward variants are selected by the Reward Configuration, calculate_rewards of reward_relabeling
+            is the same for a batch of recorded steps.
+            cars_distance: squared distance between the cars (AirsimManager.get_cars_distance_from_snapshot) """
 
         x_car1 = car1_state[0]  # TODO: make it more generic
-        cars_distance = car1_state[-1]  # TODO: make it more generic
 
         # avoid starvation
         reward = self.config.STARVATION_REWARD
 
-        # # too close
-        # # x_car1 < 2 is for not punishing after passing without collision (TODO: make it more generic)
-        # if x_car1 < 2 and cars_distance < self.config.SAFETY_DISTANCE_FOR_PUNISH:
-        #     # print(f"too close: {car1_state[-1]}")
-        #     reward = self.config.NOT_KEEPING_SAFETY_DISTANCE_REWARD
+        # too close
+        # x_car1 < 2 is for not punishing after passing without collision (TODO: make it more generic)
+        if self.config.REWARD_SAFETY_DISTANCE and x_car1 < 2 and \
+                cars_distance < self.config.SAFETY_DISTANCE_FOR_PUNISH:
+            reward = self.config.NOT_KEEPING_SAFETY_DISTANCE_REWARD
 
-        # # keeping safety distance
-        # if cars_distance > self.config.SAFETY_DISTANCE_FOR_BONUS:
-        #     # print(f"keeping safety distance: {car1_state[-1]}")
-        #     reward = self.config.KEEPING_SAFETY_DISTANCE_REWARD
+        # keeping safety distance
+        if self.config.REWARD_SAFETY_DISTANCE and cars_distance > self.config.SAFETY_DISTANCE_FOR_BONUS:
+            reward = self.config.KEEPING_SAFETY_DISTANCE_REWARD
 
         # reached target
         if reached_target:
@@ -416,12 +528,11 @@ class RL:
         if collision_occurred:
             reward = self.config.COLLISION_REWARD
 
-        # if self.config.AGENT_ONLY:
-        #     if car1_action != car2_action:
-        #         print("different actions")
-        #         reward = 15
-        #     else:
-        #         reward = -10
+        if self.config.REWARD_SAME_ACTION and self.config.AGENT_ONLY:
+            if car1_action != car2_action:
+                reward = self.config.DIFFERENT_ACTION_REWARD
+            else:
+                reward = self.config.SAME_ACTION_REWARD
 
         return reward
 
@@ -434,14 +545,18 @@ class RL:
             current_controls.throttle = 0.75
         return current_controls  # called current_controls - but it is updated controls
 
-    def predict_q_values(self, car_input, car_name, car_network):
-        q_values = self.network.predict(car_input, verbose=0)
+    def predict_q_values(self, car_input, car_name, car_network, inference_function=None):
+        if inference_function is None:
+            inference_function = self.network_inference
+        q_values = inference_function(car_input)
         action_selected = q_values.argmax()
         return action_selected
 
     def copy_network(self):
-        network_copy = self.nn_handler.create_network_copy(self.network)
-        self.network_car2 = network_copy
+        # copy into the existing car2 network in place instead of cloning a new model every time
+        if self.network_car2_update is None:
+            self.network_car2_update = self.nn_handler.create_target_update_function(self.network, self.network_car2)
+        self.network_car2_update(hard_copy=True)
 
         if self.config.LOG_WEIGHTS_ARE_IDENTICAL:
             self.nn_handler.are_weights_identical(self.network, self.network_car2)
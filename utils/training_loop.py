@@ -1,25 +1,56 @@
-from stable_baselines3 import PPO
-from stable_baselines3.common.vec_env import DummyVecEnv
-from gym_enviroment import AirSimGymEnv
-from airsim_manager import AirsimManager
-from stable_baselines3.common.logger import configure
-from plotting_utils import PlottingUtils
+import io
+import os
+
+from checkpoint import CheckpointManager
+from profiler import profiler
+from trajectory_store import TrajectoryRecorder
+
+# stable_baselines3 (torch), the environments and the plotting are imported by the functions that use them,
+# so importing this module stays cheap (e.g. in every rollout worker process)
 
 
 def model_training(config, path):
+    config.save(path)
+    if config.TRAINING_ALGORITHM == "dqn":
+        return dqn_model_training(config, path)
+    if config.PPO_TRAINING_MODE == "learn" and not config.ONLY_INFERENCE:
+        return learn_model_training(config, path)
+
+    from gym_enviroment import AirSimGymEnv
+    from airsim_manager import AirsimManager
+    from plotting_utils import PlottingUtils
+
+    # "episode_loop": the loop below collects the episodes and PPO.learn collects its own rollouts after each one
+    profiler.configure(config)
     all_rewards = []
-    new_logger = configure(path, ["stdout", "csv", "tensorboard"])
-    env = DummyVecEnv([lambda: AirSimGymEnv(config, AirsimManager(config))])
 
-    model = PPO('MlpPolicy', env, verbose=1,
-                learning_rate=config.LEARNING_RATE,
-                n_steps=config.N_STEPS,
-                batch_size=config.BATCH_SIZE)
+    if config.ONLY_INFERENCE and config.PPO_INFERENCE_BACKEND == "numpy":
+        # only the policy weights are needed, stable_baselines3 (torch) is not imported
+        from policy_server import NumpyMlpPolicy, InferenceVecEnv
+        new_logger = None
+        env = InferenceVecEnv(AirSimGymEnv(config, AirsimManager(config)))
+        model = NumpyMlpPolicy.load(config.LOAD_WEIGHT_DIRECTORY)
+        print("Loaded policy weights for inference.")
+    else:
+        from stable_baselines3 import PPO
+        from stable_baselines3.common.vec_env import DummyVecEnv
+        from stable_baselines3.common.logger import configure
+        new_logger = configure(path, ["stdout", "csv", "tensorboard"])
+        env = DummyVecEnv([lambda: AirSimGymEnv(config, AirsimManager(config))])
+        if config.ONLY_INFERENCE:
+            # no learner to build, the loaded model only predicts
+            model = PPO.load(config.LOAD_WEIGHT_DIRECTORY)
+            print("Loaded weights for inference.")
+        else:
+            model = PPO('MlpPolicy', env, verbose=1,
+                        learning_rate=config.LEARNING_RATE,
+                        n_steps=config.N_STEPS,
+                        batch_size=config.BATCH_SIZE)
+            model.set_logger(new_logger)
 
-    model.set_logger(new_logger)
-    if config.ONLY_INFERENCE:
-        model = PPO.load(config.LOAD_WEIGHT_DIRECTORY)
-        print("Loaded weights for inference.")
+    trajectory_recorder = None
+    if config.RECORD_TRAJECTORIES:
+        trajectory_recorder = TrajectoryRecorder(os.path.join(path, "trajectories"), env.observation_space.shape[0])
 
     collision_counter = 0
     episode_counter = 0
@@ -36,15 +67,25 @@ def model_training(config, path):
         episode_sum_of_rewards = 0
         episode_counter += 1
         while not done:
-            if not config.ONLY_INFERENCE:
-                if total_steps > config.EXPLORATION_EXPLOTATION_THRESHOLD:
+            with profiler.phase("ppo/predict"):
+                if not config.ONLY_INFERENCE:
+                    if total_steps > config.EXPLORATION_EXPLOTATION_THRESHOLD:
+                        action, _ = model.predict(obs, deterministic=True)
+                    elif total_steps < config.EXPLORATION_EXPLOTATION_THRESHOLD:
+                        action, _ = model.predict(obs, deterministic=False)
+                    #print(f"Action: {action}")
+                elif config.ONLY_INFERENCE:
                     action, _ = model.predict(obs, deterministic=True)
-                elif total_steps < config.EXPLORATION_EXPLOTATION_THRESHOLD:
-                    action, _ = model.predict(obs, deterministic=False)
-                #print(f"Action: {action}")
-            elif config.ONLY_INFERENCE:
-                action, _ = model.predict(obs, deterministic=True)
-            obs, reward, done, _ = env.step(action)
+            with profiler.phase("ppo/env_step"):
+                next_obs, reward, done, info = env.step(action)
+            if trajectory_recorder is not None:
+                # after the last step of an episode next_obs already holds the reset observation
+                next_state = info[0]["terminal_observation"] if done[0] else next_obs[0]
+                trajectory_recorder.append(obs[0], action[0], reward[0], next_state,
+                                           done[0] and not info[0].get("TimeLimit.truncated", False),
+                                           reward[0] == config.COLLISION_REWARD)
+            obs = next_obs
+            profiler.count_step()
             steps_counter += 1
             if reward == -20.0:
                 env.envs[0].pause_simulation()
@@ -56,16 +97,126 @@ def model_training(config, path):
                 # if env.envs[0].airsim_manager.collision_occurred():
                 #     env.envs[0].pause_simulation()
                 if not config.ONLY_INFERENCE:
-                    model.learn(total_timesteps=steps_counter)
+                    with profiler.phase("ppo/learn"):
+                        model.learn(total_timesteps=steps_counter)
                 break
         print(f"Episode {episode_counter} finished with reward: {episode_sum_of_rewards}")
         all_rewards.append(episode_sum_of_rewards)
+        if trajectory_recorder is not None:
+            trajectory_recorder.end_episode()
         steps_counter = 0
         env.envs[0].resume_simulation()
+    if trajectory_recorder is not None:
+        trajectory_recorder.close()
+    if not config.ONLY_INFERENCE:
+        model.save(path + '/model')
+        print('Model saved')
+    export_profile(new_logger, path, total_steps, env.envs[0].airsim_manager)
+    env.close()  # AirSimGymEnv.close -> AirsimManager.close
+    if new_logger is not None:
+        new_logger.close()
+    print("Total collisions:", collision_counter)
+    PlottingUtils.plot_losses(path)
+    PlottingUtils.plot_rewards(all_rewards)
+    PlottingUtils.show_plots()
+    return all_rewards
+
+
+def export_profile(sb3_logger, path, step, airsim_manager=None):
+    """ Phase latency percentiles, steps/sec and the RPC latencies of airsim_manager (if any) to TensorBoard
+        (through the SB3 logger, if any), and path/profile.csv """
+    if sb3_logger is not None:
+        profiler.log(lambda log_name, x, y: sb3_logger.record(log_name, y), step)
+        if airsim_manager is not None:
+            airsim_manager.log_rpc_latencies(lambda log_name, x, y: sb3_logger.record(log_name, y), step)
+        sb3_logger.dump(step)
+    profiler.save_csv(path)
+
+
+def dqn_model_training(config, path):
+    """ DQN training of the agent only network of RL: ActorLearner acts in the simulator while it learns from the
+        replay buffer in the background. The trained RL.model is saved to path/dqn_model.h5.
+        Checkpoints go to path/checkpoints, and training resumes when LOAD_WEIGHT_DIRECTORY holds a checkpoint. """
+    from actor_learner import ActorLearner
+    from airsim_manager import AirsimManager
+    from logger import Logger
+    from NN_utils import NN_handler
+    from plotting_utils import PlottingUtils
+    from rl import RL
+
+    if not config.AGENT_ONLY:
+        raise ValueError("TRAINING_ALGORITHM \"dqn\" trains the agent only network, set AGENT_ONLY = True")
+    profiler.configure(config)
+    logger = Logger(config)
+    rl = RL(config, logger, AirsimManager(config), NN_handler(config))
+    all_rewards = ActorLearner(config, rl, path).run()
+    rl.model.save_weights(os.path.join(path, "dqn_model.h5"))
+    logger.close()
+    print('Model saved')
+    PlottingUtils.plot_losses(path)
+    PlottingUtils.plot_rewards(all_rewards)
+    PlottingUtils.show_plots()
+    return all_rewards
+
+
+def learn_model_training(config, path):
+    """ PPO training where PPO.learn owns experience collection: every simulator step is used for exactly one
+        rollout. Episode resets (car2 side randomization, collision pause) happen inside the environments and the
+        per-episode bookkeeping in EpisodeTrackingCallback. NUM_ROLLOUT_WORKERS > 1 -> rollouts are collected from
+        parallel simulators and merged. Learning stops after MAX_EPISODES episodes or TOTAL_TIMESTEPS steps.
+        Checkpoints go to path/checkpoints, and training resumes when LOAD_WEIGHT_DIRECTORY holds a checkpoint. """
+    from stable_baselines3 import PPO
+    from stable_baselines3.common.logger import configure
+    from plotting_utils import PlottingUtils
+    from parallel_rollouts import create_rollout_vec_env
+    from ppo_callbacks import EpisodeTrackingCallback, ProfilingCallback, CheckpointCallback, \
+        TrajectoryRecordingCallback
+
+    profiler.configure(config)
+    new_logger = configure(path, ["stdout", "csv", "tensorboard"])
+    env, server_processes = create_rollout_vec_env(config)
+
+    episode_tracking_callback = EpisodeTrackingCallback(config)
+    checkpoint_path = CheckpointManager.latest_checkpoint(config.LOAD_WEIGHT_DIRECTORY)
+    if checkpoint_path is not None:
+        _, checkpoint_state, checkpoint_files = CheckpointManager.load(checkpoint_path)
+        model = PPO.load(io.BytesIO(checkpoint_files["model.zip"]), env=env)
+        model._last_obs = None  # the environments start new episodes, so learn() has to reset them
+        episode_tracking_callback.all_rewards = checkpoint_state["all_rewards"]
+        episode_tracking_callback.collision_counter = checkpoint_state["collision_counter"]
+        print(f"Resumed from {checkpoint_path} at timestep {model.num_timesteps}")
+    else:
+        model = PPO('MlpPolicy', env, verbose=1,
+                    learning_rate=config.LEARNING_RATE,
+                    n_steps=config.N_STEPS,
+                    batch_size=config.BATCH_SIZE)
+    model.set_logger(new_logger)
+
+    callbacks = [episode_tracking_callback, ProfilingCallback()]
+    checkpoint_manager = None
+    if config.CHECKPOINT_EVERY_X_EPISODES > 0:
+        checkpoint_manager = CheckpointManager(os.path.join(path, "checkpoints"), config.CHECKPOINTS_TO_KEEP)
+        callbacks.append(CheckpointCallback(config, checkpoint_manager, episode_tracking_callback))
+    trajectory_recorder = None
+    if config.RECORD_TRAJECTORIES:
+        trajectory_recorder = TrajectoryRecorder(os.path.join(path, "trajectories"), env.observation_space.shape[0])
+        callbacks.append(TrajectoryRecordingCallback(config, trajectory_recorder))
+    model.learn(total_timesteps=config.TOTAL_TIMESTEPS - model.num_timesteps, callback=callbacks,
+                reset_num_timesteps=False)
+    if checkpoint_manager is not None:
+        checkpoint_manager.close()
+    if trajectory_recorder is not None:
+        trajectory_recorder.close()
+
     model.save(path + '/model')
+    export_profile(new_logger, path, model.num_timesteps)
     new_logger.close()
+    env.close()
+    for server_process in server_processes:
+        server_process.terminate()
     print('Model saved')
-    print("Total collisions:", collision_counter)
+    print("Total collisions:", episode_tracking_callback.collision_counter)
     PlottingUtils.plot_losses(path)
-    PlottingUtils.plot_rewards(all_rewards)
+    PlottingUtils.plot_rewards(episode_tracking_callback.all_rewards)
     PlottingUtils.show_plots()
+    return episode_tracking_callback.all_rewards
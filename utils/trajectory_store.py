@@ -0,0 +1,162 @@
+import json
+import os
+
+import numpy as np
+
+META_FILE = "meta.json"
+EPISODE_ENDS_FILE = "episode_ends.bin"
+
+
+def trajectory_columns(state_size):
+    """ column name -> (dtype, shape of one row). The transition columns of the replay buffer, plus whether the
+        step ended in a collision and the squared distance between the cars after it (NaN when not known), so
+        rewards can be recomputed (see RL.calculate_reward) """
+    return {
+        "state": (np.float32, (state_size,)),
+        "action": (np.int64, ()),
+        "reward": (np.float32, ()),
+        "next_state": (np.float32, (state_size,)),
+        "done": (np.bool_, ()),
+        "collision": (np.bool_, ()),
+        "cars_distance": (np.float32, ()),
+    }
+
+
+class TrajectoryRecorder:
+    """ Append-only columnar recording of every transition of an experiment:
+            directory/meta.json - state size
+            directory/<column>.bin - raw rows of one column, e.g. state.bin is (n, state_size) float32
+            directory/episode_ends.bin - int64 exclusive end row of every complete episode
+        Rows are collected in preallocated chunks and appended to the column files in one write per column.
+        An episode only counts once its end is in episode_ends.bin (written last), so rows of an episode cut short
+        by a crash are dropped when the directory is opened again. done is termination (collision / target), an
+        episode truncated by a time limit ends with done = False. Read back with TrajectoryStore. """
+
+    def __init__(self, directory, state_size, chunk_size=4096):
+        self.directory = directory
+        self.columns = trajectory_columns(state_size)
+        os.makedirs(directory, exist_ok=True)
+        meta = {"state_size": state_size, "columns": list(self.columns)}
+        if os.path.exists(os.path.join(directory, META_FILE)):
+            with open(os.path.join(directory, META_FILE)) as meta_file:
+                if json.load(meta_file) != meta:
+                    raise ValueError(f"{directory} holds trajectories of another state size or columns")
+        else:
+            with open(os.path.join(directory, META_FILE), "w") as meta_file:
+                json.dump(meta, meta_file)
+
+        self.size = self.drop_incomplete_episode()
+        self.last_episode_end = self.size
+        self.chunk = {name: np.empty((chunk_size,) + shape, dtype=dtype)
+                      for name, (dtype, shape) in self.columns.items()}
+        self.chunk_rows = 0
+        self.column_files = {name: open(os.path.join(directory, f"{name}.bin"), "ab") for name in self.columns}
+        self.episode_ends_file = open(os.path.join(directory, EPISODE_ENDS_FILE), "ab")
+
+    def drop_incomplete_episode(self):
+        """ Truncate every column to the end of the last complete episode. returns: number of recorded rows """
+        episode_ends_path = os.path.join(self.directory, EPISODE_ENDS_FILE)
+        episode_ends = np.fromfile(episode_ends_path, dtype=np.int64) if os.path.exists(episode_ends_path) else []
+        size = int(episode_ends[-1]) if len(episode_ends) else 0
+        for name, (dtype, shape) in self.columns.items():
+            column_path = os.path.join(self.directory, f"{name}.bin")
+            if os.path.exists(column_path):
+                os.truncate(column_path, size * np.dtype(dtype).itemsize * int(np.prod(shape)))
+        return size
+
+    def append(self, state, action, reward, next_state, done, collision=False, cars_distance=np.nan):
+        chunk_row = self.chunk_rows
+        self.chunk["state"][chunk_row] = state
+        self.chunk["action"][chunk_row] = action
+        self.chunk["reward"][chunk_row] = reward
+        self.chunk["next_state"][chunk_row] = next_state
+        self.chunk["done"][chunk_row] = done
+        self.chunk["collision"][chunk_row] = collision
+        self.chunk["cars_distance"][chunk_row] = cars_distance
+        self.chunk_rows += 1
+        if self.chunk_rows == len(self.chunk["state"]):
+            self.write_chunk()
+
+    def append_episode(self, states, actions, rewards, next_states, dones, collisions, cars_distances=None):
+        """ A whole episode at once (arrays with one row per step) """
+        self.write_chunk()
+        if cars_distances is None:
+            cars_distances = np.full(len(actions), np.nan)
+        for name, rows in zip(self.columns, [states, actions, rewards, next_states, dones, collisions,
+                                             cars_distances]):
+            dtype, shape = self.columns[name]
+            self.column_files[name].write(np.ascontiguousarray(rows, dtype=dtype).reshape((-1,) + shape).tobytes())
+        self.size += len(actions)
+        self.end_episode()
+
+    def write_chunk(self):
+        if self.chunk_rows == 0:
+            return
+        for name, column_file in self.column_files.items():
+            column_file.write(self.chunk[name][:self.chunk_rows].tobytes())
+        self.size += self.chunk_rows
+        self.chunk_rows = 0
+
+    def end_episode(self):
+        self.write_chunk()
+        if self.size == self.last_episode_end:
+            return  # no steps since the last episode
+        self.last_episode_end = self.size
+        for column_file in self.column_files.values():
+            column_file.flush()
+        self.episode_ends_file.write(np.int64(self.size).tobytes())
+        self.episode_ends_file.flush()
+
+    def close(self):
+        """ Rows of an unfinished episode are not kept """
+        for column_file in self.column_files.values():
+            column_file.close()
+        self.episode_ends_file.close()
+
+
+class TrajectoryStore:
+    """ Read-only, zero-copy view of a TrajectoryRecorder directory: every column is a memory-mapped array, so
+        millions of steps are only paged in as they are read.
+            store = TrajectoryStore("experiments/<run>/trajectories")
+            store.reward[store.done].mean()
+            states, actions, rewards, next_states, dones = store.episode(3) """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META_FILE)) as meta_file:
+            self.state_size = json.load(meta_file)["state_size"]
+        self.episode_ends = np.fromfile(os.path.join(directory, EPISODE_ENDS_FILE), dtype=np.int64)
+        self.episode_starts = np.concatenate([[0], self.episode_ends[:-1]]).astype(np.int64)
+        self.size = int(self.episode_ends[-1]) if len(self.episode_ends) else 0
+        for name, (dtype, shape) in trajectory_columns(self.state_size).items():
+            if self.size == 0:
+                column = np.empty((0,) + shape, dtype=dtype)
+            else:
+                # rows past the last episode end (an episode being recorded) are not mapped
+                column = np.memmap(os.path.join(directory, f"{name}.bin"), dtype=dtype, mode="r",
+                                   shape=(self.size,) + shape)
+            setattr(self, name, column)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def n_episodes(self):
+        return len(self.episode_ends)
+
+    def transitions(self, rows=slice(None)):
+        """ returns: states, actions, rewards, next_states, dones of the given rows (views for a slice) """
+        return self.state[rows], self.action[rows], self.reward[rows], self.next_state[rows], self.done[rows]
+
+    def episode(self, episode_index):
+        return self.transitions(slice(self.episode_starts[episode_index], self.episode_ends[episode_index]))
+
+    def episode_indices(self):
+        """ returns: episode index of every row """
+        return np.repeat(np.arange(self.n_episodes), self.episode_ends - self.episode_starts)
+
+    def episode_rewards(self):
+        """ returns: sum of rewards of every episode """
+        if self.size == 0:
+            return np.zeros(0)
+        return np.add.reduceat(self.reward.astype(np.float64), self.episode_starts)